@@ -1,15 +1,26 @@
+# PYTHON_ARGCOMPLETE_OK
 import argparse
-import argcomplete
+import os
 import sys
 
-from . import tools
-from .log import setup_logger
-from .migration import Migration
+# Only the configuration is imported to build the parser: the migration
+# and its dependencies are imported once the arguments are parsed, so
+# that --help and the completion stay fast.
+from .config import (
+    _AVAILABLE_MIGRATION_STEPS,
+    _SERVER_HOST,
+    _SERVER_PORT,
+    _SERVER_TOKEN_HEADER,
+)
 
 
 def get_parser():
 
-    main_parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
+    main_parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog="Run '%(prog)s serve --help' to run a local migration server,"
+        " or '%(prog)s batch --help' to migrate several repositories.",
+    )
 
     main_parser.add_argument(
         "-d",
@@ -35,7 +46,7 @@ def get_parser():
     main_parser.add_argument(
         "-i",
         "--init-version-name",
-        choices=tools._get_available_init_version_names(),
+        choices=[x["init_version_name"] for x in _AVAILABLE_MIGRATION_STEPS],
         dest="init_version_name",
         required=True,
         type=str,
@@ -46,8 +57,8 @@ def get_parser():
         "--target-version-name",
         dest="target_version_name",
         type=str,
-        choices=tools._get_available_target_version_names(),
-        default=tools._get_latest_version_name(),
+        choices=[x["target_version_name"] for x in _AVAILABLE_MIGRATION_STEPS],
+        default=_AVAILABLE_MIGRATION_STEPS[-1]["target_version_name"],
         help="Target version of the Odoo module you want to migrate."
         " If 'latest' is set, the tool will try to migrate to the latest"
         " Odoo version.",
@@ -113,17 +124,376 @@ def get_parser():
         help="Skip removing migration folder",
     )
 
+    # TODO: Move to `argparse.BooleanOptionalAction` once in Python 3.9+
+    main_parser.add_argument(
+        "-npl",
+        "--no-pipeline",
+        dest="pipeline",
+        action="store_false",
+        help="Disable the in-memory pipeline: each migration script reads"
+        " and writes the files on the disk.",
+    )
+
+    main_parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        default=1,
+        type=int,
+        help="Number of modules migrated in parallel, in separate processes."
+        " The changes are still committed one module after another.",
+    )
+
+    main_parser.add_argument(
+        "-fj",
+        "--file-jobs",
+        dest="file_jobs",
+        default=1,
+        type=int,
+        help="Number of files of a module processed in parallel, in separate"
+        " threads. Useful for modules with many files. The global functions"
+        " of the migration scripts that don't change the same kinds of files"
+        " are also run in parallel.",
+    )
+
+    main_parser.add_argument(
+        "-inc",
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Enable this option to skip the files unchanged since their last"
+        " migration. The content hashes are stored in the"
+        " '.odoo_module_upgrade_cache' folder of the directory.",
+    )
+
+    main_parser.add_argument(
+        "-dr",
+        "--dry-run",
+        dest="dry_run",
+        nargs="?",
+        const="-",
+        default=False,
+        metavar="PATCH_FILE",
+        help="Preview the migration without changing the files nor committing:"
+        " the changes are written as a patch in PATCH_FILE, or on the standard"
+        " output if no file is given.",
+    )
+
+    main_parser.add_argument(
+        "--fsync",
+        action="store_true",
+        default=False,
+        help="Enable this option to flush the written files to the disk,"
+        " once per module, before replacing the original files.",
+    )
+
+    # TODO: Move to `argparse.BooleanOptionalAction` once in Python 3.9+
+    main_parser.add_argument(
+        "-nff",
+        "--no-file-filter",
+        dest="file_filter",
+        action="store_false",
+        help="Process all the files of the modules. By default, the ignored"
+        " files (.gitignore, .odoo-upgrade-ignore), the vendored libraries"
+        " (static/lib, node_modules, ...), the minified javascript files and"
+        " the files bigger than --max-file-size are not migrated: they are"
+        " counted in the summary logged for each module.",
+    )
+
+    main_parser.add_argument(
+        "-mfs",
+        "--max-file-size",
+        dest="max_file_sizes",
+        action="append",
+        type=_max_file_size,
+        metavar="EXTENSION=KIB",
+        help="Skip the files of the extension bigger than this size, in KiB."
+        " 0 disables the ceiling of the extension. Can be repeated."
+        " (Default: no ceiling. Example: .xml=4096)",
+    )
+
+    main_parser.add_argument(
+        "-fu",
+        "--fused",
+        action="store_true",
+        default=False,
+        help="Enable this option to process the files once for all the"
+        " consecutive migration scripts, instead of once per script. A"
+        " script whose global functions or deprecated modules access the"
+        " kinds of files the rules of the next script apply on still ends"
+        " the pass: the rules generated for renamed or removed models and"
+        " fields apply on any file. The result is the same.",
+    )
+
+    # TODO: Move to `argparse.BooleanOptionalAction` once in Python 3.9+
+    main_parser.add_argument(
+        "-nj",
+        "--no-journal",
+        dest="journal",
+        action="store_false",
+        help="Don't keep the journal of the run, in the"
+        " '.odoo_module_upgrade_cache' folder of the directory.",
+    )
+
+    main_parser.add_argument(
+        "-re",
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Enable this option to resume the previous run, if it was"
+        " interrupted: the modules it migrated are skipped, and the files of"
+        " the module it was migrating are rolled back before migrating it"
+        " again.",
+    )
+
+    main_parser.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        default=False,
+        help="Enable this option to keep watching the modules once migrated:"
+        " the files changed on the disk are migrated again at once, without"
+        " committing them.",
+    )
+
     return main_parser
 
 
+def get_serve_parser():
+
+    serve_parser = argparse.ArgumentParser(
+        prog="odoo-module-upgrade serve",
+        description="Run a local server, migrating the modules of the jobs"
+        " posted on /jobs, and streaming their progress and logs on"
+        " /jobs/<id>/events (Server-Sent Events).",
+    )
+
+    serve_parser.add_argument(
+        "-H",
+        "--host",
+        dest="host",
+        default=_SERVER_HOST,
+        type=str,
+    )
+
+    serve_parser.add_argument(
+        "-p",
+        "--port",
+        dest="port",
+        default=_SERVER_PORT,
+        type=int,
+    )
+
+    serve_parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        default=1,
+        type=int,
+        help="Number of jobs run in parallel, in separate processes. The jobs"
+        " of the same directory are run one after another.",
+    )
+
+    serve_parser.add_argument(
+        "-co",
+        "--cors-origin",
+        dest="cors_origin",
+        default=None,
+        type=str,
+        help="Origin allowed to call the server from a browser, like the one"
+        " of a dashboard. (Default: none)",
+    )
+
+    serve_parser.add_argument(
+        "-tk",
+        "--token",
+        dest="token",
+        default=None,
+        type=str,
+        help="Token the requests must carry in the "
+        + _SERVER_TOKEN_HEADER
+        + " header. (Default: a random token, printed at startup)",
+    )
+
+    serve_parser.add_argument(
+        "-ll",
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        dest="log_level",
+        default="INFO",
+        type=str,
+    )
+
+    serve_parser.add_argument(
+        "-lp",
+        "--log-path",
+        dest="log_path",
+        default=False,
+        type=str,
+    )
+
+    return serve_parser
+
+
+def run_server(args):
+    args = get_serve_parser().parse_args(args)
+    if args.workers < 1:
+        sys.exit("The number of workers must be at least 1")
+
+    from .log import setup_logger
+    from .server import serve
+
+    setup_logger(args.log_level, args.log_path)
+    serve(args.host, args.port, args.workers, args.cors_origin, args.token)
+
+
+def get_batch_parser():
+
+    batch_parser = argparse.ArgumentParser(
+        prog="odoo-module-upgrade batch",
+        description="Migrate the repositories listed in a YAML file, in a pool"
+        " of processes. The state of the jobs is kept, so that a batch run"
+        " again only migrates the repositories not migrated yet.",
+    )
+
+    batch_parser.add_argument(
+        "file_path",
+        metavar="BATCH_FILE",
+        type=str,
+        help="YAML file listing the repositories, with the options of their"
+        " migration:\n"
+        "defaults: {init_version_name: '16.0', pre_commit: false}\n"
+        "repositories: [{directory: ../web}, {directory: ../crm}]",
+    )
+
+    batch_parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        default=1,
+        type=int,
+        help="Number of repositories migrated in parallel, in separate"
+        " processes.",
+    )
+
+    batch_parser.add_argument(
+        "-q",
+        "--queue",
+        dest="queue_path",
+        default=None,
+        type=str,
+        help="SQLite database keeping the state of the jobs. (Default: the"
+        " batch file, with the .sqlite extension)",
+    )
+
+    batch_parser.add_argument(
+        "-r",
+        "--retries",
+        dest="retries",
+        default=0,
+        type=int,
+        help="Number of times a failed migration is retried.",
+    )
+
+    batch_parser.add_argument(
+        "-rf",
+        "--retry-failed",
+        action="store_true",
+        default=False,
+        help="Enable this option to migrate again the repositories failed in"
+        " the previous runs.",
+    )
+
+    batch_parser.add_argument(
+        "-ll",
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        dest="log_level",
+        default="INFO",
+        type=str,
+    )
+
+    batch_parser.add_argument(
+        "-lp",
+        "--log-path",
+        dest="log_path",
+        default=False,
+        type=str,
+    )
+
+    return batch_parser
+
+
+def run_batch(args):
+    args = get_batch_parser().parse_args(args)
+
+    from .batch import Batch
+    from .log import setup_logger
+
+    setup_logger(args.log_level, args.log_path)
+    try:
+        batch = Batch(
+            args.file_path,
+            args.queue_path,
+            args.workers,
+            args.retries,
+            args.retry_failed,
+        )
+        if not batch.run():
+            sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+def _max_file_size(value):
+    extension, __, size = value.partition("=")
+    extension = extension.strip()
+    try:
+        size = int(size)
+    except ValueError:
+        size = -1
+    if not extension or size < 0:
+        raise argparse.ArgumentTypeError(
+            "'%s' is not a valid EXTENSION=KIB value" % value
+        )
+    if not extension.startswith("."):
+        extension = "." + extension
+    return extension, size * 1024
+
+
 def main(args=False):
+    # The server and the batches have their own arguments
+    argv = args or sys.argv[1:]
+    if argv[:1] == ["serve"]:
+        run_server(argv[1:])
+        return
+    if argv[:1] == ["batch"]:
+        run_batch(argv[1:])
+        return
+
     # Parse Arguments
     parser = get_parser()
-    argcomplete.autocomplete(parser, always_complete_options=False)
+    if "_ARGCOMPLETE" in os.environ:
+        import argcomplete
+
+        argcomplete.autocomplete(parser, always_complete_options=False)
     if args:
         args = parser.parse_args(args)
     else:
         args = parser.parse_args()
+    if args.watch and (args.dry_run or not args.pipeline):
+        parser.error(
+            "the watch mode can not be used with the dry-run mode, nor"
+            " without the pipeline"
+        )
+    if args.resume and (args.dry_run or not args.journal):
+        parser.error(
+            "the resume option can not be used with the dry-run mode, nor"
+            " without journal"
+        )
+
+    from .log import setup_logger
+    from .migration import Migration
 
     # Set log level
     setup_logger(args.log_level, args.log_path)
@@ -146,11 +516,25 @@ def main(args=False):
             not args.no_commit,
             args.pre_commit,
             args.remove_migration_folder,
+            args.pipeline,
+            args.jobs,
+            args.file_jobs,
+            args.incremental,
+            args.dry_run,
+            args.fsync,
+            args.file_filter,
+            dict(args.max_file_sizes or []),
+            args.fused,
+            args.journal,
+            args.resume,
         )
 
         # run Migration
         migration.run()
 
+        if args.watch:
+            migration.watch()
+
     except KeyboardInterrupt:
         pass
 
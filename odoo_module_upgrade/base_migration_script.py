@@ -1,6 +1,6 @@
+import csv
 import os
 from .config import _ALLOWED_EXTENSIONS
-from .tools import _execute_shell
 from .log import logger
 from . import tools
 import re
@@ -8,9 +8,19 @@ import pathlib
 import traceback
 import inspect
 import glob
-import yaml
 import importlib
 
+from .csv_migration import CsvPlan, CsvStage, migrate_csv_file
+from .function_graph import ANY, MANIFEST, get_reading_functions, overlap
+from .rule_set import RulePlan, RuleSet
+
+# {script_class: RuleSet}
+_RULE_SETS = {}
+# {(script_class, extension): RulePlan}
+_RULE_PLANS = {}
+# {script_class: CsvPlan}
+_CSV_PLANS = {}
+
 
 class BaseMigrationScript(object):
     _TEXT_REPLACES = {}
@@ -24,8 +34,15 @@ class BaseMigrationScript(object):
     _REMOVED_MODELS = []
     _GLOBAL_FUNCTIONS = []  # [function_object]
     _module_path = ""
+    # ScriptEntry of the script in the registry, if loaded from it (see
+    # script_registry.py)
+    _script_entry = None
 
     def parse_rules(self):
+        """Read the rules of the script (class attributes, yaml files and
+        python_scripts) and return them as a dict {rule_name: rules}.
+        The yaml files and python_scripts are the ones of the registry, or
+        found next to the script if it's not loaded from the registry."""
         script_parts = inspect.getfile(self.__class__).split("/")
         migrate_from_to = script_parts[-1].split(".")[0]
         migration_scripts_dir = "/".join(script_parts[:-1])
@@ -88,7 +105,14 @@ class BaseMigrationScript(object):
                 rule_folder,
                 migrate_from_to,
             )
-            for filename in glob.glob(file_pattern):
+            if self._script_entry is not None:
+                file_paths = self._script_entry.rule_files.get(rule_folder, ())
+            else:
+                file_paths = glob.glob(file_pattern)
+            for filename in file_paths:
+                # Imported on first use, most of the scripts have no rule file
+                import yaml
+
                 with open(filename) as f:
                     new_rules = yaml.safe_load(f)
                     if rules[rule]["type"] == TYPE_DICT_OF_DICT:
@@ -100,41 +124,145 @@ class BaseMigrationScript(object):
                         rules[rule]["doc"].update(new_rules)
                     elif rules[rule]["type"] == TYPE_ARRAY:
                         rules[rule]["doc"].extend(new_rules)
-        # extend
+        # extend the rules declared on the class, without altering them
         for rule, data in rules.items():
             rtype = data["type"]
-            doc = data.get("doc")
-            if not doc:
-                continue
-
-            rvalues = getattr(self, rule)
+            class_values = getattr(self, rule)
             if rtype == TYPE_ARRAY:
-                rvalues.extend(doc)
+                data["doc"] = list(class_values) + data["doc"]
             elif rtype == TYPE_DICT:
-                rvalues.update(doc)
+                data["doc"] = dict(class_values, **data["doc"])
             else:
                 # TYPE_DICT_OF_DICT
-                for filetype, values in doc.items():
-                    rvalues.setdefault(filetype, {})
-                    rvalues[filetype].update(values or {})
+                doc = {
+                    filetype: dict(values or {})
+                    for filetype, values in class_values.items()
+                }
+                for filetype, values in data["doc"].items():
+                    doc.setdefault(filetype, {})
+                    doc[filetype].update(values or {})
+                data["doc"] = doc
+        res = {rule: data["doc"] for rule, data in rules.items()}
 
-        file_pattern = "%s/python_scripts/%s/*.py" % (
-            migration_scripts_dir,
-            migrate_from_to,
-        )
-        for path in glob.glob(file_pattern):
-            module_name = path.split("/")[-1].split(".")[0]
-            module_name = ".".join(
-                [
-                    "odoo_module_upgrade.upgrade_scripts.python_scripts",
-                    migrate_from_to,
-                    module_name,
-                ]
+        global_functions = list(self._GLOBAL_FUNCTIONS)
+        if self._script_entry is not None:
+            module_names = self._script_entry.python_scripts
+        else:
+            file_pattern = "%s/python_scripts/%s/*.py" % (
+                migration_scripts_dir,
+                migrate_from_to,
             )
+            module_names = [
+                ".".join(
+                    [
+                        "odoo_module_upgrade.upgrade_scripts.python_scripts",
+                        migrate_from_to,
+                        path.split("/")[-1].split(".")[0],
+                    ]
+                )
+                for path in glob.glob(file_pattern)
+            ]
+        for module_name in module_names:
             module = importlib.import_module(module_name)
             for name, value in inspect.getmembers(module, inspect.isfunction):
-                if not name.startswith("_"):
-                    self._GLOBAL_FUNCTIONS.append(value)
+                # Skip the imported functions (file_access(), ...)
+                if not name.startswith("_") and value.__module__ == module_name:
+                    global_functions.append(value)
+        res["_GLOBAL_FUNCTIONS"] = global_functions
+        return res
+
+    def get_rule_set(self):
+        """Return the RuleSet of the script. The rules are read and compiled
+        only once per process, and shared by all the migrated modules."""
+        rule_set = _RULE_SETS.get(self.__class__)
+        if rule_set is None:
+            rule_set = _RULE_SETS[self.__class__] = RuleSet.from_rules(
+                self.parse_rules()
+            )
+        return rule_set
+
+    def get_rule_plan(self, extension):
+        """Return the RulePlan of the script for the given file extension:
+        text rules of the RuleSet merged with the rules generated for the
+        removed / renamed fields and models. The plan is built once per
+        script and extension, and shared by all the processed files."""
+        key = (self.__class__, extension)
+        rule_plan = _RULE_PLANS.get(key)
+        if rule_plan is not None:
+            return rule_plan
+
+        rule_set = self.get_rule_set()
+        removed_fields = self.handle_removed_fields(rule_set.removed_fields)
+        renamed_fields = self.handle_renamed_fields(rule_set.renamed_fields)
+        renamed_models = self.handle_renamed_models(rule_set.renamed_models)
+        removed_models = self.handle_removed_models(rule_set.removed_models)
+
+        replaces = dict(rule_set.text_replaces.get("*", ()))
+        replaces.update(rule_set.text_replaces.get(extension, ()))
+        replaces.update(renamed_models.get("replaces"))
+        replaces.update(removed_models.get("replaces"))
+
+        errors = dict(rule_set.text_errors.get("*", ()))
+        errors.update(rule_set.text_errors.get(extension, ()))
+        errors.update(renamed_models.get("errors"))
+        errors.update(removed_models.get("errors"))
+
+        warnings = dict(rule_set.text_warnings.get("*", ()))
+        warnings.update(rule_set.text_warnings.get(extension, ()))
+        warnings.update(removed_fields.get("warnings"))
+        warnings.update(renamed_fields.get("warnings"))
+        warnings.update(renamed_models.get("warnings"))
+        warnings.update(removed_models.get("warnings"))
+
+        rule_plan = _RULE_PLANS[key] = RulePlan.from_dicts(
+            replaces, errors, warnings
+        )
+        return rule_plan
+
+    def get_csv_plan(self):
+        """Return the CsvPlan of the script, built once per script"""
+        csv_plan = _CSV_PLANS.get(self.__class__)
+        if csv_plan is None:
+            csv_plan = _CSV_PLANS[self.__class__] = CsvPlan.from_rule_set(
+                self.get_rule_set(), self.get_rule_plan(".csv")
+            )
+        return csv_plan
+
+    def get_file_kinds(self):
+        """Return the kinds of files changed, scanned or renamed by the rules
+        of the script applied on each file (see function_graph.py). The rules
+        generated for the removed / renamed fields and models apply on any
+        file."""
+        rule_set = self.get_rule_set()
+        if (
+            rule_set.removed_fields
+            or rule_set.renamed_fields
+            or rule_set.renamed_models
+            or rule_set.removed_models
+        ):
+            return frozenset([ANY])
+        kinds = set()
+        for rules in (
+            rule_set.text_replaces,
+            rule_set.text_errors,
+            rule_set.text_warnings,
+        ):
+            kinds.update(kind for kind, values in rules.items() if values)
+        for old_name, new_name in rule_set.file_renames.items():
+            kinds.add(os.path.splitext(old_name)[1])
+            kinds.add(os.path.splitext(new_name)[1])
+        return frozenset([ANY]) if ANY in kinds else frozenset(kinds)
+
+    def can_fuse(self, next_script):
+        """Return True if the files of the next script can be processed in the
+        same pass as the files of this script, before its module functions:
+        they don't read or write the kinds of files the rules of the next
+        script apply on, so the result is the same."""
+        rule_set = self.get_rule_set()
+        kinds = next_script.get_file_kinds()
+        if rule_set.deprecated_modules and overlap([MANIFEST], kinds):
+            return False
+        return not get_reading_functions(rule_set.global_functions, kinds)
 
     def run(
         self,
@@ -144,33 +272,52 @@ class BaseMigrationScript(object):
         migration_steps,
         directory_path,
         commit_enabled,
+        fused_scripts=(),
     ):
-        logger.debug(
-            "Running %s script" % inspect.getfile(self.__class__).split("/")[-1]
-        )
-        self.parse_rules()
-        manifest_path = self._get_correct_manifest_path(
-            manifest_path, self._FILE_RENAMES
-        )
-        for root, directories, filenames in os.walk(module_path.resolve()):
+        """Migrate the module.
+
+        fused_scripts: previous scripts whose rules are applied in the same
+        pass on the files, before the rules of this script (see
+        process_file()). Their module functions are run after the pass, in
+        the order of the scripts (see can_fuse()).
+        """
+        for script in list(fused_scripts) + [self]:
+            logger.debug(
+                "Running %s script" % inspect.getfile(script.__class__).split("/")[-1]
+            )
+            manifest_path = self._get_correct_manifest_path(
+                manifest_path, script.get_rule_set().file_renames
+            )
+        rule_set = self.get_rule_set()
+        file_paths = []
+        for root, directories, filenames in tools._walk(module_path.resolve()):
             for filename in filenames:
                 extension = os.path.splitext(filename)[1]
                 if extension not in _ALLOWED_EXTENSIONS:
                     continue
-                self.process_file(
-                    root,
-                    filename,
-                    extension,
-                    self._FILE_RENAMES,
-                    directory_path,
-                    commit_enabled,
-                )
+                file_paths.append(os.path.join(root, filename))
+        tools._map_files(
+            lambda file_path: self.process_file(
+                os.path.dirname(file_path),
+                os.path.basename(file_path),
+                os.path.splitext(file_path)[1],
+                rule_set.file_renames,
+                directory_path,
+                commit_enabled,
+                fused_scripts,
+            ),
+            file_paths,
+        )
 
-        self.handle_deprecated_modules(manifest_path, self._DEPRECATED_MODULES)
+        for script in list(fused_scripts) + [self]:
+            script_rule_set = script.get_rule_set()
+            script.handle_deprecated_modules(
+                manifest_path, script_rule_set.deprecated_modules
+            )
 
-        if self._GLOBAL_FUNCTIONS:
-            for function in self._GLOBAL_FUNCTIONS:
-                function(
+            if script_rule_set.global_functions:
+                tools._run_functions(
+                    script_rule_set.global_functions,
                     logger=logger,
                     module_path=module_path,
                     module_name=module_name,
@@ -180,16 +327,52 @@ class BaseMigrationScript(object):
                 )
 
     def process_file(
-        self, root, filename, extension, file_renames, directory_path, commit_enabled
+        self,
+        root,
+        filename,
+        extension,
+        file_renames,
+        directory_path,
+        commit_enabled,
+        fused_scripts=(),
     ):
-        # Skip useless file
-        # TODO, skip files present in some folders. (for exemple 'lib')
+        # The files present in some folders (for exemple 'lib') are not
+        # listed by the workspace (see file_filter.py)
         absolute_file_path = os.path.join(root, filename)
         logger.debug("Migrate '%s' file" % absolute_file_path)
 
-        # Rename file, if required
-        new_name = file_renames.get(filename)
-        if new_name:
+        # Name of the file before each script, as if they were run one after
+        # another: a script doesn't process the file if its new extension
+        # is not allowed anymore.
+        scripts = []
+        file_names = [filename]
+        for script in list(fused_scripts) + [self]:
+            if os.path.splitext(file_names[-1])[1] not in _ALLOWED_EXTENSIONS:
+                break
+            renames = (
+                file_renames if script is self else script.get_rule_set().file_renames
+            )
+            scripts.append(script)
+            file_names.append(renames.get(file_names[-1], file_names[-1]))
+
+        # The file is not read if the rules of the scripts can not match its
+        # content: none of their literals is in its bytes (see
+        # tools._may_contain())
+        literals = set()
+        for script, file_name in zip(scripts, file_names):
+            rule_plan = script.get_rule_plan(os.path.splitext(file_name)[1])
+            if literals is not None and rule_plan.literals is not None:
+                literals.update(rule_plan.literals)
+            else:
+                literals = None
+        is_unmatched = literals is not None and not tools._may_contain(
+            absolute_file_path, literals
+        )
+
+        # Rename file, if required. The renames of the fused scripts are done
+        # at once: A -> B -> C becomes A -> C
+        new_name = file_names[-1]
+        if new_name != filename:
             self._rename_file(
                 directory_path,
                 absolute_file_path,
@@ -198,40 +381,70 @@ class BaseMigrationScript(object):
             )
             absolute_file_path = os.path.join(root, new_name)
 
-        removed_fields = self.handle_removed_fields(self._REMOVED_FIELDS)
-        renamed_fields = self.handle_renamed_fields(self._RENAMED_FIELDS)
-        renamed_models = self.handle_renamed_models(self._RENAMED_MODELS)
-        removed_models = self.handle_removed_models(self._REMOVED_MODELS)
+        # The CSV files are migrated column by column, streaming their rows
+        if all(os.path.splitext(x)[1] == ".csv" for x in file_names):
+            try:
+                self._process_csv_file(absolute_file_path, root, scripts, file_names)
+                return
+            except csv.Error as e:
+                logger.warning(
+                    "Unable to read %s as a CSV file (%s), migrating its text"
+                    % (absolute_file_path, e)
+                )
+
+        if is_unmatched:
+            return
 
-        # Operate changes in the file (replacements, removals)
-        replaces = self._TEXT_REPLACES.get("*", {})
-        replaces.update(self._TEXT_REPLACES.get(extension, {}))
-        replaces.update(renamed_models.get("replaces"))
-        replaces.update(removed_models.get("replaces"))
+        # Operate changes in the file (replacements, removals), the file
+        # being read and written once for all the fused scripts
+        current_text = tools._read_content(absolute_file_path)
+        new_text = current_text
+        for script, file_name in zip(scripts, file_names):
+            rule_plan = script.get_rule_plan(os.path.splitext(file_name)[1])
+            text = rule_plan.replace(new_text)
+            if text != new_text:
+                logger.info("Change file content of %s" % file_name)
+                new_text = text
 
-        new_text = tools._replace_in_file(
-            absolute_file_path, replaces, "Change file content of %s" % filename
-        )
+            # Display errors and warnings if the new content contains some
+            # obsolete pattern, with the position of the occurrences
+            script._log_findings(
+                os.path.join(root, file_name), rule_plan.scan(new_text)
+            )
+        if new_text != current_text:
+            tools._write_content(absolute_file_path, new_text)
 
-        # Display errors if the new content contains some obsolete
-        # pattern
-        errors = self._TEXT_ERRORS.get("*", {})
-        errors.update(self._TEXT_ERRORS.get(extension, {}))
-        errors.update(renamed_models.get("errors"))
-        errors.update(removed_models.get("errors"))
-        for pattern, error_message in errors.items():
-            if re.findall(pattern, new_text):
-                logger.error(error_message + "\nFile " + os.path.join(root, filename))
+    def _process_csv_file(self, file_path, root, scripts, file_names):
+        stages = [
+            CsvStage(script.get_csv_plan(), file_name)
+            for script, file_name in zip(scripts, file_names)
+        ]
+        migrate_csv_file(file_path, stages)
+        for script, file_name, stage in zip(scripts, file_names, stages):
+            if stage.changed:
+                logger.info("Change file content of %s" % file_name)
+            script._log_findings(os.path.join(root, file_name), stage.findings)
 
-        warnings = self._TEXT_WARNINGS.get("*", {})
-        warnings.update(self._TEXT_WARNINGS.get(extension, {}))
-        warnings.update(removed_fields.get("warnings"))
-        warnings.update(renamed_fields.get("warnings"))
-        warnings.update(renamed_models.get("warnings"))
-        warnings.update(removed_models.get("warnings"))
-        for pattern, warning_message in warnings.items():
-            if re.findall(pattern, new_text):
-                logger.warning(warning_message + ". File " + root + os.sep + filename)
+    def _log_findings(self, file_path, findings):
+        findings_by_rule = {}
+        for finding in findings:
+            key = (finding.severity != "error", finding.rule_id)
+            findings_by_rule.setdefault(key, []).append(finding)
+        for (is_warning, __), rule_findings in sorted(
+            findings_by_rule.items(), key=lambda x: x[0][0]
+        ):
+            first = rule_findings[0]
+            position = "%s:%d:%d" % (file_path, first.line, first.column)
+            if len(rule_findings) > 1:
+                position += " (%d occurrences, lines %s)" % (
+                    len(rule_findings),
+                    ", ".join(str(x.line) for x in rule_findings[:10])
+                    + (", ..." if len(rule_findings) > 10 else ""),
+                )
+            if is_warning:
+                logger.warning(first.message + ". File " + position)
+            else:
+                logger.error(first.message + "\nFile " + position)
 
     def handle_removed_fields(self, removed_fields):
         """Give warnings if field_name is found on the code. To minimize two
@@ -434,25 +647,19 @@ class BaseMigrationScript(object):
 
     def _rename_file(self, module_path, old_file_path, new_file_path, commit_enabled):
         """
-        Rename a file. try to execute 'git mv', to avoid huge diff.
-
-        if 'git mv' fails, make a classical rename
+        Rename a file. In pipeline mode, the rename is planned, and done with
+        the other ones of the module (see Workspace.flush()). With commits,
+        the renames are staged by the commit of the module.
         """
-        logger.info(
-            "Renaming file: '%s' by '%s' "
-            % (
-                old_file_path.replace(str(module_path.resolve()), ""),
-                new_file_path.replace(str(module_path.resolve()), ""),
-            )
+        message = "Renaming file: '%s' by '%s' " % (
+            old_file_path.replace(str(module_path.resolve()), ""),
+            new_file_path.replace(str(module_path.resolve()), ""),
         )
+        if tools._has_rename_plan():
+            logger.debug(message)
+        else:
+            logger.info(message)
         try:
-            if commit_enabled:
-                _execute_shell(
-                    "git mv %s %s" % (old_file_path, new_file_path), path=module_path
-                )
-            else:
-                _execute_shell(
-                    "mv %s %s" % (old_file_path, new_file_path), path=module_path
-                )
+            tools._rename(old_file_path, new_file_path)
         except BaseException:
             logger.error(traceback.format_exc())
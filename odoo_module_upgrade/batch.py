@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import time
+
+from .exception import ConfigException
+from .job_pool import END_STATES, JobPool, parse_job_options
+from .log import logger
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    name TEXT PRIMARY KEY,
+    options TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    module_count INTEGER NOT NULL DEFAULT 0,
+    started REAL,
+    ended REAL
+)
+"""
+
+
+def read_batch_file(file_path):
+    """Return the [(name, options)] of the repositories of a batch file:
+
+        defaults:                     # Options of all the repositories
+          init_version_name: "16.0"
+          pre_commit: false
+        repositories:
+          - directory: ../web         # Relative to the batch file
+          - directory: ../server-tools
+            name: server-tools-user   # Default: the directory
+            modules: [base_technical_user]
+
+    The options are the ones of the jobs of the server (see
+    job_pool.parse_job_options()), except dry_run.
+    """
+    # Imported on first use, as the other commands don't need it
+    import yaml
+
+    with open(file_path, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f) or {}
+    if (
+        not isinstance(data, dict)
+        or not isinstance(data.get("repositories"), list)
+        or not data["repositories"]
+    ):
+        raise ConfigException("%s has no list of repositories" % file_path)
+    defaults = data.get("defaults") or {}
+    base_path = os.path.dirname(os.path.abspath(file_path))
+    res = []
+    names = set()
+    for repository in data["repositories"]:
+        if not isinstance(repository, dict) or not repository.get("directory"):
+            raise ConfigException(
+                "Each repository of %s must have a directory" % file_path
+            )
+        job_data = dict(defaults, **repository)
+        job_data["directory"] = os.path.join(
+            base_path, os.path.expanduser(str(job_data["directory"]))
+        )
+        name = str(job_data.pop("name", None) or repository["directory"])
+        # Versions written without quotes are read as numbers
+        for key in ("init_version_name", "target_version_name"):
+            if isinstance(job_data.get(key), float):
+                job_data[key] = str(job_data[key])
+        if job_data.get("dry_run"):
+            raise ConfigException("The batches can not be run in dry-run mode")
+        try:
+            options = parse_job_options(job_data)
+        except ConfigException as e:
+            raise ConfigException("Repository '%s': %s" % (name, e))
+        if name in names:
+            raise ConfigException(
+                "The repository '%s' is listed twice, give them distinct names"
+                % name
+            )
+        names.add(name)
+        res.append((name, options))
+    return res
+
+
+class Batch(object):
+    """Migration of the repositories of a batch file (see read_batch_file()),
+    on a pool of worker processes sharing the compiled rules (see
+    job_pool.JobPool). The repositories of the same directory are migrated
+    one after another.
+
+    The state of the jobs is kept in a SQLite database. When the batch is
+    run again, the repositories already migrated are skipped, and the ones
+    interrupted are migrated again. The failed ones are skipped too, unless
+    retry_failed is set, or their options changed. A failed job is retried
+    at most retries times during a run.
+    """
+
+    def __init__(
+        self, file_path, queue_path=None, workers=1, retries=0, retry_failed=False
+    ):
+        if workers < 1:
+            raise ConfigException("The number of workers must be at least 1")
+        self._jobs = read_batch_file(file_path)
+        self._options = dict(self._jobs)
+        self._queue_path = queue_path or os.path.splitext(file_path)[0] + ".sqlite"
+        self._workers = workers
+        self._retries = retries
+        self._connection = sqlite3.connect(self._queue_path)
+        self._connection.execute(_SCHEMA)
+        self._queued_names = self._load_jobs(retry_failed)
+        # State of the run: {name: number of migrated modules} of the
+        # running jobs, and directories of the running jobs
+        self._running = {}
+        self._busy_directories = set()
+        self._done_count = 0
+        self._module_count = 0
+
+    def _load_jobs(self, retry_failed):
+        """Return the names of the jobs to run, after updating the database
+        with the repositories of the batch file"""
+        res = []
+        with self._connection:
+            for name, options in self._jobs:
+                row = self._connection.execute(
+                    "SELECT options, state FROM jobs WHERE name = ?", (name,)
+                ).fetchone()
+                json_options = json.dumps(options, sort_keys=True)
+                if row is None:
+                    self._connection.execute(
+                        "INSERT INTO jobs (name, options, state) VALUES (?, ?, ?)",
+                        (name, json_options, "queued"),
+                    )
+                elif row[0] != json_options or row[1] == "running" or (
+                    row[1] == "failed" and retry_failed
+                ):
+                    self._connection.execute(
+                        "UPDATE jobs SET options = ?, state = ?, attempts = 0,"
+                        " error = NULL WHERE name = ?",
+                        (json_options, "queued", name),
+                    )
+                elif row[1] != "queued":
+                    continue
+                res.append(name)
+        return res
+
+    def _update_job(self, name, **values):
+        with self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET %s WHERE name = ?"
+                % ", ".join("%s = ?" % x for x in values),
+                list(values.values()) + [name],
+            )
+
+    def run(self):
+        """Run the jobs, log a summary, and return True if all the
+        repositories are migrated"""
+        start = time.time()
+        logger.info(
+            "Batch of %d repositories: %d to migrate, with %d worker(s)."
+            " Job states are kept in %s"
+            % (
+                len(self._jobs),
+                len(self._queued_names),
+                self._workers,
+                self._queue_path,
+            )
+        )
+        if self._queued_names:
+            events = queue.Queue()
+            pool = JobPool(
+                min(self._workers, len(self._queued_names)),
+                lambda *event: events.put(event),
+            )
+            try:
+                while self._queued_names or self._running:
+                    self._schedule(pool)
+                    self._handle_event(*events.get())
+            except KeyboardInterrupt:
+                logger.warning(
+                    "Interrupted, waiting for the %d running job(s)"
+                    % len(self._running)
+                )
+                self._queued_names = []
+                pool.close()
+                while self._running and not events.empty():
+                    self._handle_event(*events.get())
+            else:
+                pool.close()
+        return self._log_summary(time.time() - start)
+
+    def _schedule(self, pool):
+        for name in list(self._queued_names):
+            if len(self._running) >= self._workers:
+                return
+            options = self._options[name]
+            if options["directory"] in self._busy_directories:
+                continue
+            self._queued_names.remove(name)
+            self._running[name] = 0
+            self._busy_directories.add(options["directory"])
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE jobs SET state = 'running', attempts = attempts + 1,"
+                    " error = NULL, started = ?, ended = NULL WHERE name = ?",
+                    (time.time(), name),
+                )
+            pool.submit(name, options)
+
+    def _handle_event(self, name, event_type, data):
+        # The end of a job can be sent twice (see JobPool)
+        if name not in self._running:
+            return
+        if event_type == "log":
+            logger.log(
+                logging.getLevelName(data["level"]),
+                "[%s] %s" % (name, data["message"]),
+            )
+        elif event_type == "module" and data["state"] == "done":
+            self._running[name] += 1
+        elif event_type == "state" and data["state"] in END_STATES:
+            module_count = self._running.pop(name)
+            self._busy_directories.discard(self._options[name]["directory"])
+            self._module_count += module_count
+            attempts = self._connection.execute(
+                "SELECT attempts FROM jobs WHERE name = ?", (name,)
+            ).fetchone()[0]
+            if data["state"] == "failed" and attempts <= self._retries:
+                logger.warning(
+                    "[%s] Migration failed (%s), retrying it" % (name, data["error"])
+                )
+                self._update_job(name, state="queued", error=data["error"])
+                self._queued_names.append(name)
+                return
+            if data["state"] == "done":
+                self._done_count += 1
+                logger.info("[%s] Migrated %d module(s)" % (name, module_count))
+            else:
+                logger.error("[%s] Migration failed: %s" % (name, data["error"]))
+            self._update_job(
+                name,
+                state=data["state"],
+                error=data["error"],
+                module_count=module_count,
+                ended=time.time(),
+            )
+
+    def _log_summary(self, duration):
+        rows = self._connection.execute(
+            "SELECT name, state, error FROM jobs WHERE name IN (%s)"
+            % ", ".join("?" * len(self._jobs)),
+            [name for name, __ in self._jobs],
+        ).fetchall()
+        states = {name: (state, error) for name, state, error in rows}
+        failures = [
+            (name, states[name][1])
+            for name, __ in self._jobs
+            if states[name][0] == "failed"
+        ]
+        done_count = len([x for x in states.values() if x[0] == "done"])
+        logger.info(
+            "Batch summary: %d repositories migrated (%d in this run),"
+            " %d failed, %d not run"
+            % (
+                done_count,
+                self._done_count,
+                len(failures),
+                len(self._jobs) - done_count - len(failures),
+            )
+        )
+        if self._done_count:
+            logger.info(
+                "Throughput: %d modules in %.1f s, %.1f modules per minute"
+                % (
+                    self._module_count,
+                    duration,
+                    self._module_count * 60 / max(duration, 0.001),
+                )
+            )
+        for name, error in failures:
+            logger.error("[%s] Failed: %s" % (name, error))
+        return done_count == len(self._jobs)
@@ -0,0 +1,185 @@
+import hashlib
+import inspect
+import json
+import os
+import pathlib
+
+from .config import _CACHE_DIRECTORY_NAME
+from .log import logger
+
+
+def _hash_file(file_path):
+    """Return the hash of the bytes of the file, or None if it doesn't
+    exist"""
+    try:
+        with open(file_path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def _has_stat(entry, file_stat):
+    return (entry.get("size"), entry.get("mtime_ns")) == (
+        file_stat.st_size,
+        file_stat.st_mtime_ns,
+    )
+
+
+def get_cache_directory(directory_path):
+    """Return the path of the cache directory of the migrated repository,
+    created if needed"""
+    cache_directory_path = os.path.join(directory_path, _CACHE_DIRECTORY_NAME)
+    if not os.path.isdir(cache_directory_path):
+        os.makedirs(cache_directory_path, exist_ok=True)
+        # The cache must not be committed with the migrated modules
+        with open(os.path.join(cache_directory_path, ".gitignore"), "w") as f:
+            f.write("*\n")
+    return cache_directory_path
+
+
+def get_fingerprint(migration_steps, migration_scripts):
+    """Return a fingerprint of the migration: steps, scripts and source of the
+    tool (code and rules). Any change invalidates the cached hashes."""
+    fingerprint = hashlib.sha256()
+    fingerprint.update(json.dumps(migration_steps, sort_keys=True).encode())
+    for migration_script in migration_scripts:
+        fingerprint.update(migration_script.__class__.__module__.encode())
+        # The scripts can come from other packages (see script_registry.py)
+        script_entry = migration_script._script_entry
+        if script_entry is not None:
+            file_paths = [inspect.getfile(migration_script.__class__)]
+            for rule_file_paths in script_entry.rule_files.values():
+                file_paths.extend(rule_file_paths)
+            for file_path in file_paths:
+                fingerprint.update(pathlib.Path(file_path).read_bytes())
+    package_path = pathlib.Path(__file__).parent
+    for file_path in sorted(package_path.rglob("*")):
+        if (
+            file_path.suffix in (".py", ".yaml", ".yml", ".json")
+            and file_path.is_file()
+        ):
+            fingerprint.update(str(file_path.relative_to(package_path)).encode())
+            fingerprint.update(file_path.read_bytes())
+    return fingerprint.hexdigest()
+
+
+class ModuleCache(object):
+    """Hashes of the files of a module before and after its last migration,
+    stored in the cache directory of the migrated repository.
+
+    A file whose bytes are still the ones written by the last migration,
+    done with the same fingerprint, doesn't need to be migrated again. The
+    file is not read if its size and modification time are the recorded
+    ones, as git does for its index: unless it was modified after the cache
+    was saved. A file back to its content before the last migration (git
+    checkout, ...) is migrated again.
+    """
+
+    def __init__(self, directory_path, module_name, fingerprint):
+        self._directory_path = os.path.join(directory_path, _CACHE_DIRECTORY_NAME)
+        self._path = os.path.join(self._directory_path, module_name + ".json")
+        self._fingerprint = fingerprint
+        # {relative_path: {"before": hash, "after": hash, "size": size,
+        # "mtime_ns": modification time}}
+        self._files = {}
+        # Modification time of the cache file: the files modified since are
+        # hashed, whatever their stat
+        self._saved_ns = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._saved_ns = os.stat(self._path).st_mtime_ns
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring invalid cache file %s: %s" % (self._path, e))
+            return
+        if data.get("fingerprint") != self._fingerprint:
+            logger.debug("Cache %s outdated, ignoring it" % self._path)
+            return
+        self._files = data.get("files", {})
+
+    def freeze_migrated_files(self, module_path, workspace):
+        """Freeze in the workspace the files unchanged since their last
+        migration, and return their number"""
+        count = 0
+        for relative_path, entry in self._files.items():
+            file_path = os.path.join(module_path, relative_path)
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue
+            # Modified when the cache was saved: its stat can't be trusted
+            is_racy = file_stat.st_mtime_ns >= self._saved_ns
+            if is_racy or not _has_stat(entry, file_stat):
+                file_hash = _hash_file(file_path)
+                if file_hash != entry["after"]:
+                    if file_hash == entry["before"]:
+                        logger.debug(
+                            "%s back to its content before the last migration"
+                            % file_path
+                        )
+                    continue
+            workspace.freeze(file_path)
+            count += 1
+        return count
+
+    def update(self, module_path, workspace):
+        """Record the hashes of the files of the workspace before their
+        migration. To be called before flushing it."""
+        files = {}
+        for file_path, original_content, __ in workspace.get_files():
+            relative_path = os.path.relpath(file_path, module_path)
+            if relative_path.startswith(os.pardir):
+                continue
+            entry = self._files.get(relative_path)
+            if workspace.is_frozen(file_path) and entry:
+                files[relative_path] = entry
+            elif original_content is None:
+                files[relative_path] = {"before": None}
+            else:
+                files[relative_path] = {
+                    "before": _hash_file(workspace.get_source(file_path))
+                }
+        # The frozen files not read by the scripts are not buffered
+        for relative_path, entry in self._files.items():
+            if relative_path not in files and workspace.is_frozen(
+                os.path.join(module_path, relative_path)
+            ):
+                files[relative_path] = entry
+        self._files = files
+
+    def save(self, module_path):
+        """Record the hashes and the stat of the files written by the
+        migration, and save the cache. To be called after flushing the
+        workspace."""
+        files = {}
+        for relative_path, entry in self._files.items():
+            file_path = os.path.join(module_path, relative_path)
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue
+            after = entry.get("after")
+            if after is None or not _has_stat(entry, file_stat):
+                after = _hash_file(file_path)
+            files[relative_path] = {
+                "before": entry["before"],
+                "after": after,
+                "size": file_stat.st_size,
+                "mtime_ns": file_stat.st_mtime_ns,
+            }
+        self._files = files
+        get_cache_directory(os.path.dirname(self._directory_path))
+        temporary_path = self._path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"fingerprint": self._fingerprint, "files": self._files},
+                f,
+                indent=1,
+                sort_keys=True,
+            )
+        os.replace(temporary_path, self._path)
@@ -28,3 +28,51 @@ _AVAILABLE_MIGRATION_STEPS = [
 _ALLOWED_EXTENSIONS = [".py", ".xml", ".js", ".csv"]
 
 _MANIFEST_NAMES = ["__openerp__.py", "__manifest__.py"]
+
+# Registry of the migration scripts of a package (see script_registry.py),
+# and entry point group of the packages of scripts added to the built-in ones
+_SCRIPT_REGISTRY_NAME = "registry.json"
+_SCRIPT_ENTRY_POINT_GROUP = "odoo_module_upgrade.upgrade_scripts"
+
+# Directory of the incremental mode cache, in the migrated repository
+_CACHE_DIRECTORY_NAME = ".odoo_module_upgrade_cache"
+
+# Files listing the paths excluded from the migration, with the syntax of
+# the .gitignore files, read in the migrated directory and in the modules
+_IGNORE_FILE_NAMES = [".gitignore", ".odoo-upgrade-ignore"]
+
+# Folders of vendored libraries, relative to the module
+_VENDORED_FOLDERS = ["static/lib", "static/src/lib", "node_modules", "bower_components"]
+
+# Files bigger than these sizes (in bytes) are not migrated: {extension:
+# size}. No ceiling by default, they are set by --max-file-size. The CSV
+# files are streamed (see _CSV_STREAMED_SIZE), whatever their size.
+_MAX_FILE_SIZES = {}
+
+# Javascript files having a line longer than this are considered minified
+_MINIFIED_LINE_LENGTH = 1000
+
+# Default address of the migration server (see server.py)
+_SERVER_HOST = "127.0.0.1"
+_SERVER_PORT = 8071
+# Header of the requests carrying the token of the server
+_SERVER_TOKEN_HEADER = "X-Migration-Token"
+
+# Seconds between two keep-alive comments of the event streams of the server
+_SERVER_KEEP_ALIVE = 15
+
+# Watch mode (see watcher.py): seconds between two checks of the files when
+# inotify is not available, and delay to group the changes of a save
+_WATCH_POLL_INTERVAL = 0.5
+_WATCH_DEBOUNCE = 0.05
+
+# Journal of the last migration run, in the cache directory (see journal.py)
+_JOURNAL_FILE_NAME = "journal.jsonl"
+
+# Lines of the CSV files migrated at once, the files being streamed block
+# by block (see csv_migration.py)
+_CSV_BLOCK_LINES = 1000
+
+# CSV files bigger than this size (in bytes) are streamed from and to the
+# disk even in pipeline mode, instead of being buffered by the workspace
+_CSV_STREAMED_SIZE = 1024 * 1024
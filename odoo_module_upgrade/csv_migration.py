@@ -0,0 +1,318 @@
+import csv
+import io
+import itertools
+import os
+import re
+
+from .config import _CSV_BLOCK_LINES
+from .scanner import Finding
+from . import tools
+
+# Field of a column header, followed by its suffix (':id', '/id', '/.id')
+_HEADER_RE = re.compile(r"^([^:/]*)(.*)$", re.DOTALL)
+
+
+class CsvPlan(object):
+    """Rules of a migration script for the CSV files, applied column by
+    column on their rows instead of on their text.
+
+    text_plan: RulePlan of the script for the '.csv' files, with the rules
+    generated for the removed / renamed fields and models, applied on the
+    text of the rows (domains, contexts, ...)
+    renamed_models / removed_models: {model name: new model name / message},
+    for the columns of model names ('model', 'res_model', ...)
+    renamed_tables / removed_tables: {table name: new table name / message},
+    for the columns of model xml ids ('model_id:id', ...), like
+    'model_res_partner'
+    renamed_fields / removed_fields: {model name: {field name: new field
+    name / message}}, for the headers of the data files named after their
+    model, like 'res.partner.csv'
+    """
+
+    __slots__ = (
+        "text_plan",
+        "renamed_models",
+        "removed_models",
+        "renamed_tables",
+        "removed_tables",
+        "renamed_fields",
+        "removed_fields",
+        "values_re",
+    )
+
+    def __init__(
+        self,
+        text_plan,
+        renamed_models,
+        removed_models,
+        renamed_fields,
+        removed_fields,
+    ):
+        self.text_plan = text_plan
+        self.renamed_models = renamed_models
+        self.removed_models = removed_models
+        self.renamed_tables = {
+            _get_table(old_model_name): _get_table(new_model_name)
+            for old_model_name, new_model_name in renamed_models.items()
+        }
+        self.removed_tables = {
+            _get_table(model_name): message
+            for model_name, message in removed_models.items()
+        }
+        self.renamed_fields = renamed_fields
+        self.removed_fields = removed_fields
+        # Any of the values to migrate, to skip at once the blocks of rows
+        # without them
+        values = list(renamed_models) + list(removed_models)
+        values += ["model_" + x for x in self.renamed_tables]
+        values += ["model_" + x for x in self.removed_tables]
+        self.values_re = values and re.compile(
+            "|".join(re.escape(x) for x in sorted(values, reverse=True))
+        )
+
+    @classmethod
+    def from_rule_set(cls, rule_set, text_plan):
+        renamed_fields = {}
+        for model_name, old_field_name, new_field_name, __ in rule_set.renamed_fields:
+            renamed_fields.setdefault(model_name, {})[old_field_name] = new_field_name
+        removed_fields = {}
+        for model_name, field_name, more_info in rule_set.removed_fields:
+            removed_fields.setdefault(model_name, {})[field_name] = (
+                "On the model %s, the field %s was deprecated.%s"
+                % (model_name, field_name, _get_more_info(more_info))
+            )
+        return cls(
+            text_plan,
+            {
+                old_model_name: new_model_name
+                for old_model_name, new_model_name, __ in rule_set.renamed_models
+            },
+            # Same messages as the text rules, for the findings of the cells
+            # to be reported once (see CsvStage.migrate_block())
+            {
+                model_name: "The model %s has been deprecated. %s"
+                % (model_name, more_info)
+                for model_name, more_info in rule_set.removed_models
+            },
+            renamed_fields,
+            removed_fields,
+        )
+
+
+class CsvStage(object):
+    """Migration of the rows of a CSV file by a script, block by block.
+
+    The rows of a block are read only if the block has values to migrate,
+    and kept as they are, unless the rules change one of their cells. Then
+    the text rules of the script are applied on the block, and its errors
+    and warnings searched in it.
+    """
+
+    def __init__(self, csv_plan, file_name):
+        self.plan = csv_plan
+        # Data files are named after their model
+        self.model_name = os.path.splitext(file_name)[0]
+        self.changed = False
+        self.findings = []
+        # [(column index, kind)] of the columns to migrate, read in the
+        # header, the first row
+        self._columns = None
+        # Lines of the blocks already migrated
+        self._line_count = 0
+
+    def migrate_block(self, text):
+        """Migrate the block of rows, and return its new text"""
+        new_text = text
+        finding_count = len(self.findings)
+        if self._columns is None or '"' in text:
+            new_text = self._migrate_rows(text, self._line_count + 1)
+        elif self._columns and self.plan.values_re:
+            new_text = self._migrate_lines(text)
+        new_text = self.plan.text_plan.replace(new_text)
+        self.changed = self.changed or new_text != text
+        text_findings = [
+            finding._replace(line=finding.line + self._line_count)
+            for finding in self.plan.text_plan.scan(new_text)
+        ]
+        # The text rules of the removed models find some of the cells
+        # already reported
+        keys = set((x.severity, x.message, x.line) for x in text_findings)
+        self.findings[finding_count:] = [
+            x
+            for x in self.findings[finding_count:]
+            if (x.severity, x.message, x.line) not in keys
+        ]
+        self.findings.extend(text_findings)
+        self._line_count += new_text.count("\n")
+        return new_text
+
+    def _migrate_lines(self, text):
+        """Migrate the rows of a block without quotes, each of its lines
+        being a row. Only the lines with values to migrate are read."""
+        texts = []
+        position = 0
+        line = self._line_count + 1
+        for match in self.plan.values_re.finditer(text):
+            if match.start() < position:
+                continue
+            start = text.rfind("\n", 0, match.start()) + 1
+            end = text.find("\n", match.end()) + 1 or len(text)
+            line += text.count("\n", position, start)
+            texts.append(text[position:start])
+            texts.append(self._migrate_rows(text[start:end], line))
+            position = end
+            line += 1
+        texts.append(text[position:])
+        return "".join(texts)
+
+    def _migrate_rows(self, text, line):
+        """Migrate the rows of text, starting at the given line"""
+        texts = []
+        for row_text, cells in _read_rows(io.StringIO(text)):
+            if self._columns is None:
+                new_cells = self._migrate_header(cells, row_text, line)
+            else:
+                new_cells = self._migrate_cells(cells, row_text, line)
+            if new_cells is not cells:
+                row_text = _write_row(new_cells, row_text)
+            texts.append(row_text)
+            line += row_text.count("\n")
+        return "".join(texts)
+
+    def _migrate_header(self, cells, text, line):
+        self._columns = []
+        renamed_fields = self.plan.renamed_fields.get(self.model_name, {})
+        removed_fields = self.plan.removed_fields.get(self.model_name, {})
+        new_cells = list(cells)
+        for index, cell in enumerate(cells):
+            field_name, suffix = _HEADER_RE.match(cell.strip()).groups()
+            if field_name in renamed_fields:
+                new_cells[index] = renamed_fields[field_name] + suffix
+            elif field_name in removed_fields:
+                self._add_finding(
+                    "warning", removed_fields[field_name], text, cell, line
+                )
+            if suffix in (":id", "/id") and (
+                field_name == "model_id" or field_name.endswith("_model_id")
+            ):
+                self._columns.append((index, "table"))
+            elif not suffix and (
+                field_name == "model" or field_name.endswith("_model")
+            ):
+                self._columns.append((index, "model"))
+        return new_cells if new_cells != cells else cells
+
+    def _migrate_cells(self, cells, text, line):
+        new_cells = cells
+        for index, kind in self._columns:
+            if index >= len(cells):
+                continue
+            value = cells[index].strip()
+            if kind == "model":
+                new_value = self.plan.renamed_models.get(value)
+                message = self.plan.removed_models.get(value)
+            else:
+                # [module.]model_<table>
+                prefix, __, xml_id = value.rpartition(".")
+                if not xml_id.startswith("model_"):
+                    continue
+                table_name = xml_id[len("model_") :]
+                new_value = self.plan.renamed_tables.get(table_name)
+                if new_value:
+                    new_value = "%smodel_%s" % (prefix and prefix + ".", new_value)
+                message = self.plan.removed_tables.get(table_name)
+            if new_value:
+                if new_cells is cells:
+                    new_cells = list(cells)
+                new_cells[index] = new_value
+            elif message:
+                self._add_finding("error", message, text, cells[index], line)
+        return new_cells
+
+    def _add_finding(self, severity, message, text, cell, line):
+        column = text.find(cell) + 1 or 1
+        self.findings.append(
+            Finding("csv:" + message, severity, message, line, column)
+        )
+
+
+def migrate_csv_file(file_path, stages):
+    """Migrate the CSV file by the stages (see CsvStage), one after another
+    on each block of rows. The file is streamed block by block: it is
+    written only from its first changed block, and never loaded at once
+    from the disk. Raise csv.Error if the file can not be parsed."""
+    with tools._open_lines(file_path) as lines:
+        blocks = _migrate_blocks(lines, stages)
+        # The unchanged blocks are copied from the file, if another one
+        # changes
+        line_count = 0
+        for text, new_text in blocks:
+            if new_text != text:
+                break
+            line_count += text.count("\n")
+        else:
+            return
+
+        def get_chunks():
+            with tools._open_lines(file_path) as source_lines:
+                yield from itertools.islice(source_lines, line_count)
+            yield new_text
+            for __, text in blocks:
+                yield text
+
+        tools._write_chunks(file_path, get_chunks())
+
+
+def _migrate_blocks(lines, stages):
+    """Yield the text of each block of rows, and its migrated text"""
+    while True:
+        block_lines = list(itertools.islice(lines, _CSV_BLOCK_LINES))
+        if not block_lines:
+            return
+        # The quotes go by pairs, escaped ones included: a block with an odd
+        # number of them ends inside a quoted cell, on several lines
+        text = "".join(block_lines)
+        quote_count = text.count('"')
+        while quote_count % 2:
+            line = next(lines, None)
+            if line is None:
+                break
+            text += line
+            quote_count += line.count('"')
+        new_text = text
+        for stage in stages:
+            new_text = stage.migrate_block(new_text)
+        yield text, new_text
+
+
+def _read_rows(lines):
+    """Yield the (text, cells) of the rows of the CSV lines. A row spans
+    several lines if a quoted cell has line breaks."""
+    row_lines = []
+
+    def read_lines():
+        for line in lines:
+            row_lines.append(line)
+            yield line
+
+    for cells in csv.reader(read_lines()):
+        text = "".join(row_lines)
+        row_lines.clear()
+        yield text, cells
+
+
+def _write_row(cells, text):
+    """Return the text of the row with the new cells, and the line ending
+    of its previous text"""
+    output = io.StringIO()
+    line_ending = "\n" if text.endswith("\n") else ""
+    csv.writer(output, lineterminator=line_ending).writerow(cells)
+    return output.getvalue()
+
+
+def _get_table(model_name):
+    return model_name.replace(".", "_")
+
+
+def _get_more_info(more_info):
+    return " %s" % more_info if more_info else ""
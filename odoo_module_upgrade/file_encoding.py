@@ -0,0 +1,186 @@
+import codecs
+import os
+import re
+
+from .log import logger
+
+# {absolute_file_path: encoding}, detected once per file during the run.
+# The encodings of the files changed since then are forgotten (see
+# forget_encodings())
+_ENCODINGS = {}
+
+# {absolute_file_path: line ending}, of the files read with '\r\n' line
+# endings, to write them back with them. The text is always read with '\n'
+# line endings.
+_NEWLINES = {}
+
+# Size of the chunks read to detect the encoding of a file
+_CHUNK_SIZE = 1024 * 1024
+
+# The UTF-32 BOMs start with the UTF-16 ones, and are checked first
+_BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# Encoding declared by an xml declaration or a python coding comment
+# (PEP 263), in the first two lines of the file
+_DECLARED_ENCODING_RE = re.compile(
+    rb"""<\?xml[^>]*?encoding=["']([-\w.:]+)["']|^[ \t\f]*#.*?coding[:=][ \t]*([-\w.]+)""",
+    re.MULTILINE,
+)
+
+
+def decode(data):
+    """Return the text of the bytes and their encoding.
+
+    The encoding is given by the BOM, if any. Otherwise, the ASCII and
+    UTF-8 contents, most of the files, are decoded at once, the other ones
+    with their declared encoding, or latin-1, which decodes any bytes.
+    """
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return data.decode(encoding), encoding
+    if data.isascii():
+        return data.decode("ascii"), "utf-8"
+    try:
+        return data.decode("utf-8"), "utf-8"
+    except UnicodeDecodeError:
+        pass
+    encoding = _get_declared_encoding(data)
+    if encoding:
+        try:
+            return data.decode(encoding), encoding
+        except (LookupError, UnicodeDecodeError):
+            pass
+    return data.decode("latin-1"), "latin-1"
+
+
+def decode_file(file_path, data):
+    """Return the text of the content of the file and its encoding. The
+    encoding is detected on the first read of the file, then reused."""
+    key = os.path.abspath(os.fspath(file_path))
+    encoding = _ENCODINGS.get(key)
+    if encoding:
+        try:
+            return data.decode(encoding), encoding
+        except UnicodeDecodeError:
+            # The file has been replaced by a content in another encoding
+            pass
+    text, encoding = decode(data)
+    _ENCODINGS[key] = encoding
+    if encoding != "utf-8":
+        logger.debug("Detected %s encoding of file %s" % (encoding, key))
+    return text, encoding
+
+
+def detect_file_encoding(file_path):
+    """Return the encoding of the file, detected as decode() does, but
+    reading the file by chunks, without loading it at once. The declared
+    encodings are not read: they are the ones of the xml and python files,
+    read at once."""
+    key = os.path.abspath(os.fspath(file_path))
+    encoding = _ENCODINGS.get(key)
+    if encoding:
+        return encoding
+    with open(key, "rb") as f:
+        head = f.read(_CHUNK_SIZE)
+        encoding = next((x for bom, x in _BOMS if head.startswith(bom)), None)
+        if encoding is None:
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            try:
+                chunk = head
+                while chunk:
+                    decoder.decode(chunk)
+                    chunk = f.read(_CHUNK_SIZE)
+                decoder.decode(b"", final=True)
+                encoding = "utf-8"
+            except UnicodeDecodeError:
+                encoding = "latin-1"
+    _ENCODINGS[key] = encoding
+    if encoding != "utf-8":
+        logger.debug("Detected %s encoding of file %s" % (encoding, key))
+    normalize_newlines(key, head.decode(encoding, "ignore"))
+    return encoding
+
+
+def normalize_newlines(file_path, text):
+    """Return the text with '\n' line endings, as read in text mode, and
+    the line ending of the file: '\r\n' if it has some, kept to write the
+    file back with them (see encode())"""
+    key = os.path.abspath(os.fspath(file_path))
+    if "\r\n" in text:
+        _NEWLINES[key] = "\r\n"
+    else:
+        _NEWLINES.pop(key, None)
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text, _NEWLINES.get(key, "\n")
+
+
+def get_newline(file_path):
+    """Return the line ending of the file, as detected when reading it"""
+    return _NEWLINES.get(os.path.abspath(os.fspath(file_path)), "\n")
+
+
+def get_encoding(file_path):
+    """Return the encoding of the file, as detected when reading it"""
+    return _ENCODINGS.get(os.path.abspath(os.fspath(file_path)), "utf-8")
+
+
+def forget_encodings(file_paths=None):
+    """Forget the encodings and line endings of the files, or of all of
+    them: they are detected again on their next read, as the files may have
+    been saved in another encoding since then (watch mode, jobs of a worker
+    process)"""
+    if file_paths is None:
+        _ENCODINGS.clear()
+        _NEWLINES.clear()
+        return
+    for file_path in file_paths:
+        _ENCODINGS.pop(os.path.abspath(os.fspath(file_path)), None)
+        _NEWLINES.pop(os.path.abspath(os.fspath(file_path)), None)
+
+
+def move_encoding(old_file_path, new_file_path):
+    old_key = os.path.abspath(os.fspath(old_file_path))
+    new_key = os.path.abspath(os.fspath(new_file_path))
+    encoding = _ENCODINGS.pop(old_key, None)
+    if encoding:
+        _ENCODINGS[new_key] = encoding
+    newline = _NEWLINES.pop(old_key, None)
+    if newline:
+        _NEWLINES[new_key] = newline
+
+
+def encode(file_path, content, encoding, newline="\n"):
+    """Return the content encoded in the original encoding of the file, or
+    in UTF-8 if the new content can not be represented in it, with the
+    given line endings"""
+    if newline != "\n":
+        content = content.replace("\n", newline)
+    try:
+        return content.encode(encoding)
+    except UnicodeEncodeError:
+        logger.warning(
+            "The new content of file %s can not be written in %s encoding,"
+            " writing it in utf-8 instead" % (file_path, encoding)
+        )
+        _ENCODINGS[os.path.abspath(os.fspath(file_path))] = "utf-8"
+        return content.encode("utf-8")
+
+
+def _get_declared_encoding(data):
+    head = b"\n".join(data[:4096].split(b"\n", 2)[:2])
+    match = _DECLARED_ENCODING_RE.search(head)
+    if not match:
+        return None
+    encoding = (match.group(1) or match.group(2)).decode("ascii")
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        return None
+    return encoding
@@ -0,0 +1,211 @@
+import os
+import threading
+from fnmatch import fnmatchcase
+
+from .config import (
+    _IGNORE_FILE_NAMES,
+    _MAX_FILE_SIZES,
+    _MINIFIED_LINE_LENGTH,
+    _VENDORED_FOLDERS,
+)
+from .log import logger
+
+
+class FileFilter(object):
+    """Exclude from the file index (see file_index.py) the files that no
+    rule can meaningfully change: paths listed in the ignore files, vendored
+    libraries, minified javascript files and files bigger than the size
+    ceiling of their extension. Without file index, the files are excluded
+    when walking the folders (see walk()).
+
+    The filter is enabled by default (see --no-file-filter): the excluded
+    files are not migrated, and only counted in the summary logged for each
+    module (see log_skipped()).
+
+    max_file_sizes: {extension: size in bytes}, overriding _MAX_FILE_SIZES.
+    A size of 0 removes the ceiling of the extension.
+    """
+
+    def __init__(self, root, max_file_sizes=None, ignore_file_folders=()):
+        self._root = os.path.abspath(os.fspath(root))
+        self._max_file_sizes = dict(_MAX_FILE_SIZES, **(max_file_sizes or {}))
+        # [(base_folder, pattern, is_negation, is_folder_only)]
+        self._rules = []
+        self._loaded_folders = set()
+        self._lock = threading.Lock()
+        for folder_path in ignore_file_folders:
+            self.load_ignore_files(folder_path)
+        # [(absolute_path, reason, size)]
+        self.skipped = []
+        self._skipped_paths = set()
+
+    def covers(self, path):
+        key = os.path.abspath(os.fspath(path))
+        return key == self._root or key.startswith(os.path.join(self._root, ""))
+
+    def load_ignore_files(self, folder_path):
+        """Read the ignore files of the folder, once. Their patterns apply to
+        the content of the folder."""
+        folder_path = os.path.abspath(os.fspath(folder_path))
+        with self._lock:
+            if folder_path in self._loaded_folders:
+                return
+            self._loaded_folders.add(folder_path)
+        for file_name in _IGNORE_FILE_NAMES:
+            file_path = os.path.join(folder_path, file_name)
+            if not os.path.isfile(file_path):
+                continue
+            with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                for line in f.read().splitlines():
+                    rule = _parse_ignore_line(line)
+                    if rule:
+                        self._rules.append((folder_path,) + rule)
+
+    def get_skip_reason(self, entry):
+        """Return the reason to skip the os.DirEntry, or None"""
+        try:
+            is_folder = entry.is_dir()
+        except OSError:
+            is_folder = False
+        relative_path = os.path.relpath(entry.path, self._root).replace(os.sep, "/")
+        if is_folder and any(
+            relative_path == x if "/" in x else entry.name == x
+            for x in _VENDORED_FOLDERS
+        ):
+            return "vendored"
+        if self._is_ignored(entry.path, is_folder):
+            return "ignored"
+        if is_folder:
+            return None
+        extension = os.path.splitext(entry.name)[1]
+        max_file_size = self._max_file_sizes.get(extension)
+        if max_file_size and entry.stat().st_size > max_file_size:
+            return "too large"
+        if extension == ".js" and _is_minified(entry.path):
+            return "minified"
+        return None
+
+    def skip(self, entry, reason):
+        size = 0
+        try:
+            if not entry.is_dir():
+                size = entry.stat().st_size
+        except OSError:
+            pass
+        with self._lock:
+            # Walked again (see walk())
+            if entry.path in self._skipped_paths:
+                return
+            self._skipped_paths.add(entry.path)
+            self.skipped.append((entry.path, reason, size))
+        logger.debug("Skipping %s (%s)" % (entry.path, reason))
+
+    def walk(self, top):
+        """Same as os.walk(top), without the excluded files and folders, top
+        being covered by the filter. The ignore files of the folders from the
+        root to top apply."""
+        top = os.path.abspath(os.fspath(top))
+        folder_path = self._root
+        while folder_path != top:
+            self.load_ignore_files(folder_path)
+            name = os.path.relpath(top, folder_path).split(os.sep)[0]
+            folder_path = os.path.join(folder_path, name)
+        yield from self._walk(top)
+
+    def _walk(self, top):
+        self.load_ignore_files(top)
+        try:
+            with os.scandir(top) as entries:
+                entries = list(entries)
+        except OSError:
+            return
+        folder_names, file_names = [], []
+        for entry in entries:
+            reason = self.get_skip_reason(entry)
+            if reason:
+                self.skip(entry, reason)
+                continue
+            try:
+                is_folder = entry.is_dir()
+            except OSError:
+                is_folder = False
+            (folder_names if is_folder else file_names).append(entry.name)
+        yield top, folder_names, file_names
+        # As os.walk(), the symbolic links to folders are not followed
+        for folder_name in folder_names:
+            folder_path = os.path.join(top, folder_name)
+            if not os.path.islink(folder_path):
+                yield from self._walk(folder_path)
+
+    def log_skipped(self, module_name):
+        if not self.skipped:
+            return
+        count_by_reason = {}
+        for __, reason, __ in self.skipped:
+            count_by_reason[reason] = count_by_reason.get(reason, 0) + 1
+        message = "[%s] Skipping %d path(s): %s" % (
+            module_name,
+            len(self.skipped),
+            ", ".join(
+                "%d %s" % (count, reason)
+                for reason, count in sorted(count_by_reason.items())
+            ),
+        )
+        skipped_size = sum(x[2] for x in self.skipped)
+        if skipped_size:
+            message += " (%.1f KiB of files)" % (skipped_size / 1024)
+        logger.info(message)
+
+    def _is_ignored(self, path, is_folder):
+        ignored = False
+        for base_folder, pattern, is_negation, is_folder_only in self._rules:
+            if is_folder_only and not is_folder:
+                continue
+            if not path.startswith(os.path.join(base_folder, "")):
+                continue
+            relative_path = os.path.relpath(path, base_folder).replace(os.sep, "/")
+            if pattern.startswith("./"):
+                matched = fnmatchcase(relative_path, pattern[2:])
+            elif "/" in pattern:
+                matched = fnmatchcase(relative_path, pattern)
+            else:
+                matched = fnmatchcase(os.path.basename(path), pattern)
+            if matched:
+                ignored = not is_negation
+        return ignored
+
+
+def _parse_ignore_line(line):
+    """Return (pattern, is_negation, is_folder_only) of a line of an ignore
+    file, or None. Patterns containing a "/" are relative to the folder of
+    the ignore file, the other ones match the names at any depth."""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    is_negation = line.startswith("!")
+    if is_negation:
+        line = line[1:]
+    is_folder_only = line.endswith("/")
+    line = line.rstrip("/")
+    if line.startswith("**/"):
+        line = line[3:]
+    elif "/" in line:
+        # fnmatch "*" also matches "/", "a/**/b" becomes "a/*/b"
+        line = line.lstrip("/").replace("/**/", "/*/")
+        if "/" not in line:
+            # "/name": name in the folder of the ignore file only
+            line = "./" + line
+    if not line:
+        return None
+    return line, is_negation, is_folder_only
+
+
+def _is_minified(file_path):
+    if file_path.endswith((".min.js", "-min.js")):
+        return True
+    try:
+        with open(file_path, "rb") as f:
+            head = f.read(4 * _MINIFIED_LINE_LENGTH)
+    except OSError:
+        return False
+    return any(len(line) > _MINIFIED_LINE_LENGTH for line in head.split(b"\n"))
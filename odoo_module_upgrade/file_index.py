@@ -0,0 +1,151 @@
+import os
+import pathlib
+
+
+class FileIndex(object):
+    """Tree of the files of a folder, built once with os.scandir().
+
+    The index is queried instead of walking the disk again (see walk() and
+    get_files()), in the same order as os.walk() and Path.rglob(). It is
+    kept up to date by the workspace when files are created, renamed or
+    removed during the migration.
+
+    The files and folders excluded by the file_filter, if any, are not
+    indexed (see file_filter.py). If file_paths is given, the other files
+    are not indexed either.
+    """
+
+    def __init__(self, root, file_filter=None, file_paths=None):
+        self.root = os.path.abspath(os.fspath(root))
+        self._file_filter = file_filter
+        self._file_paths = file_paths and set(
+            os.path.abspath(os.fspath(x)) for x in file_paths
+        )
+        # Paths of the files and folders excluded by the filter
+        self._skipped_paths = set()
+        # {absolute_folder_path: ([sub_folder_name], [file_name])}, in the
+        # order of os.scandir(). Symbolic links to folders are listed, but
+        # not indexed, as os.walk() doesn't follow them.
+        self._folders = {}
+        # {absolute_file_path: os.DirEntry or None, if unknown}
+        self._entries = {}
+        self._scan(self.root)
+
+    def _scan(self, folder_path):
+        folder_names, file_names = [], []
+        self._folders[folder_path] = (folder_names, file_names)
+        if self._file_filter:
+            self._file_filter.load_ignore_files(folder_path)
+        try:
+            with os.scandir(folder_path) as entries:
+                entries = list(entries)
+        except OSError:
+            return
+        for entry in entries:
+            if self._file_filter:
+                reason = self._file_filter.get_skip_reason(entry)
+                if reason:
+                    self._file_filter.skip(entry, reason)
+                    self._skipped_paths.add(entry.path)
+                    continue
+            try:
+                is_folder = entry.is_dir()
+            except OSError:
+                is_folder = False
+            if is_folder:
+                folder_names.append(entry.name)
+                if not entry.is_symlink():
+                    self._scan(entry.path)
+            elif self._file_paths is not None and entry.path not in self._file_paths:
+                self._skipped_paths.add(entry.path)
+            else:
+                file_names.append(entry.name)
+                self._entries[entry.path] = entry
+
+    def covers(self, path):
+        key = os.path.abspath(os.fspath(path))
+        return key == self.root or key.startswith(os.path.join(self.root, ""))
+
+    def exists(self, path):
+        key = os.path.abspath(os.fspath(path))
+        if key in self._entries or key in self._folders:
+            return True
+        # Excluded paths still exist, but are not indexed
+        if any(
+            key == x or key.startswith(os.path.join(x, ""))
+            for x in self._skipped_paths
+        ):
+            return os.path.exists(key)
+        return False
+
+    def stat(self, file_path):
+        """Return the os.stat_result of the file, as found when indexing it"""
+        key = os.path.abspath(os.fspath(file_path))
+        entry = self._entries[key]
+        return entry.stat() if entry is not None else os.stat(key)
+
+    def walk(self, top):
+        """Same as os.walk(top)"""
+        top = os.path.abspath(os.fspath(top))
+        if top not in self._folders:
+            return
+        folder_names, file_names = self._folders[top]
+        folder_names = list(folder_names)
+        yield top, folder_names, list(file_names)
+        for folder_name in folder_names:
+            yield from self.walk(os.path.join(top, folder_name))
+
+    def get_files(self, top, extensions):
+        """Return the pathlib.Path of the files of top ending with one of
+        the extensions, grouped by extension, as Path.rglob() would."""
+        file_paths = [
+            os.path.join(root, file_name)
+            for root, __, file_names in self.walk(top)
+            for file_name in file_names
+        ]
+        return [
+            pathlib.Path(file_path)
+            for extension in extensions
+            for file_path in file_paths
+            if file_path.endswith(extension)
+        ]
+
+    def add(self, file_path):
+        key = os.path.abspath(os.fspath(file_path))
+        if key in self._entries:
+            return
+        folder_path, file_name = os.path.split(key)
+        self._add_folder(folder_path)[1].append(file_name)
+        self._entries[key] = None
+
+    def _add_folder(self, folder_path):
+        folder = self._folders.get(folder_path)
+        if folder is None:
+            parent_path, folder_name = os.path.split(folder_path)
+            if folder_path != self.root:
+                self._add_folder(parent_path)[0].append(folder_name)
+            folder = self._folders[folder_path] = ([], [])
+        return folder
+
+    def remove(self, path):
+        """Remove a file or a folder and its content"""
+        key = os.path.abspath(os.fspath(path))
+        parent_path, name = os.path.split(key)
+        parent = self._folders.get(parent_path)
+        if key in self._folders:
+            prefix = os.path.join(key, "")
+            for folder_path in [x for x in self._folders if x.startswith(prefix)]:
+                del self._folders[folder_path]
+            for file_path in [x for x in self._entries if x.startswith(prefix)]:
+                del self._entries[file_path]
+            del self._folders[key]
+            if parent is not None:
+                parent[0].remove(name)
+        elif key in self._entries:
+            del self._entries[key]
+            if parent is not None:
+                parent[1].remove(name)
+
+    def rename(self, old_file_path, new_file_path):
+        self.remove(old_file_path)
+        self.add(new_file_path)
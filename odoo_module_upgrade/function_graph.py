@@ -0,0 +1,74 @@
+# Any file of the module, including the created, renamed or removed ones
+ANY = "*"
+# The manifest file of the module, which is also a '.py' file
+MANIFEST = "manifest"
+
+_KIND_EXTENSIONS = {MANIFEST: ".py"}
+
+
+def file_access(reads=(), writes=()):
+    """Declare the kinds of files read and written by a global function of
+    a migration script. A kind is a file extension ('.py', '.xml', ...),
+    MANIFEST or ANY. The written files are also considered as read.
+
+    The functions that don't access the same files, or only read them, can
+    be run concurrently (see tools._run_functions()). A function without
+    declaration is run after all the previous ones, and before the next
+    ones."""
+    reads = frozenset(reads) | frozenset(writes)
+    writes = frozenset(writes)
+
+    def decorator(function):
+        function._file_access = (reads, writes)
+        return function
+
+    return decorator
+
+
+def get_file_access(function):
+    """Return the (read kinds, written kinds) of the function"""
+    return getattr(function, "_file_access", None) or (
+        frozenset([ANY]),
+        frozenset([ANY]),
+    )
+
+
+def get_dependencies(functions):
+    """Return, for each function, the indexes of the previous functions
+    that must be run before it: the ones writing files it reads, or reading
+    files it writes."""
+    accesses = [get_file_access(x) for x in functions]
+    res = []
+    for index, (reads, writes) in enumerate(accesses):
+        res.append(
+            [
+                previous_index
+                for previous_index, (previous_reads, previous_writes) in enumerate(
+                    accesses[:index]
+                )
+                if overlap(writes, previous_reads) or overlap(reads, previous_writes)
+            ]
+        )
+    return res
+
+
+def get_reading_functions(functions, kinds):
+    """Return the functions reading files of one of the kinds (see
+    Migration.watch())"""
+    return [x for x in functions if overlap(get_file_access(x)[0], kinds)]
+
+
+def overlap(kinds, other_kinds):
+    """Return True if a file can be of one of the kinds and of one of the
+    other kinds"""
+    return any(
+        _kinds_overlap(kind, other_kind) for kind in kinds for other_kind in other_kinds
+    )
+
+
+def _kinds_overlap(kind, other_kind):
+    if ANY in (kind, other_kind) or kind == other_kind:
+        return True
+    return _KIND_EXTENSIONS.get(kind, kind) == _KIND_EXTENSIONS.get(
+        other_kind, other_kind
+    )
@@ -0,0 +1,285 @@
+import os
+import stat
+import subprocess
+import threading
+import time
+
+from .log import logger
+
+_NULL_MODE = b"000000"
+_FILE_MODES = (_NULL_MODE, b"100644", b"100755")
+
+
+class GitSession(object):
+    """Git commands of a migration run, in the repository of its directory.
+
+    The commands are run directly, without a shell. The long-lived processes
+    are started on first use: the revisions are resolved by a 'git cat-file
+    --batch-check', the changed files are stored by a 'git hash-object
+    --stdin-paths' and the commits are created by a 'git fast-import'.
+    Git only writes its index when the process updating it ends: a commit
+    still runs a 'git status' and a 'git update-index', instead of 'git add',
+    'git write-tree' and 'git commit'.
+
+    The session only holds its directory once sent to the worker processes:
+    they start their own long-lived process, if they need one.
+    """
+
+    def __init__(self, directory_path):
+        self._directory_path = directory_path
+        self._processes = {}
+        self._lock = threading.Lock()
+        # Options of the commits, read on the first one
+        self._commit_options = None
+        self._mark = 0
+
+    def __getstate__(self):
+        return {"_directory_path": self._directory_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["_directory_path"])
+
+    def run(self, *args, check=True):
+        """Run the git command, and return its output. If check is not set,
+        return None when the command fails, instead of raising
+        subprocess.CalledProcessError."""
+        logger.debug("Execute git: %s" % " ".join(args))
+        result = subprocess.run(
+            ("git",) + args,
+            cwd=str(self._directory_path),
+            stdout=subprocess.PIPE,
+            check=check,
+        )
+        return result.stdout if not result.returncode else None
+
+    def resolve(self, revision):
+        """Return the sha of the revision, or None if it does not exist"""
+        with self._lock:
+            line = self._communicate(
+                ("cat-file", "--batch-check"), revision.encode() + b"\n"
+            ).decode()
+        # '<sha> <type> <size>', or '<revision> missing'
+        sha, object_type = line.split()[:2]
+        return sha if object_type != "missing" else None
+
+    def get_head(self):
+        return self.resolve("HEAD")
+
+    def get_changed_folders(self, folder_names):
+        """Return the names of the folders with uncommitted changes, in a
+        single 'git status'"""
+        if not folder_names:
+            return set()
+        output = self.run(
+            "status", "--porcelain", "-z", "--no-renames", "--", *folder_names
+        )
+        # The paths are relative to the root of the repository
+        prefix = self.run("rev-parse", "--show-prefix").decode().strip()
+        res = set()
+        for entry in output.decode("utf-8", "surrogateescape").split("\0"):
+            path = entry[3:]
+            if path.startswith(prefix):
+                res.add(path[len(prefix) :].split("/")[0])
+        return res & set(folder_names)
+
+    def commit(self, message, pathspec="."):
+        """Stage all the changes of the pathspec, and commit them. Return the
+        sha of the commit, or None if there was nothing to commit."""
+        options = self._get_commit_options()
+        changes = self._get_changes(pathspec) if options else None
+        if changes is None:
+            # Not handled by fast-import: detached HEAD, signed commits,
+            # symbolic links, submodules, conflicts
+            return self._commit_index(message, pathspec)
+        if not changes:
+            return None
+        index_info = []
+        commands = []
+        for path, mode, sha, head_mode, head_sha in changes:
+            # The deleted files are removed from the index by a null mode
+            index_info.append(b"%s %s\t%s\0" % (mode, sha, path))
+            if (mode, sha) == (head_mode, head_sha):
+                continue
+            if mode != _NULL_MODE:
+                commands.append(b"M %s %s %s\n" % (mode, sha, _quote_path(path)))
+            elif head_mode != _NULL_MODE:
+                commands.append(b"D %s\n" % _quote_path(path))
+        # As 'git add --all', the changes are staged even if they match HEAD
+        self._run_input(
+            ("update-index", "-z", "--index-info"), b"".join(index_info)
+        )
+        if not commands:
+            return None
+        self._mark += 1
+        data = message.rstrip("\n").encode() + b"\n"
+        head = self.get_head()
+        commit = [
+            b"commit %s\n" % options["ref"],
+            b"mark :%d\n" % self._mark,
+            b"author %s\n" % _get_ident(options["author"], "GIT_AUTHOR_DATE"),
+            b"committer %s\n"
+            % _get_ident(options["committer"], "GIT_COMMITTER_DATE"),
+            b"data %d\n%s" % (len(data), data),
+        ]
+        if head:
+            commit.append(b"from %s\n" % head.encode())
+        # The branch is updated by the checkpoint
+        commit += commands + [b"\ncheckpoint\n\nget-mark :%d\n" % self._mark]
+        with self._lock:
+            sha = self._communicate(
+                ("fast-import", "--quiet"), b"".join(commit), cwd=options["top"]
+            )
+        return sha.decode().strip()
+
+    def _commit_index(self, message, pathspec):
+        self.run("add", "--all", "--", pathspec)
+        tree = self.run("write-tree").decode().strip()
+        head_tree = self.resolve("HEAD^{tree}")
+        if tree == head_tree:
+            return None
+        # Without commit yet, nothing is staged if the index is empty
+        if head_tree is None and not self.run("ls-files", "-z"):
+            return None
+        self.run("commit", "--no-verify", "-q", "-m", message)
+        return self.get_head()
+
+    def _get_commit_options(self):
+        """Return the options of the commits made by fast-import, or an empty
+        dict if they have to be made by 'git commit'"""
+        if self._commit_options is None:
+            ref = self.run("symbolic-ref", "-q", "HEAD", check=False)
+            sign = self.run("config", "--bool", "commit.gpgsign", check=False)
+            options = {}
+            if ref and (sign or b"").strip() != b"true":
+                file_mode = self.run("config", "--bool", "core.filemode", check=False)
+                top = self.run("rev-parse", "--show-toplevel").strip()
+                options = {
+                    "ref": ref.strip(),
+                    "top": os.fsdecode(top),
+                    "author": self.run("var", "GIT_AUTHOR_IDENT").strip(),
+                    "committer": self.run("var", "GIT_COMMITTER_IDENT").strip(),
+                    "file_mode": (file_mode or b"").strip() != b"false",
+                }
+            self._commit_options = options
+        return self._commit_options
+
+    def _get_changes(self, pathspec):
+        """Return (path, mode, sha, head_mode, head_sha) of the changed files
+        of the pathspec, the paths being relative to the root of the
+        repository, or None if one of them is not a regular file. The mode
+        of a deleted file is null, as the head one of a file not in HEAD."""
+        output = self.run(
+            "--no-optional-locks",
+            "status",
+            "--porcelain=v2",
+            "-z",
+            "-uall",
+            "--no-renames",
+            "--",
+            pathspec,
+        )
+        options = self._commit_options
+        res = []
+        for entry in output.split(b"\0"):
+            if entry.startswith(b"? "):
+                path = entry[2:]
+                file_stat = os.lstat(os.path.join(options["top"], os.fsdecode(path)))
+                if not stat.S_ISREG(file_stat.st_mode):
+                    return None
+                mode = b"100644"
+                if options["file_mode"] and file_stat.st_mode & stat.S_IXUSR:
+                    mode = b"100755"
+                res.append((path, mode, _NULL_MODE, None))
+            elif entry.startswith(b"1 "):
+                # '1 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <path>'
+                fields = entry.split(b" ", 8)
+                if fields[2] != b"N..." or fields[5] not in _FILE_MODES:
+                    return None
+                res.append((fields[8], fields[5], fields[3], fields[6]))
+            elif entry:
+                # Unmerged file
+                return None
+        shas = self._hash_files([x[0] for x in res if x[1] != _NULL_MODE])
+        return [
+            (
+                path,
+                mode,
+                shas[path] if mode != _NULL_MODE else b"0" * len(head_sha),
+                head_mode,
+                head_sha,
+            )
+            for path, mode, head_mode, head_sha in res
+        ]
+
+    def _hash_files(self, paths):
+        """Store the files in the repository, as 'git add' does, and return
+        their sha by path"""
+        if not paths:
+            return {}
+        with self._lock:
+            output = self._communicate(
+                ("hash-object", "-w", "--stdin-paths"),
+                b"".join(x + b"\n" for x in paths),
+                cwd=self._commit_options["top"],
+                line_count=len(paths),
+            )
+        return dict(zip(paths, output.split()))
+
+    def restore(self, pathspec):
+        """Restore the files of the pathspec as they are in HEAD, removing
+        the untracked ones"""
+        if (
+            self.run("reset", "-q", "HEAD", "--", pathspec, check=False) is not None
+            and self.run("checkout", "-q", "HEAD", "--", pathspec, check=False)
+            is not None
+        ):
+            self.run("clean", "-fdq", "--", pathspec, check=False)
+
+    def close(self):
+        with self._lock:
+            for process in self._processes.values():
+                process.stdin.close()
+                process.wait()
+            self._processes = {}
+
+    def _communicate(self, args, data, cwd=None, line_count=1):
+        """Write the data to the long-lived git process of the arguments, and
+        return the given number of lines of its output"""
+        process = self._processes.get(args)
+        if process is None:
+            process = self._processes[args] = subprocess.Popen(
+                ("git",) + args,
+                cwd=str(cwd or self._directory_path),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+        process.stdin.write(data)
+        process.stdin.flush()
+        lines = [process.stdout.readline() for x in range(line_count)]
+        if not all(lines):
+            raise subprocess.CalledProcessError(process.poll(), " ".join(args))
+        return b"".join(lines)
+
+    def _run_input(self, args, data):
+        logger.debug("Execute git: %s" % " ".join(args))
+        subprocess.run(
+            ("git",) + args, cwd=str(self._directory_path), input=data, check=True
+        )
+
+
+def _get_ident(ident, date_variable):
+    """Return the identity given by 'git var', dated now unless its date is
+    set in the environment"""
+    if os.environ.get(date_variable):
+        return ident
+    name, date, timezone = ident.rsplit(b" ", 2)
+    return b"%s %d %s" % (name, time.time(), timezone)
+
+
+def _quote_path(path):
+    """Return the path as written in a fast-import command"""
+    if not path.startswith(b'"') and b"\n" not in path:
+        return path
+    for char, escaped in ((b"\\", b"\\\\"), (b'"', b'\\"'), (b"\n", b"\\n")):
+        path = path.replace(char, escaped)
+    return b'"%s"' % path
@@ -0,0 +1,269 @@
+import functools
+import io
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .config import _ALLOWED_EXTENSIONS, _AVAILABLE_MIGRATION_STEPS
+from .exception import ConfigException
+from .file_encoding import forget_encodings
+from .log import logger
+from .migration import Migration
+from .script_registry import get_script_entries
+
+# Options of a job, with their type and default value. None marks the
+# required ones. (see parse_job_options())
+_JOB_OPTIONS = {
+    "directory": (str, None),
+    "init_version_name": (str, None),
+    "target_version_name": (str, _AVAILABLE_MIGRATION_STEPS[-1]["target_version_name"]),
+    "modules": (list, []),
+    "commit": (bool, True),
+    "pre_commit": (bool, True),
+    "remove_migration_folder": (bool, True),
+    "pipeline": (bool, True),
+    "file_jobs": (int, 1),
+    "incremental": (bool, False),
+    "dry_run": (bool, False),
+    "fsync": (bool, False),
+    "file_filter": (bool, True),
+    "max_file_sizes": (dict, {}),
+    "fused": (bool, False),
+}
+
+# End states of a job
+END_STATES = ("done", "failed")
+
+# Queue of the events sent by the current worker process to the pool, and
+# id of the job it runs (see _run_job())
+_EVENTS = None
+_JOB_ID = None
+
+
+class JobPool(object):
+    """Pool of worker processes running migration jobs (see server.py and
+    batch.py).
+
+    The migration scripts are imported and their rules compiled once, when
+    the pool is created, and the workers are started at once: a job starts
+    without paying for them, and all the jobs share the compiled rules.
+
+    The events of the jobs are passed to on_event(job_id, event_type, data),
+    from a thread of the pool:
+    - 'state': {'state': 'running', 'done' or 'failed', 'error': message},
+      the end state of a dry-run job having its 'patch' too
+    - 'module': {'module': module name, 'state': 'queued', 'running',
+      'done' or 'failed'}
+    - 'log': {'level': level name, 'message': message}
+
+    The last event of a job is its end state. It can be sent twice, if its
+    worker died after sending it.
+    """
+
+    def __init__(self, workers, on_event):
+        self._on_event = on_event
+        self._lock = threading.Lock()
+        # {job_id: Future} of the jobs not ended
+        self._futures = {}
+        context = multiprocessing.get_context()
+        self._events = context.SimpleQueue()
+        # The forked workers inherit the warm scripts, the other ones warm
+        # them up when they start
+        _warm_up()
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._events, logger.getEffectiveLevel()),
+        )
+        for future in [self._executor.submit(int) for __ in range(workers)]:
+            future.result()
+        self._reader = threading.Thread(target=self._read_events, daemon=True)
+        self._reader.start()
+
+    def submit(self, job_id, options):
+        """Run the job, options being the result of parse_job_options()"""
+        future = self._executor.submit(_run_job, job_id, options)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(functools.partial(self._check_job, job_id))
+
+    def _check_job(self, job_id, future):
+        with self._lock:
+            self._futures.pop(job_id, None)
+        # The job ends with its last event, unless its worker died
+        if future.cancelled():
+            error = "The job has been cancelled"
+        elif future.exception() is not None:
+            error = str(future.exception()) or future.exception().__class__.__name__
+        else:
+            return
+        self._on_event(job_id, "state", {"state": "failed", "error": error})
+
+    def _read_events(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            self._on_event(*event)
+
+    def close(self):
+        """Cancel the jobs not started, and wait for the running ones"""
+        with self._lock:
+            futures = list(self._futures.values())
+        for future in futures:
+            future.cancel()
+        self._executor.shutdown()
+        self._events.put(None)
+        self._reader.join()
+
+
+def parse_job_options(data):
+    """Return the options of a job from the JSON object of its request,
+    completed with their default values (see _JOB_OPTIONS). The options are
+    the ones of the command line. max_file_sizes is {extension: KiB}.
+    Raise a ConfigException if the options are not valid."""
+    if not isinstance(data, dict):
+        raise ConfigException("The job must be a JSON object")
+    unknown_names = sorted(set(data) - set(_JOB_OPTIONS))
+    if unknown_names:
+        raise ConfigException("Unknown option(s): %s" % ", ".join(unknown_names))
+    options = {}
+    for name, (option_type, default) in _JOB_OPTIONS.items():
+        value = data.get(name, default)
+        if value is None:
+            raise ConfigException("The option '%s' is required" % name)
+        if not isinstance(value, option_type) or (
+            option_type is int and isinstance(value, bool)
+        ):
+            raise ConfigException(
+                "The option '%s' must be a %s" % (name, option_type.__name__)
+            )
+        options[name] = value
+    if options["init_version_name"] not in [
+        x["init_version_name"] for x in _AVAILABLE_MIGRATION_STEPS
+    ]:
+        raise ConfigException(
+            "Unknown initial version '%s'" % options["init_version_name"]
+        )
+    if options["target_version_name"] not in [
+        x["target_version_name"] for x in _AVAILABLE_MIGRATION_STEPS
+    ]:
+        raise ConfigException(
+            "Unknown target version '%s'" % options["target_version_name"]
+        )
+    if not all(isinstance(x, str) for x in options["modules"]):
+        raise ConfigException("The option 'modules' must be a list of names")
+    max_file_sizes = {}
+    for extension, size in options["max_file_sizes"].items():
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            raise ConfigException("Invalid size of the '%s' files" % extension)
+        if not extension.startswith("."):
+            extension = "." + extension
+        max_file_sizes[extension] = size
+    options["max_file_sizes"] = max_file_sizes
+    options["directory"] = os.path.abspath(options["directory"])
+    if not os.path.isdir(options["directory"]):
+        raise ConfigException(
+            "Unable to find directory: %s" % options["directory"]
+        )
+    return options
+
+
+def _warm_up():
+    """Import all the migration scripts, and compile their rules"""
+    for script_entry in get_script_entries():
+        script = script_entry.load()
+        for extension in _ALLOWED_EXTENSIONS:
+            script.get_rule_plan(extension)
+
+
+def _init_worker(events, log_level):
+    global _EVENTS
+    _EVENTS = events
+    # On Ctrl+C, the pool lets the running jobs end (see JobPool.close())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logger.handlers = [_JobEventHandler()]
+    logger.propagate = False
+    logger.setLevel(log_level)
+    _warm_up()
+
+
+class _JobEventHandler(logging.Handler):
+    """Send the log records of the current job to the pool"""
+
+    def emit(self, record):
+        if _JOB_ID is not None:
+            _send_event(
+                "log", {"level": record.levelname, "message": self.format(record)}
+            )
+
+
+def _send_event(event_type, data):
+    _EVENTS.put((_JOB_ID, event_type, data))
+
+
+def _run_job(job_id, options):
+    """Run the migration of a job in a worker process. Its events are sent
+    to the pool, the last one being its end."""
+    global _JOB_ID
+    _JOB_ID = job_id
+    # The files of the previous jobs may have been saved since then
+    forget_encodings()
+    _send_event("state", {"state": "running"})
+    patch_file = io.StringIO() if options["dry_run"] else None
+    running_module_names = []
+
+    def progress(module_name, state):
+        if state == "running":
+            running_module_names.append(module_name)
+        else:
+            running_module_names.remove(module_name)
+        _send_event("module", {"module": module_name, "state": state})
+
+    state, error = "failed", "The migration has been interrupted"
+    try:
+        migration = Migration(
+            options["directory"],
+            options["init_version_name"],
+            options["target_version_name"],
+            module_names=list(options["modules"]),
+            commit_enabled=options["commit"],
+            pre_commit=options["pre_commit"],
+            remove_migration_folder=options["remove_migration_folder"],
+            pipeline=options["pipeline"],
+            file_jobs=options["file_jobs"],
+            incremental=options["incremental"],
+            dry_run=options["dry_run"] and "-",
+            fsync=options["fsync"],
+            file_filter=options["file_filter"],
+            max_file_sizes={
+                extension: size * 1024
+                for extension, size in options["max_file_sizes"].items()
+            },
+            fused=options["fused"],
+        )
+        for module_migration in migration._module_migrations:
+            _send_event(
+                "module", {"module": module_migration._module_name, "state": "queued"}
+            )
+        migration.run(patch_file=patch_file, progress=progress)
+        state, error = "done", None
+    except Exception as e:
+        logger.exception("Unable to run the migration")
+        error = str(e) or e.__class__.__name__
+        for module_name in running_module_names:
+            _send_event("module", {"module": module_name, "state": "failed"})
+    finally:
+        _send_event(
+            "state",
+            {
+                "state": state,
+                "error": error,
+                "patch": patch_file.getvalue() if patch_file else None,
+            },
+        )
+        _JOB_ID = None
@@ -0,0 +1,137 @@
+import json
+import os
+import time
+
+from .cache import get_cache_directory
+from .config import _JOURNAL_FILE_NAME
+from .exception import ConfigException
+from .log import logger
+
+
+def get_script_name(migration_script):
+    return "%s.%s" % (
+        migration_script.__class__.__module__,
+        migration_script.__class__.__name__,
+    )
+
+
+class RunJournal(object):
+    """Journal of the last migration run of a repository, in its cache
+    directory. The events of the run are appended as they happen, one JSON
+    object per line, so that the journal survives a crash of the run:
+
+    - 'run': start of the run, with its versions and scripts
+    - 'resume': start of a run resuming the previous one
+    - 'module_start': start of the migration of a module, and if the module
+      had uncommitted changes at that time
+    - 'script_start', 'script_done': run of a script on a module, with the
+      scripts fused with it
+    - 'module_done': changes of a module written on the disk
+    - 'module_commit': changes of a module committed, with the sha of the
+      commit (None if there was nothing to commit)
+    - 'run_done': end of the run
+
+    The journal only holds its path, and the modules with uncommitted
+    changes when the run started, so that it can be sent to the worker
+    processes.
+    """
+
+    def __init__(self, directory_path, header):
+        self._path = os.path.join(
+            get_cache_directory(str(directory_path)), _JOURNAL_FILE_NAME
+        )
+        self._header = header
+        # Names of the modules with uncommitted changes, or None if unknown
+        self._changed_module_names = None
+
+    def start(self, resume=False):
+        """Start the journal of the run. If resume is set, return the state
+        of the previous run, if it did not end (see get_resume_state())."""
+        resume_state = resume and self.get_resume_state() or None
+        if resume_state is None:
+            with open(self._path, "w", encoding="utf-8"):
+                pass
+            self.write("run", sync=True, **self._header)
+        else:
+            # End the line partially written when the previous run died
+            with open(self._path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            self.write("resume", sync=True)
+        return resume_state
+
+    def end(self):
+        self.write("run_done", sync=True)
+
+    def get_resume_state(self):
+        """Return the names of the modules completed by the previous run,
+        and {module name: had uncommitted changes} of the modules it started
+        without completing them. Return None if the previous run ended.
+
+        With commits, the modules are completed once committed, otherwise
+        once written on the disk."""
+        records = []
+        if os.path.exists(self._path):
+            with open(self._path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Line partially written when the run died
+                        continue
+        if not records or records[0].get("event") != "run":
+            logger.warning("No previous run to resume, starting a new one")
+            return None
+        if records[-1].get("event") == "run_done":
+            logger.info("The previous run ended, starting a new one")
+            return None
+        if any(records[0].get(key) != value for key, value in self._header.items()):
+            raise ConfigException(
+                "Unable to resume the previous run, from %s to %s: the versions,"
+                " scripts or commit option of the migration changed"
+                % (
+                    records[0].get("init_version_name"),
+                    records[0].get("target_version_name"),
+                )
+            )
+        completed_event = self._header["commit"] and "module_commit" or "module_done"
+        completed_module_names = set()
+        started_modules = {}
+        for record in records:
+            if record.get("event") == "module_start":
+                started_modules[record["module"]] = record["has_changes"]
+            elif record.get("event") == completed_event:
+                completed_module_names.add(record["module"])
+        return completed_module_names, {
+            module_name: has_changes
+            for module_name, has_changes in started_modules.items()
+            if module_name not in completed_module_names
+        }
+
+    def write(self, event, sync=False, **values):
+        """Append an event to the journal. With sync, the journal is flushed
+        to the disk."""
+        values.update(event=event, time=time.time())
+        line = json.dumps(values, sort_keys=True) + "\n"
+        with open(self._path, "a", encoding="utf-8") as f:
+            f.write(line)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def set_changed_modules(self, module_names):
+        """Set the names of the modules with uncommitted changes, read at
+        once for all the modules of the run"""
+        self._changed_module_names = set(module_names)
+
+    def start_module(self, module_name):
+        # Without the changes (not a git repository), they can not be rolled
+        # back
+        has_changes = (
+            self._changed_module_names is None
+            or module_name in self._changed_module_names
+        )
+        self.write(
+            "module_start", sync=True, module=module_name, has_changes=has_changes
+        )
@@ -1,11 +1,16 @@
 
 from colorama import Fore, Style
+from contextlib import contextmanager
+import threading
 import time
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Log records held by the current thread, if any (see buffer_log_records())
+_THREAD_BUFFER = threading.local()
+
 LEVEL_COLORS = {
     "DEBUG": Fore.BLUE,
     "INFO": Fore.GREEN,
@@ -30,6 +35,30 @@ def setup_logger(level, file_path=False):
     logger.setLevel(getattr(logging, str(level)))
 
 
+@contextmanager
+def buffer_log_records():
+    """Hold the log records emitted by the current thread in the yielded
+    list, instead of emitting them. (see tools._map_files())"""
+    previous_records = getattr(_THREAD_BUFFER, "records", None)
+    _THREAD_BUFFER.records = records = []
+    try:
+        yield records
+    finally:
+        _THREAD_BUFFER.records = previous_records
+
+
+class _ThreadBufferFilter(logging.Filter):
+    def filter(self, record):
+        records = getattr(_THREAD_BUFFER, "records", None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
+logger.addFilter(_ThreadBufferFilter())
+
+
 class OdooMigrateFormatter(logging.Formatter):
     def format(self, record):
         """Overwrite format() function to use custom formatter"""
@@ -66,3 +95,21 @@ class OdooMigrateFormatter(logging.Formatter):
         ]
 
         return "".join(reset + asctime + levelname + reset)
+
+
+class LogRecordCollector(logging.Handler):
+    """Keep the log records, to emit them later, possibly in another
+    process. (see Migration._run_parallel())"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # Render the message, so that the record can be pickled
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
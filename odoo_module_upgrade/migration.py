@@ -1,16 +1,21 @@
 
-import importlib
+import hashlib
 import os
 import pathlib
-import pkgutil
 import inspect
+import subprocess
+import sys
+import time
 
 from .config import _AVAILABLE_MIGRATION_STEPS, _MANIFEST_NAMES
-from .exception import ConfigException
-from .log import logger
+from .exception import ConfigException, OdooMigrateException
+from .log import logger, LogRecordCollector
 from .tools import _execute_shell, _get_latest_version_code
 from .module_migration import ModuleMigration
-from .base_migration_script import BaseMigrationScript
+from .cache import get_fingerprint
+from .git_session import GitSession
+from .journal import RunJournal, get_script_name
+from .script_registry import select_script_entries
 
 
 class Migration:
@@ -25,12 +30,58 @@ class Migration:
         commit_enabled=True,
         pre_commit=True,
         remove_migration_folder=True,
+        pipeline=True,
+        jobs=1,
+        file_jobs=1,
+        incremental=False,
+        dry_run=False,
+        fsync=False,
+        file_filter=True,
+        max_file_sizes=None,
+        fused=False,
+        journal=True,
+        resume=False,
     ):
         if not module_names:
             module_names = []
+        if jobs < 1 or file_jobs < 1:
+            raise ConfigException("The number of jobs must be at least 1")
+        if incremental and not pipeline:
+            raise ConfigException(
+                "Incremental mode can not be used without the pipeline"
+            )
+        if dry_run and not pipeline:
+            raise ConfigException("Dry-run mode can not be used without the pipeline")
+        if dry_run and format_patch:
+            raise ConfigException(
+                "Dry-run mode can not be used with the format patch option"
+            )
+        if resume and (dry_run or not journal):
+            raise ConfigException(
+                "A run can not be resumed in dry-run mode, nor without journal"
+            )
         self._commit_enabled = commit_enabled
         self._pre_commit = pre_commit
         self._remove_migration_folder = remove_migration_folder
+        self._pipeline = pipeline
+        self._jobs = jobs
+        self._file_jobs = file_jobs
+        self._incremental = incremental
+        self._fingerprint = False
+        # False, or '-' to write the patch on the standard output, or the
+        # path of the patch file
+        self._dry_run = dry_run
+        self._fsync = fsync
+        # Skip the ignored, vendored, minified and oversized files
+        # (see file_filter.py). {extension: size in bytes}
+        self._file_filter = file_filter
+        self._max_file_sizes = max_file_sizes or {}
+        self._fused = fused
+        # Journal of the run, to resume it if it is interrupted (see
+        # journal.py)
+        self._journal = journal and not dry_run
+        self._resume = resume
+        self._run_journal = None
         self._migration_steps = []
         self._migration_scripts = []
         self._module_migrations = []
@@ -64,6 +115,7 @@ class Migration:
 
         root_path = pathlib.Path(relative_directory_path)
         self._directory_path = pathlib.Path(root_path.resolve(strict=True))
+        self._git = GitSession(self._directory_path)
 
         # format-patch, if required
         if format_patch:
@@ -99,12 +151,32 @@ class Migration:
         for module_name in module_names:
             self._module_migrations.append(ModuleMigration(self, module_name))
 
-        if os.path.exists(".pre-commit-config.yaml") and self._pre_commit:
+        if (
+            os.path.exists(".pre-commit-config.yaml")
+            and self._pre_commit
+            and not self._dry_run
+        ):
             self._run_pre_commit(module_names)
 
         # get migration scripts, depending to the migration list
         self._get_migration_scripts()
 
+        if self._incremental:
+            self._fingerprint = get_fingerprint(
+                self._migration_steps, self._migration_scripts
+            )
+
+        if self._journal:
+            self._run_journal = RunJournal(
+                self._directory_path,
+                {
+                    "init_version_name": init_version_name,
+                    "target_version_name": target_version_name,
+                    "scripts": [get_script_name(x) for x in self._migration_scripts],
+                    "commit": self._commit_enabled,
+                },
+            )
+
     def _run_pre_commit(self, module_names):
         logger.info("Run pre-commit")
         _execute_shell(
@@ -112,12 +184,8 @@ class Migration:
         )
         if self._commit_enabled:
             logger.info("Stage and commit changes done by pre-commit")
-            _execute_shell("git add -A", path=self._directory_path)
-            _execute_shell(
-                "git commit -m '[IMP] %s: pre-commit execution' --no-verify"
-                % ", ".join(module_names),
-                path=self._directory_path,
-                raise_error=False,  # Don't fail if there is nothing to commit
+            self._git.commit(
+                "[IMP] %s: pre-commit execution" % ", ".join(module_names), ":/"
             )
 
     def _is_module_path(self, module_path):
@@ -166,57 +234,17 @@ class Migration:
             path=self._directory_path,
         )
 
-    def _load_migration_script(self, full_name):
-        module = importlib.import_module(full_name)
-        result = [
-            x[1]()
-            for x in inspect.getmembers(module, inspect.isclass)
-            if x[0] != "BaseMigrationScript" and issubclass(x[1], BaseMigrationScript)
-        ]
-        return result
-
     def _get_migration_scripts(self):
-        # Add the script that will be allways executed
-        self._migration_scripts.extend(
-            self._load_migration_script(
-                "odoo_module_upgrade.upgrade_scripts.migrate_allways"
-            )
+        # The scripts run allways first, then the ones of the migration
+        # steps. Only the selected scripts are imported.
+        script_entries = select_script_entries(
+            self._migration_steps[0]["init_version_code"],
+            self._migration_steps[-1]["target_version_code"],
+            _get_latest_version_code(),
+            remove_migration_folder=self._remove_migration_folder,
         )
-        if self._remove_migration_folder:
-            self._migration_scripts.extend(
-                self._load_migration_script(
-                    "odoo_module_upgrade.upgrade_scripts."
-                    "migrate_remove_migration_folder"
-                )
-            )
-        all_packages = importlib.import_module("odoo_module_upgrade.upgrade_scripts")
-
-        migration_start = float(self._migration_steps[0]["init_version_code"])
-        migration_end = float(self._migration_steps[-1]["target_version_code"])
-
-        for loader, name, is_pkg in pkgutil.walk_packages(all_packages.__path__):
-            # Ignore script that will be allways executed.
-            # this script will be added at the end.
-            if name in ("migrate_allways", "migrate_remove_migration_folder"):
-                continue
-
-            # Filter migration scripts, depending of the configuration
-            full_name = all_packages.__name__ + "." + name
-            if "allways" in name:
-                # replace allways by the most recent version
-                real_name = name.replace("allways", _get_latest_version_code())
-            else:
-                real_name = name
-            splitted_name = real_name.split("_")
-
-            script_start = float(splitted_name[1])
-            script_end = float(splitted_name[2])
-
-            # Exclude scripts
-            if script_start >= migration_end or script_end <= migration_start:
-                continue
-
-            self._migration_scripts.extend(self._load_migration_script(full_name))
+        for script_entry in script_entries:
+            self._migration_scripts.append(script_entry.load())
 
         logger.debug(
             "The following migration script will be"
@@ -229,7 +257,14 @@ class Migration:
             )
         )
 
-    def run(self):
+    def run(self, patch_file=None, progress=None):
+        """Migrate the modules.
+
+        patch_file: file to write the dry-run patch in, instead of the one
+        given by the dry_run option.
+        progress: function called with (module_name, state) when the
+        migration of a module starts ('running') and ends ('done').
+        """
         logger.debug(
             "Running migration from: %s to: %s in '%s'"
             % (
@@ -238,5 +273,242 @@ class Migration:
                 self._directory_path.resolve(),
             )
         )
+        # In dry-run mode, the changes are written as a single patch
+        # The files not encoded in utf-8 are kept in their own encoding, see
+        # workspace._get_patch_text()
+        own_patch_file = patch_file is None and bool(self._dry_run)
+        if own_patch_file and self._dry_run == "-":
+            sys.stdout.flush()
+            patch_file = open(
+                sys.stdout.fileno(),
+                "w",
+                encoding="utf-8",
+                errors="surrogateescape",
+                newline="",
+                closefd=False,
+            )
+        elif own_patch_file:
+            patch_file = open(
+                self._dry_run,
+                "w",
+                encoding="utf-8",
+                errors="surrogateescape",
+                newline="",
+            )
+        try:
+            module_migrations = self._start_journal()
+            if self._jobs > 1 and len(module_migrations) > 1:
+                self._run_parallel(module_migrations, patch_file, progress)
+            else:
+                for module_migration in module_migrations:
+                    if progress:
+                        progress(module_migration._module_name, "running")
+                    diff = module_migration.migrate_files()
+                    self._end_module_migration(
+                        module_migration, diff, patch_file, progress
+                    )
+            if self._run_journal:
+                self._run_journal.end()
+        finally:
+            self._git.close()
+            if own_patch_file:
+                patch_file.close()
+                if self._dry_run != "-":
+                    logger.info("Patch written in %s" % self._dry_run)
+
+    def _start_journal(self):
+        """Start the journal of the run, and return the module migrations
+        to run. When resuming, the modules completed by the previous run are
+        skipped, and the files of the ones it left in progress are rolled
+        back, if they had no uncommitted changes before."""
+        if not self._run_journal:
+            return self._module_migrations
+        resume_state = self._run_journal.start(self._resume)
+        if resume_state is None:
+            self._set_changed_modules(self._module_migrations)
+            return self._module_migrations
+        completed_module_names, started_modules = resume_state
+        module_migrations = []
         for module_migration in self._module_migrations:
-            module_migration.run()
+            module_name = module_migration._module_name
+            if module_name in completed_module_names:
+                logger.info("[%s] Skipping the module, already migrated" % module_name)
+                continue
+            if module_name in started_modules:
+                if started_modules[module_name]:
+                    logger.warning(
+                        "[%s] Unable to roll back the interrupted migration, as"
+                        " the module had uncommitted changes: migrating it again"
+                        " on its current files" % module_name
+                    )
+                else:
+                    logger.info(
+                        "[%s] Rolling back the interrupted migration" % module_name
+                    )
+                    self._git.restore(module_name)
+            module_migrations.append(module_migration)
+        self._set_changed_modules(module_migrations)
+        logger.info(
+            "Resuming the previous run: %d module(s) already migrated, %d to"
+            " migrate"
+            % (
+                len(self._module_migrations) - len(module_migrations),
+                len(module_migrations),
+            )
+        )
+        return module_migrations
+
+    def _set_changed_modules(self, module_migrations):
+        try:
+            self._run_journal.set_changed_modules(
+                self._git.get_changed_folders(
+                    [x._module_name for x in module_migrations]
+                )
+            )
+        except subprocess.CalledProcessError:
+            # Not a git repository
+            pass
+
+    def watch(self):
+        """Migrate again the files of the modules changed on the disk, until
+        interrupted. The compiled rules are kept, and only the changed files
+        are processed, with the global functions reading files of their
+        kinds (see ModuleMigration.migrate_changed_files())."""
+        if self._dry_run:
+            raise ConfigException("Watch mode can not be used with dry-run mode")
+        if not self._pipeline:
+            raise ConfigException("Watch mode can not be used without the pipeline")
+        # Imported on first use, as only the watch mode needs it
+        from .watcher import get_file_watcher
+
+        module_migrations = {
+            os.path.join(str(x._module_path), ""): x for x in self._module_migrations
+        }
+        watcher = get_file_watcher([x._module_path for x in self._module_migrations])
+        logger.info(
+            "Watching %d module(s) for changes. Press Ctrl+C to stop."
+            % len(self._module_migrations)
+        )
+        # {file_path: hash of its content, once migrated}, to ignore the
+        # changes made by the migration itself
+        hashes = {}
+        try:
+            while True:
+                file_paths_by_module = {}
+                for file_path in watcher.get_changes():
+                    file_hash = _hash_file(file_path)
+                    if file_hash is None or hashes.get(file_path) == file_hash:
+                        continue
+                    for module_path, module_migration in module_migrations.items():
+                        if file_path.startswith(module_path):
+                            file_paths_by_module.setdefault(
+                                module_migration, []
+                            ).append(file_path)
+                for module_migration in self._module_migrations:
+                    if module_migration not in file_paths_by_module:
+                        continue
+                    start = time.perf_counter()
+                    try:
+                        file_paths = module_migration.migrate_changed_files(
+                            file_paths_by_module[module_migration]
+                        )
+                    except Exception:
+                        logger.exception(
+                            "[%s] Unable to migrate the changed files"
+                            % module_migration._module_name
+                        )
+                        continue
+                    for file_path in file_paths:
+                        hashes[file_path] = _hash_file(file_path)
+                    if file_paths:
+                        logger.info(
+                            "[%s] Migrated in %d ms"
+                            % (
+                                module_migration._module_name,
+                                (time.perf_counter() - start) * 1000,
+                            )
+                        )
+        finally:
+            watcher.close()
+
+    def _end_module_migration(self, module_migration, diff, patch_file, progress):
+        if patch_file is None:
+            module_migration.commit()
+        elif diff:
+            patch_file.write(diff)
+            patch_file.flush()
+        if progress:
+            progress(module_migration._module_name, "done")
+
+    def _run_parallel(self, module_migrations, patch_file, progress):
+        """Migrate the files of the modules in a pool of processes, then
+        commit the changes module by module, in the initial order. The logs
+        of each module are emitted together, before its commit."""
+        # Imported on first use, as multiprocessing is slow to import
+        from concurrent.futures import ProcessPoolExecutor
+
+        jobs = min(self._jobs, len(module_migrations))
+        logger.info(
+            "Migrating %d modules with %d processes" % (len(module_migrations), jobs)
+        )
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(logger.getEffectiveLevel(),),
+        ) as executor:
+            futures = [
+                executor.submit(_migrate_module_files, module_migration)
+                for module_migration in module_migrations
+            ]
+            if progress:
+                for module_migration in module_migrations:
+                    progress(module_migration._module_name, "running")
+            for module_migration, future in zip(module_migrations, futures):
+                records, failed, diff = future.result()
+                for record in records:
+                    logger.handle(record)
+                if failed:
+                    for future in futures:
+                        future.cancel()
+                    raise OdooMigrateException(
+                        "Migration of the module %s failed"
+                        % module_migration._module_name
+                    )
+                self._end_module_migration(
+                    module_migration, diff, patch_file, progress
+                )
+
+
+def _hash_file(file_path):
+    try:
+        with open(file_path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _init_worker(log_level):
+    # The records are sent back to the main process, that emits them
+    logger.handlers = []
+    logger.propagate = False
+    logger.setLevel(log_level)
+
+
+def _migrate_module_files(module_migration):
+    """Run the file-rewriting phase of a module migration in a worker.
+    Return the log records, if the migration failed, and the diff of the
+    module in dry-run mode."""
+    collector = LogRecordCollector()
+    logger.addHandler(collector)
+    failed = False
+    diff = None
+    try:
+        diff = module_migration.migrate_files()
+    except Exception:
+        logger.exception(
+            "[%s] Unable to migrate the module" % module_migration._module_name
+        )
+        failed = True
+    finally:
+        logger.removeHandler(collector)
+    return collector.records, failed, diff
@@ -1,8 +1,17 @@
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from .log import logger
 
-from .config import _MANIFEST_NAMES
-from .tools import _execute_shell
+from .cache import ModuleCache
+from .config import _ALLOWED_EXTENSIONS, _MANIFEST_NAMES
+from .file_filter import FileFilter
+from .function_graph import MANIFEST, get_reading_functions
+from .journal import get_script_name
+from .workspace import Workspace
+from . import file_encoding
+from . import tools
 
 
 class ModuleMigration:
@@ -17,6 +26,14 @@ class ModuleMigration:
         self._module_path = self._migration._directory_path / module_name
 
     def run(self):
+        diff = self.migrate_files()
+        self.commit()
+        return diff
+
+    def migrate_files(self):
+        """Apply the migration scripts on the files of the module.
+        In dry-run mode, return the changes as a git patch, without
+        applying them."""
         logger.info(
             "[%s] Running migration from %s to %s"
             % (
@@ -26,64 +43,237 @@ class ModuleMigration:
             )
         )
 
-        # Apply migration script
-        for migration_script in self._migration._migration_scripts:
-            migration_script.run(
+        run_journal = self._migration._run_journal
+        if run_journal:
+            run_journal.start_module(self._module_name)
+
+        file_filter = None
+        if self._migration._file_filter:
+            file_filter = FileFilter(
                 self._module_path,
-                self._get_manifest_path(),
-                self._module_name,
-                self._migration._migration_steps,
+                self._migration._max_file_sizes,
+                ignore_file_folders=[self._migration._directory_path],
+            )
+
+        # In pipeline mode, each file is read once and written at most once,
+        # all the migration scripts working on the in-memory content
+        workspace = None
+        if self._migration._pipeline:
+            workspace = Workspace(
+                self._module_path,
+                virtual=bool(self._migration._dry_run),
+                file_filter=file_filter,
+            )
+
+        # In incremental mode, the files unchanged since their last migration
+        # are kept as they are
+        cache = None
+        if self._migration._incremental:
+            cache = ModuleCache(
                 self._migration._directory_path,
-                self._migration._commit_enabled,
+                self._module_name,
+                self._migration._fingerprint,
             )
+            skipped_count = cache.freeze_migrated_files(self._module_path, workspace)
+            if skipped_count:
+                logger.info(
+                    "[%s] Skipping %d file(s) unchanged since their last migration"
+                    % (self._module_name, skipped_count)
+                )
+
+        # Files can be processed in a pool of threads (see tools._map_files())
+        executor = None
+        if self._migration._file_jobs > 1:
+            executor = ThreadPoolExecutor(max_workers=self._migration._file_jobs)
+        try:
+            with tools._use_workspace(workspace), tools._use_file_filter(
+                file_filter
+            ), tools._use_file_executor(executor):
+                # Apply migration script. In fused mode, the files of the
+                # consecutive scripts are processed in one pass, as long as
+                # the module functions of the scripts don't access the files
+                # of the next ones (see BaseMigrationScript.can_fuse()).
+                migration_scripts = self._migration._migration_scripts
+                fused_scripts = []
+                for index, migration_script in enumerate(migration_scripts):
+                    next_scripts = migration_scripts[index + 1 : index + 2]
+                    if (
+                        self._migration._fused
+                        and next_scripts
+                        and all(
+                            x.can_fuse(next_scripts[0])
+                            for x in fused_scripts + [migration_script]
+                        )
+                    ):
+                        fused_scripts.append(migration_script)
+                        continue
+                    if run_journal:
+                        run_journal.write(
+                            "script_start",
+                            module=self._module_name,
+                            script=get_script_name(migration_script),
+                            fused_scripts=[get_script_name(x) for x in fused_scripts],
+                        )
+                    migration_script.run(
+                        self._module_path,
+                        self._get_manifest_path(),
+                        self._module_name,
+                        self._migration._migration_steps,
+                        self._migration._directory_path,
+                        self._migration._commit_enabled,
+                        fused_scripts,
+                    )
+                    if run_journal:
+                        run_journal.write(
+                            "script_done",
+                            module=self._module_name,
+                            script=get_script_name(migration_script),
+                        )
+                    fused_scripts = []
+                if file_filter:
+                    file_filter.log_skipped(self._module_name)
+                if workspace and workspace.virtual:
+                    return workspace.get_diff(self._migration._directory_path)
+                if cache:
+                    cache.update(self._module_path, workspace)
+                if workspace:
+                    workspace.flush(sync=self._migration._fsync)
+                if cache:
+                    cache.save(self._module_path)
+                if run_journal:
+                    run_journal.write(
+                        "module_done", sync=True, module=self._module_name
+                    )
+        finally:
+            if executor:
+                executor.shutdown()
+
+    def migrate_changed_files(self, file_paths):
+        """Apply the migration scripts again on the given files of the module,
+        changed since its migration, then run the global functions reading
+        files of their kinds. The changes are written on the disk, without
+        committing them. Return the paths of the files read or written.
 
-        self._commit_changes(
+        Only the changed files are indexed: the global functions listing the
+        files of the module don't see the other ones. (see Migration.watch())
+        """
+        # The files may have been saved in another encoding
+        file_encoding.forget_encodings(file_paths)
+        file_filter = None
+        if self._migration._file_filter:
+            file_filter = FileFilter(
+                self._module_path,
+                self._migration._max_file_sizes,
+                ignore_file_folders=[self._migration._directory_path],
+            )
+        workspace = Workspace(
+            self._module_path, file_filter=file_filter, file_paths=file_paths
+        )
+        with tools._use_workspace(workspace):
+            # The changed files excluded by the file filter are not indexed
+            file_paths = set(
+                str(x) for x in tools.get_files(self._module_path, _ALLOWED_EXTENSIONS)
+            )
+            if not file_paths:
+                return []
+            logger.info(
+                "[%s] Migrating %d changed file(s)"
+                % (self._module_name, len(file_paths))
+            )
+            kinds = set(os.path.splitext(x)[1] for x in file_paths)
+            if any(os.path.basename(x) in _MANIFEST_NAMES for x in file_paths):
+                kinds.add(MANIFEST)
+            processed_file_paths = set(file_paths)
+            for migration_script in self._migration._migration_scripts:
+                rule_set = migration_script.get_rule_set()
+                new_file_paths = []
+                for file_path in sorted(file_paths):
+                    root, file_name = os.path.split(file_path)
+                    if os.path.splitext(file_name)[1] not in _ALLOWED_EXTENSIONS:
+                        continue
+                    migration_script.process_file(
+                        root,
+                        file_name,
+                        os.path.splitext(file_name)[1],
+                        rule_set.file_renames,
+                        self._migration._directory_path,
+                        False,
+                    )
+                    new_file_paths.append(
+                        os.path.join(
+                            root, rule_set.file_renames.get(file_name, file_name)
+                        )
+                    )
+                file_paths = new_file_paths
+                processed_file_paths.update(file_paths)
+                if MANIFEST in kinds:
+                    migration_script.handle_deprecated_modules(
+                        self._get_manifest_path(), rule_set.deprecated_modules
+                    )
+                global_functions = get_reading_functions(
+                    rule_set.global_functions, kinds
+                )
+                if global_functions:
+                    tools._run_functions(
+                        global_functions,
+                        logger=logger,
+                        module_path=self._module_path,
+                        module_name=self._module_name,
+                        manifest_path=self._get_manifest_path(),
+                        migration_steps=self._migration._migration_steps,
+                        tools=tools,
+                    )
+            processed_file_paths.update(x[0] for x in workspace.get_files())
+            workspace.flush(sync=self._migration._fsync)
+        return sorted(processed_file_paths)
+
+    def commit(self):
+        sha = self._commit_changes(
             "[MIG] %s: Migration to %s"
             % (
                 self._module_name,
                 self._migration._migration_steps[-1]["target_version_name"],
             )
         )
+        run_journal = self._migration._run_journal
+        if run_journal and self._migration._commit_enabled:
+            run_journal.write(
+                "module_commit", sync=True, module=self._module_name, sha=sha
+            )
 
     def _get_manifest_path(self):
         for manifest_name in _MANIFEST_NAMES:
             manifest_path = self._module_path / manifest_name
-            if manifest_path.exists():
+            if tools._exists(manifest_path):
                 return manifest_path
 
     def _rename_file(self, module_path, old_file_path, new_file_path):
         """
-        Rename a file. try to execute 'git mv', to avoid huge diff.
-
-        if 'git mv' fails, make a classical rename
+        Rename a file, see BaseMigrationScript._rename_file()
         """
-        logger.info(
-            "Renaming file: '%s' by '%s' "
-            % (
-                old_file_path.replace(str(module_path.resolve()), ""),
-                new_file_path.replace(str(module_path.resolve()), ""),
-            )
+        message = "Renaming file: '%s' by '%s' " % (
+            old_file_path.replace(str(module_path.resolve()), ""),
+            new_file_path.replace(str(module_path.resolve()), ""),
         )
-        if self._migration._commit_enabled:
-            _execute_shell(
-                "git mv %s %s" % (old_file_path, new_file_path), path=module_path
-            )
+        if tools._has_rename_plan():
+            logger.debug(message)
         else:
-            _execute_shell(
-                "mv %s %s" % (old_file_path, new_file_path), path=module_path
-            )
+            logger.info(message)
+        tools._rename(old_file_path, new_file_path)
 
     def _commit_changes(self, commit_name):
-        if not self._migration._commit_enabled:
-            return
+        """Commit the changes, and return the sha of the commit, or None if
+        there was nothing to commit"""
+        if not self._migration._commit_enabled or self._migration._dry_run:
+            return None
 
-        if _execute_shell("git diff", path=self._migration._directory_path):
+        # With parallel jobs, the changes of all the modules are on the disk
+        # when committing: each commit is restricted to its own module
+        pathspec = self._module_name if self._migration._jobs > 1 else "."
+        sha = self._migration._git.commit(commit_name, pathspec)
+        if sha:
             logger.info(
                 "Commit changes for %s. commit name '%s'"
                 % (self._module_name, commit_name)
             )
-
-            _execute_shell(
-                " git add . --all && git commit --no-verify -m '%s'" % (commit_name),
-                path=self._migration._directory_path,
-            )
+        return sha
@@ -0,0 +1,241 @@
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
+
+from .scanner import Scanner, sre_parse
+
+# Shorter anchors are not worth a substring scan
+_MIN_ANCHOR_LENGTH = 2
+
+# Scanners kept by a RulePlan, the least recently used being dropped: one
+# per combination of candidate rules found in the files
+_MAX_SCANNERS = 32
+
+
+class RuleSet(
+    namedtuple(
+        "RuleSet",
+        [
+            "text_replaces",
+            "text_errors",
+            "text_warnings",
+            "deprecated_modules",
+            "file_renames",
+            "removed_fields",
+            "renamed_fields",
+            "renamed_models",
+            "removed_models",
+            "global_functions",
+        ],
+    )
+):
+    """Frozen, precompiled rules of a migration script.
+
+    text_replaces: {filetype: ((re.Pattern, replacement), ...)}
+    text_errors / text_warnings: {filetype: ((re.Pattern, message), ...)}
+    deprecated_modules, removed_fields, renamed_fields, renamed_models,
+    removed_models: tuples of tuples, as declared in the yaml files.
+    file_renames: {old_name: new_name}
+    global_functions: (function, ...)
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_rules(cls, rules):
+        """Build a RuleSet from the raw rules returned by
+        BaseMigrationScript.parse_rules()"""
+        return cls(
+            text_replaces=_compile_dict_of_dict(rules["_TEXT_REPLACES"], True),
+            text_errors=_compile_dict_of_dict(rules["_TEXT_ERRORS"]),
+            text_warnings=_compile_dict_of_dict(rules["_TEXT_WARNINGS"]),
+            deprecated_modules=_to_tuples(rules["_DEPRECATED_MODULES"]),
+            file_renames=MappingProxyType(dict(rules["_FILE_RENAMES"])),
+            removed_fields=_to_tuples(rules["_REMOVED_FIELDS"]),
+            renamed_fields=_to_tuples(rules["_RENAMED_FIELDS"]),
+            renamed_models=_to_tuples(rules["_RENAMED_MODELS"]),
+            removed_models=_to_tuples(rules["_REMOVED_MODELS"]),
+            global_functions=tuple(rules["_GLOBAL_FUNCTIONS"]),
+        )
+
+
+class RulePlan(object):
+    """Text rules to apply on the files of a given extension.
+
+    replaces: ((re.Pattern, replacement, anchors), ...), applied in this order
+    errors / warnings: ((re.Pattern, message, anchors), ...)
+
+    anchors are the literal strings derived from the pattern: any text
+    matched by the pattern contains at least one of them. None if no anchor
+    could be derived, in which case the rule is always applied.
+
+    literals: anchors of all the rules, a text containing none of them being
+    left as it is without findings. None if a rule has no anchor.
+    """
+
+    __slots__ = (
+        "replaces",
+        "errors",
+        "warnings",
+        "literals",
+        "_scanners",
+        "_lock",
+    )
+
+    def __init__(self, replaces, errors, warnings):
+        self.replaces = replaces
+        self.errors = errors
+        self.warnings = warnings
+        self.literals = _get_literals(replaces + errors + warnings)
+        # {((severity, rule_index), ...): Scanner}, least recently used first
+        self._scanners = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dicts(cls, replaces, errors, warnings):
+        """Build a RulePlan from dicts {regex or re.Pattern: value}"""
+        return cls(
+            _compile_items(replaces, True),
+            _compile_items(errors),
+            _compile_items(warnings),
+        )
+
+    def replace(self, text):
+        """Apply the replaces on text, skipping the rules whose anchors
+        are not present in it"""
+        found_anchors = {}
+        for pattern, replacement, anchors in self.replaces:
+            if not _has_anchor(text, anchors, found_anchors):
+                continue
+            new_text = pattern.sub(replacement, text)
+            if new_text != text:
+                text = new_text
+                found_anchors = {}
+        return text
+
+    def scan(self, text):
+        """Return the Finding of the errors and warnings in text, sorted by
+        position. All the candidate rules are searched in a single pass."""
+        found_anchors = {}
+        rule_keys = tuple(
+            (severity, index)
+            for severity, rules in (("error", self.errors), ("warning", self.warnings))
+            for index, (__, __, anchors) in enumerate(rules)
+            if _has_anchor(text, anchors, found_anchors)
+        )
+        if not rule_keys:
+            return []
+        with self._lock:
+            scanner = self._scanners.get(rule_keys)
+            if scanner is not None:
+                self._scanners.move_to_end(rule_keys)
+        if scanner is None:
+            scanner = Scanner(
+                self._get_scanner_rule(severity, index)
+                for severity, index in rule_keys
+            )
+            with self._lock:
+                self._scanners[rule_keys] = scanner
+                if len(self._scanners) > _MAX_SCANNERS:
+                    self._scanners.popitem(last=False)
+        return scanner.scan(text)
+
+    def _get_scanner_rule(self, severity, index):
+        rules = self.errors if severity == "error" else self.warnings
+        pattern, message, __ = rules[index]
+        return pattern.pattern, severity, pattern, message
+
+
+def _get_literals(rules):
+    literals = set()
+    for rule in rules:
+        if rule[2] is None:
+            return None
+        literals.update(rule[2])
+    return tuple(sorted(literals))
+
+
+def _has_anchor(text, anchors, found_anchors):
+    if anchors is None:
+        return True
+    for anchor in anchors:
+        found = found_anchors.get(anchor)
+        if found is None:
+            found = found_anchors[anchor] = anchor in text
+        if found:
+            return True
+    return False
+
+
+def _get_anchors(pattern):
+    """Return a tuple of literal strings, one of them at least being part of
+    any string matched by the pattern, or None."""
+    if pattern.flags & re.IGNORECASE:
+        return None
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+    anchors = _get_required_literals(parsed)
+    if anchors and min(len(x) for x in anchors) >= _MIN_ANCHOR_LENGTH:
+        return anchors
+    return None
+
+
+def _get_required_literals(items):
+    """Return the best set of alternative literals required by the sequence
+    of parsed items, favouring the longest shortest alternative"""
+    candidates = []
+    current_literal = []
+
+    def close_literal():
+        if current_literal:
+            candidates.append(("".join(current_literal),))
+            current_literal.clear()
+
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            current_literal.append(chr(av))
+            continue
+        close_literal()
+        if op == sre_parse.SUBPATTERN:
+            add_flags, sub_items = av[1], av[-1]
+            if not add_flags & re.IGNORECASE:
+                candidates.append(_get_required_literals(sub_items))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            candidates.append(_get_required_literals(av[2]))
+        elif op == sre_parse.BRANCH:
+            alternatives = [_get_required_literals(x) for x in av[1]]
+            if all(alternatives):
+                candidates.append(tuple(sorted(set().union(*alternatives))))
+    close_literal()
+
+    candidates = [x for x in candidates if x]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda x: min(len(y) for y in x))
+
+
+def _compile_items(rules, is_replace=False):
+    res = []
+    for pattern, value in rules.items():
+        pattern = re.compile(pattern)
+        res.append(
+            (pattern, (value or "") if is_replace else value, _get_anchors(pattern))
+        )
+    return tuple(res)
+
+
+def _compile_dict_of_dict(doc, is_replace=False):
+    res = {}
+    for filetype, values in doc.items():
+        res[filetype] = tuple(
+            (re.compile(pattern), (value or "") if is_replace else value)
+            for pattern, value in (values or {}).items()
+        )
+    return MappingProxyType(res)
+
+
+def _to_tuples(items):
+    return tuple(tuple(item) for item in items)
@@ -0,0 +1,130 @@
+import bisect
+import re
+from collections import namedtuple
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+
+_REPEAT_OPS = tuple(
+    getattr(sre_parse, x)
+    for x in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+    if hasattr(sre_parse, x)
+)
+
+Finding = namedtuple("Finding", ["rule_id", "severity", "message", "line", "column"])
+
+
+class Scanner(object):
+    """Search a text for many patterns in a single pass.
+
+    rules: ((rule_id, severity, re.Pattern, message), ...)
+
+    The patterns are combined in a single alternation, each of them wrapped
+    in a named group, so the text is scanned once whatever the number of
+    rules. A match of a rule can be hidden by an overlapping match of
+    another rule: the matches of each rule are then searched, as
+    pattern.finditer() would find them, but only inside the matched spans.
+    Patterns that can not be combined (back references, named groups,
+    specific flags, empty matches) are scanned separately.
+    """
+
+    def __init__(self, rules):
+        self._rules = tuple(rules)
+        self._combined_indexes = []
+        self._standalone_indexes = []
+        for index, (__, __, pattern, __) in enumerate(self._rules):
+            if _is_combinable(pattern):
+                self._combined_indexes.append(index)
+            else:
+                self._standalone_indexes.append(index)
+        self._combined = None
+        if self._combined_indexes:
+            try:
+                self._combined = re.compile(
+                    "|".join(
+                        "(?P<_r%d>%s)" % (index, self._rules[index][2].pattern)
+                        for index in self._combined_indexes
+                    )
+                )
+            except re.error:
+                self._standalone_indexes = sorted(
+                    self._combined_indexes + self._standalone_indexes
+                )
+                self._combined_indexes = []
+
+    def scan(self, text):
+        """Return the list of the Finding in text, sorted by position"""
+        # [(position, rule_index)]
+        hits = []
+        if self._combined is not None:
+            # Any match of a rule starts in a span of the combined pattern
+            spans = [match.span() for match in self._combined.finditer(text)]
+            if spans:
+                for index in self._combined_indexes:
+                    hits.extend(self._scan_spans(text, index, spans))
+        for index in self._standalone_indexes:
+            pattern = self._rules[index][2]
+            hits.extend((match.start(), index) for match in pattern.finditer(text))
+        if not hits:
+            return []
+
+        line_starts = [0]
+        line_starts.extend(match.end() for match in re.finditer("\n", text))
+        res = []
+        for position, index in sorted(hits):
+            rule_id, severity, __, message = self._rules[index]
+            line = bisect.bisect_right(line_starts, position)
+            column = position - line_starts[line - 1] + 1
+            res.append(Finding(rule_id, severity, message, line, column))
+        return res
+
+    def _scan_spans(self, text, index, spans):
+        """Yield the (position, index) of the matches of the rule starting in
+        the spans, skipping the ones overlapping a previous match"""
+        pattern = self._rules[index][2]
+        position = 0
+        for start, end in spans:
+            position = max(start, position)
+            while position < end:
+                match = pattern.match(text, position)
+                if match:
+                    yield position, index
+                    position = max(position + 1, match.end())
+                else:
+                    position += 1
+
+
+def _is_combinable(pattern):
+    if pattern.groupindex or pattern.flags & ~re.UNICODE:
+        return False
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return False
+    if parsed.state.flags & ~re.UNICODE or not parsed.getwidth()[0]:
+        return False
+    return not _has_group_reference(parsed)
+
+
+def _has_group_reference(items):
+    for op, av in items:
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            return True
+        if op == sre_parse.SUBPATTERN:
+            sub_items_list = [av[-1]]
+        elif op == getattr(sre_parse, "ATOMIC_GROUP", None):
+            sub_items_list = [av]
+        elif op in _REPEAT_OPS:
+            sub_items_list = [av[2]]
+        elif op == sre_parse.BRANCH:
+            sub_items_list = av[1]
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            sub_items_list = [av[1]]
+        else:
+            continue
+        if any(_has_group_reference(x) for x in sub_items_list):
+            return True
+    return False
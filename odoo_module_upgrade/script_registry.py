@@ -0,0 +1,256 @@
+import argparse
+import importlib
+import importlib.util
+import inspect
+import json
+import os
+import sys
+from collections import namedtuple
+
+from .config import _SCRIPT_ENTRY_POINT_GROUP, _SCRIPT_REGISTRY_NAME
+from .log import logger
+
+# Folders of the rule files of a script, named after the rule attributes of
+# the scripts (see BaseMigrationScript.parse_rules())
+_RULE_FOLDERS = [
+    "text_replaces",
+    "text_errors",
+    "text_warnings",
+    "deprecated_modules",
+    "file_renames",
+    "removed_fields",
+    "renamed_fields",
+    "renamed_models",
+    "removed_models",
+]
+
+# Kinds of scripts, in their execution order
+_KINDS = ["always", "migration_folder", "step"]
+
+# ScriptEntry of all the packages of scripts, read once (see
+# get_script_entries())
+_ENTRIES = None
+
+
+class ScriptEntry(
+    namedtuple(
+        "ScriptEntry",
+        ["name", "script", "kind", "start", "end", "rule_files", "python_scripts"],
+    )
+):
+    """A migration script of a registry.
+
+    name: name of the script, like 'migrate_150_160'
+    script: 'module:class' of the BaseMigrationScript
+    kind: 'always' (run first), 'migration_folder' (run next, unless the
+    migration folder is kept) or 'step' (run if the versions overlap)
+    start, end: version codes of a step, end being None for the latest one
+    rule_files: {rule folder: (absolute path of a yaml file, ...)}
+    python_scripts: (module of the global functions, ...)
+    """
+
+    __slots__ = ()
+
+    def load(self):
+        """Import the script and return an instance of it"""
+        module_name, class_name = self.script.split(":")
+        script = getattr(importlib.import_module(module_name), class_name)()
+        script._script_entry = self
+        return script
+
+    def overlaps(self, start, end, latest):
+        """Return True if the step is part of a migration from start to end,
+        latest being the code of the latest version"""
+        step_end = self.end or latest
+        return float(self.start) < float(end) and float(step_end) > float(start)
+
+
+def get_script_entries():
+    """Return the ScriptEntry of the built-in scripts, followed by the ones
+    of the packages registered on the 'odoo_module_upgrade.upgrade_scripts'
+    entry point. The registries are read once, without importing the
+    scripts."""
+    global _ENTRIES
+    if _ENTRIES is None:
+        entries = []
+        for package_name in _get_package_names():
+            entries.extend(_read_registry(package_name))
+        _ENTRIES = entries
+    return _ENTRIES
+
+
+def select_script_entries(start, end, latest, remove_migration_folder=True):
+    """Return the ScriptEntry to run for a migration from start to end,
+    in their execution order"""
+    res = []
+    for kind in _KINDS:
+        if kind == "migration_folder" and not remove_migration_folder:
+            continue
+        entries = [x for x in get_script_entries() if x.kind == kind]
+        if kind == "step":
+            entries = sorted(
+                [x for x in entries if x.overlaps(start, end, latest)],
+                key=lambda x: (float(x.start), x.name),
+            )
+        res.extend(entries)
+    return res
+
+
+def _get_package_names():
+    package_names = [__package__ + ".upgrade_scripts"]
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return package_names
+    all_entry_points = entry_points()
+    if hasattr(all_entry_points, "select"):
+        plugin_entry_points = all_entry_points.select(group=_SCRIPT_ENTRY_POINT_GROUP)
+    else:
+        plugin_entry_points = all_entry_points.get(_SCRIPT_ENTRY_POINT_GROUP, [])
+    for entry_point in plugin_entry_points:
+        if entry_point.value not in package_names:
+            package_names.append(entry_point.value)
+    return package_names
+
+
+def _get_package_path(package_name):
+    spec = importlib.util.find_spec(package_name)
+    if spec is None or not spec.submodule_search_locations:
+        raise ValueError("'%s' is not a package of scripts" % package_name)
+    return list(spec.submodule_search_locations)[0]
+
+
+def _read_registry(package_name):
+    package_path = _get_package_path(package_name)
+    registry_path = os.path.join(package_path, _SCRIPT_REGISTRY_NAME)
+    with open(registry_path, "r", encoding="utf-8") as f:
+        registry = json.load(f)
+    logger.debug("Read %d script(s) from %s" % (len(registry), registry_path))
+    return [
+        ScriptEntry(
+            name=x["name"],
+            script=x["script"],
+            kind=x["kind"],
+            start=x["start"],
+            end=x["end"],
+            rule_files={
+                rule_folder: tuple(
+                    os.path.join(package_path, *file_path.split("/"))
+                    for file_path in file_paths
+                )
+                for rule_folder, file_paths in x["rule_files"].items()
+            },
+            python_scripts=tuple(x["python_scripts"]),
+        )
+        for x in registry
+    ]
+
+
+def build_registry(package_name):
+    """Scan the package of scripts and return its registry: a list of dicts
+    with the keys of ScriptEntry, the rule files being relative to the
+    package.
+
+    The scripts are modules named 'migrate_<start>_<end>', with 'allways' as
+    end for the latest version, 'migrate_allways' and
+    'migrate_remove_migration_folder'. The rule files of a script are the
+    '<rule folder>/<script name>/*.yaml' files, and its global functions
+    the 'python_scripts/<script name>/*.py' modules.
+    """
+    from .base_migration_script import BaseMigrationScript
+
+    package_path = _get_package_path(package_name)
+    registry = []
+    for file_name in sorted(os.listdir(package_path)):
+        name, extension = os.path.splitext(file_name)
+        if extension != ".py" or not name.startswith("migrate_"):
+            continue
+        module_name = package_name + "." + name
+        module = importlib.import_module(module_name)
+        class_names = [
+            class_name
+            for class_name, value in inspect.getmembers(module, inspect.isclass)
+            if issubclass(value, BaseMigrationScript)
+            and value.__module__ == module_name
+        ]
+        if name == "migrate_allways":
+            kind, start, end = "always", None, None
+        elif name == "migrate_remove_migration_folder":
+            kind, start, end = "migration_folder", None, None
+        else:
+            kind = "step"
+            start, end = name.split("_")[1:3]
+            if end == "allways":
+                end = None
+        rule_files = {}
+        for rule_folder in _RULE_FOLDERS:
+            folder_path = os.path.join(package_path, rule_folder, name)
+            if os.path.isdir(folder_path):
+                rule_files[rule_folder] = [
+                    "%s/%s/%s" % (rule_folder, name, x)
+                    for x in sorted(os.listdir(folder_path))
+                    if x.endswith(".yaml")
+                ]
+        python_scripts = []
+        folder_path = os.path.join(package_path, "python_scripts", name)
+        if os.path.isdir(folder_path):
+            python_scripts = [
+                "%s.python_scripts.%s.%s" % (package_name, name, x[:-3])
+                for x in sorted(os.listdir(folder_path))
+                if x.endswith(".py")
+            ]
+        for class_name in class_names:
+            registry.append(
+                {
+                    "name": name,
+                    "script": "%s:%s" % (module_name, class_name),
+                    "kind": kind,
+                    "start": start,
+                    "end": end,
+                    "rule_files": rule_files,
+                    "python_scripts": python_scripts,
+                }
+            )
+    return registry
+
+
+def main(args=None):
+    """Write the registry of a package of scripts, or check it is up to
+    date with --check"""
+    parser = argparse.ArgumentParser(
+        prog="python -m odoo_module_upgrade.script_registry",
+        description=main.__doc__,
+    )
+    parser.add_argument(
+        "package",
+        nargs="?",
+        default=__package__ + ".upgrade_scripts",
+        help="Package of the scripts (Default: the built-in scripts)",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        default=False,
+        help="Exit with an error if the registry is not up to date",
+    )
+    args = parser.parse_args(args)
+    content = json.dumps(build_registry(args.package), indent=4) + "\n"
+    registry_path = os.path.join(
+        _get_package_path(args.package), _SCRIPT_REGISTRY_NAME
+    )
+    current_content = None
+    if os.path.isfile(registry_path):
+        with open(registry_path, "r", encoding="utf-8") as f:
+            current_content = f.read()
+    if args.check:
+        if content != current_content:
+            sys.exit("%s is not up to date" % registry_path)
+        return
+    if content != current_content:
+        with open(registry_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        print("Wrote %s" % registry_path)
+
+
+if __name__ == "__main__":
+    main()
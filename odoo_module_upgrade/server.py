@@ -0,0 +1,311 @@
+import hmac
+import itertools
+import json
+import secrets
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from .config import _SERVER_KEEP_ALIVE, _SERVER_TOKEN_HEADER
+from .exception import ConfigException
+from .job_pool import END_STATES, JobPool, parse_job_options
+from .log import logger
+
+
+class Job(object):
+    """A migration run by the server, and the events it emitted (see
+    job_pool.JobPool).
+
+    The events are kept, so that a client can follow the job from its start
+    at any time. The id of an event is its position, starting from 1.
+    """
+
+    def __init__(self, job_id, options):
+        self.id = job_id
+        self.options = options
+        self.state = "queued"
+        self.error = None
+        # {module_name: state}, in the migration order
+        self.modules = {}
+        # Changes of a dry-run job, as a git patch
+        self.patch = None
+        self.created = time.time()
+        self.started = None
+        self.ended = None
+        self._events = []
+        self._condition = threading.Condition()
+
+    def is_over(self):
+        return self.state in END_STATES
+
+    def add_event(self, event_type, data):
+        """Add the event, and return False if the job is already over"""
+        with self._condition:
+            if self.is_over():
+                return False
+            if event_type == "state":
+                self.state = data["state"]
+                self.error = data.get("error")
+                if self.state == "running":
+                    self.started = time.time()
+                else:
+                    self.ended = time.time()
+            elif event_type == "module":
+                self.modules[data["module"]] = data["state"]
+            self._events.append((event_type, data))
+            self._condition.notify_all()
+            return True
+
+    def get_events(self, start, timeout):
+        """Return the events following the first start ones, waiting for
+        them at most timeout seconds, and if the job is over"""
+        with self._condition:
+            if len(self._events) <= start and not self.is_over():
+                self._condition.wait(timeout)
+            return self._events[start:], self.is_over()
+
+    def to_dict(self):
+        with self._condition:
+            return {
+                "id": self.id,
+                "state": self.state,
+                "error": self.error,
+                "options": self.options,
+                "modules": [
+                    {"module": module_name, "state": state}
+                    for module_name, state in self.modules.items()
+                ],
+                "created": self.created,
+                "started": self.started,
+                "ended": self.ended,
+                "event_count": len(self._events),
+                "has_patch": self.patch is not None,
+            }
+
+
+class MigrationServer(ThreadingHTTPServer):
+    """HTTP server running migration jobs in a pool of worker processes,
+    started with the server (see job_pool.JobPool). The jobs of the same
+    directory are run one after another, as they commit in the same
+    repository.
+
+    The requests must carry the token of the server in the
+    _SERVER_TOKEN_HEADER header, and the jobs be posted as JSON: a web page
+    can't post them without the token, nor without a CORS preflight.
+
+    POST /jobs                  Create a job (see parse_job_options())
+    GET  /jobs                  List the jobs
+    GET  /jobs/<id>             Get a job
+    GET  /jobs/<id>/events      Stream the events of a job (Server-Sent
+                                Events), from the Last-Event-ID, if any
+    GET  /jobs/<id>/patch       Get the patch of a dry-run job
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, workers=1, cors_origin=None, token=None):
+        super().__init__(address, _RequestHandler)
+        self.cors_origin = cors_origin
+        self.token = token or secrets.token_urlsafe(32)
+        # {job_id: Job}, in their creation order
+        self.jobs = {}
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queued_jobs = []
+        self._busy_directories = set()
+        self._pool = JobPool(workers, self._on_event)
+
+    def add_job(self, options):
+        with self._lock:
+            job = Job(str(next(self._job_ids)), options)
+            self.jobs[job.id] = job
+            self._queued_jobs.append(job)
+            logger.info(
+                "Job %s: migration of %s queued" % (job.id, options["directory"])
+            )
+            self._schedule()
+        return job
+
+    def get_jobs(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _schedule(self):
+        for job in list(self._queued_jobs):
+            directory = job.options["directory"]
+            if directory in self._busy_directories:
+                continue
+            self._queued_jobs.remove(job)
+            self._busy_directories.add(directory)
+            self._pool.submit(job.id, job.options)
+
+    def _on_event(self, job_id, event_type, data):
+        job = self.jobs[job_id]
+        patch = data.pop("patch", None)
+        if patch is not None:
+            job.patch = patch
+        if (
+            job.add_event(event_type, data)
+            and event_type == "state"
+            and data["state"] in END_STATES
+        ):
+            logger.info("Job %s: %s" % (job.id, job.state))
+            with self._lock:
+                self._busy_directories.discard(job.options["directory"])
+                self._schedule()
+
+    def server_close(self):
+        super().server_close()
+        with self._lock:
+            self._queued_jobs = []
+        self._pool.close()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server_version = "odoo-module-upgrade"
+
+    def do_GET(self):
+        if not self._check_token():
+            return
+        parts = self._get_path_parts()
+        if parts == ["jobs"]:
+            self._send_json(
+                HTTPStatus.OK, [job.to_dict() for job in self.server.get_jobs()]
+            )
+            return
+        job = len(parts) in (2, 3) and parts[0] == "jobs" and self.server.jobs.get(
+            parts[1]
+        )
+        if not job:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+        elif len(parts) == 2:
+            self._send_json(HTTPStatus.OK, job.to_dict())
+        elif parts[2] == "events":
+            self._send_events(job)
+        elif parts[2] == "patch" and job.patch is not None:
+            content = job.patch.encode("utf-8", errors="surrogateescape")
+            self._send(HTTPStatus.OK, "text/x-diff; charset=utf-8", content)
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+
+    def do_POST(self):
+        if not self._check_token():
+            return
+        if self._get_path_parts() != ["jobs"]:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+            return
+        # The other content types can be posted by a web page without CORS
+        # preflight
+        if self.headers.get_content_type() != "application/json":
+            self._send_json(
+                HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+                {"error": "The jobs must be posted as application/json"},
+            )
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            options = parse_job_options(json.loads(self.rfile.read(length) or b"{}"))
+        except ValueError:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "Invalid JSON"})
+            return
+        except ConfigException as e:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+        job = self.server.add_job(options)
+        self._send_json(
+            HTTPStatus.CREATED, job.to_dict(), {"Location": "/jobs/%s" % job.id}
+        )
+
+    def do_OPTIONS(self):
+        self._send(HTTPStatus.NO_CONTENT, None, b"")
+
+    def _check_token(self):
+        """Return True if the request carries the token of the server, else
+        send an error"""
+        token = self.headers.get(_SERVER_TOKEN_HEADER, "")
+        if hmac.compare_digest(token.encode(), self.server.token.encode()):
+            return True
+        self._send_json(HTTPStatus.UNAUTHORIZED, {"error": "Invalid token"})
+        return False
+
+    def _get_path_parts(self):
+        return [x for x in urlsplit(self.path).path.split("/") if x]
+
+    def _send_headers(self, status, content_type, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        if self.server.cors_origin:
+            self.send_header("Access-Control-Allow-Origin", self.server.cors_origin)
+            self.send_header(
+                "Access-Control-Allow-Headers",
+                "Content-Type, %s" % _SERVER_TOKEN_HEADER,
+            )
+            self.send_header("Access-Control-Allow-Methods", "GET, POST")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+    def _send(self, status, content_type, content, headers=None):
+        self._send_headers(status, content_type, headers)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_json(self, status, data, headers=None):
+        content = (json.dumps(data, indent=4) + "\n").encode("utf-8")
+        self._send(status, "application/json", content, headers)
+
+    def _send_events(self, job):
+        last_event_id = self.headers.get("Last-Event-ID", "")
+        start = int(last_event_id) if last_event_id.isdigit() else 0
+        self._send_headers(
+            HTTPStatus.OK, "text/event-stream", {"Cache-Control": "no-cache"}
+        )
+        self.end_headers()
+        try:
+            while True:
+                events, is_over = job.get_events(start, _SERVER_KEEP_ALIVE)
+                for event_type, data in events:
+                    start += 1
+                    self.wfile.write(
+                        (
+                            "id: %d\nevent: %s\ndata: %s\n\n"
+                            % (start, event_type, json.dumps(data))
+                        ).encode("utf-8")
+                    )
+                if not events:
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+                if is_over:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped following the job
+            return
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s" % (self.address_string(), format % args))
+
+
+def serve(host, port, workers=1, cors_origin=None, token=None):
+    """Run the migration server until it is interrupted. Without token, a
+    random one is generated, and printed."""
+    server = MigrationServer((host, port), workers, cors_origin, token)
+    logger.info(
+        "Serving on http://%s:%d with %d worker(s)"
+        % (host, server.server_port, workers)
+    )
+    if not token:
+        logger.info(
+            "Send the token of the server in the %s header: %s"
+            % (_SERVER_TOKEN_HEADER, server.token)
+        )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
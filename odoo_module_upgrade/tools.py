@@ -1,10 +1,21 @@
 
+import codecs
+import io
+import mmap
 import subprocess
 import re
+import os
 import pathlib
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
-from .config import _AVAILABLE_MIGRATION_STEPS
-from .log import logger
+from .config import _AVAILABLE_MIGRATION_STEPS, _CSV_STREAMED_SIZE
+from . import file_encoding
+from .function_graph import get_dependencies
+from .log import logger, buffer_log_records
 
 
 def _get_available_init_version_names():
@@ -33,6 +44,145 @@ def _execute_shell(shell_command, path=False, raise_error=True):
         return subprocess.run(shell_command, shell=True)
 
 
+# Workspace of the module being migrated, if any. (see workspace.py)
+_WORKSPACE = None
+
+
+@contextmanager
+def _use_workspace(workspace):
+    """Route the file operations of the tools through the given workspace"""
+    global _WORKSPACE
+    previous_workspace, _WORKSPACE = _WORKSPACE, workspace
+    try:
+        yield workspace
+    finally:
+        _WORKSPACE = previous_workspace
+
+
+# File filter of the module being migrated, used without workspace to list
+# its files (see file_filter.py)
+_FILE_FILTER = None
+
+
+@contextmanager
+def _use_file_filter(file_filter):
+    """Exclude the files of the file filter from the folders walked without
+    workspace (see --no-pipeline): the workspace excludes them from its own
+    index"""
+    global _FILE_FILTER
+    previous_file_filter, _FILE_FILTER = _FILE_FILTER, file_filter
+    try:
+        yield file_filter
+    finally:
+        _FILE_FILTER = previous_file_filter
+
+
+# Executor running the per-file tasks of the module being migrated, if any.
+_FILE_EXECUTOR = None
+# Set in the threads running a per-file task
+_FILE_TASK = threading.local()
+
+
+@contextmanager
+def _use_file_executor(executor):
+    """Run the per-file tasks of _map_files() in the given executor"""
+    global _FILE_EXECUTOR
+    previous_executor, _FILE_EXECUTOR = _FILE_EXECUTOR, executor
+    try:
+        yield executor
+    finally:
+        _FILE_EXECUTOR = previous_executor
+
+
+def _map_files(function, file_paths):
+    """Call function(file_path) for each file and return the results, in the
+    order of the files.
+
+    With a file executor, the calls run in its threads. Their log records are
+    emitted afterwards, file by file, so the logs read as in a sequential run.
+    """
+    file_paths = [x for x in file_paths if not _is_frozen(x)]
+    if _FILE_EXECUTOR is None or getattr(_FILE_TASK, "running", False):
+        return [function(file_path) for file_path in file_paths]
+
+    def run_task(file_path):
+        _FILE_TASK.running = True
+        try:
+            with buffer_log_records() as records:
+                try:
+                    return function(file_path), records, None
+                except Exception as e:
+                    return None, records, e
+        finally:
+            _FILE_TASK.running = False
+
+    res = []
+    for result, records, error in list(_FILE_EXECUTOR.map(run_task, file_paths)):
+        for record in records:
+            logger.handle(record)
+        if error is not None:
+            raise error
+        res.append(result)
+    return res
+
+
+def _run_functions(functions, **kwargs):
+    """Call each function with kwargs, in order.
+
+    With a file executor, the functions that don't depend on each other
+    (see function_graph.py) run concurrently, in their own threads. Their
+    log records are emitted afterwards, function by function, so the logs
+    read as in a sequential run. If a function fails, the ones depending
+    on it are not called, and the first error is raised at the end.
+    """
+    if (
+        _FILE_EXECUTOR is None
+        or getattr(_FILE_TASK, "running", False)
+        or len(functions) < 2
+    ):
+        for function in functions:
+            function(**kwargs)
+        return
+
+    def run_task(function, dependency_futures):
+        with buffer_log_records() as records:
+            if any(x.result()[1] is not None for x in dependency_futures):
+                return records, _SkippedFunction()
+            try:
+                function(**kwargs)
+                return records, None
+            except Exception as e:
+                return records, e
+
+    futures = []
+    # One thread per function: a task waiting for its dependencies never
+    # prevents them from running
+    with ThreadPoolExecutor(max_workers=len(functions)) as executor:
+        for function, dependencies in zip(functions, get_dependencies(functions)):
+            futures.append(
+                executor.submit(run_task, function, [futures[x] for x in dependencies])
+            )
+    errors = []
+    for future in futures:
+        records, error = future.result()
+        for record in records:
+            logger.handle(record)
+        if error is not None and not isinstance(error, _SkippedFunction):
+            errors.append(error)
+    if errors:
+        raise errors[0]
+
+
+class _SkippedFunction(Exception):
+    """A function not called, as a function it depends on failed"""
+
+
+def _is_frozen(file_path):
+    """Return True if the file is kept as it is by the active workspace,
+    being unchanged since its last migration (see cache.py)"""
+    return _WORKSPACE is not None and _WORKSPACE.is_frozen(file_path)
+
+
 # def _read_content(file_path):
 #     f = open(file_path, "r")
 #     text = f.read()
@@ -40,30 +190,94 @@ def _execute_shell(shell_command, path=False, raise_error=True):
 #     return text
 
 def _read_content(file_path):
-    """ Method 1: Try UTF-8 first, then fallback to other encodings """
-    encodings_to_try = ['utf-8', 'utf-8-sig', 'latin-1', 'cp1252', 'iso-8859-1']
-    
-    for encoding in encodings_to_try:
-        try:
-            with open(file_path, 'r', encoding=encoding) as f:
-                text = f.read()
-            logger.debug(f"Successfully read file {file_path} with encoding: {encoding}")
-            return text
-        except UnicodeDecodeError as e:
-            logger.debug(f"Failed to read {file_path} with encoding {encoding}: {e}")
-            continue
-        except Exception as e:
-            logger.error(f"Unexpected error reading {file_path} with encoding {encoding}: {e}")
-            continue
-    
-    """ If all encodings fail, try reading with error handling """
+    if _WORKSPACE is not None:
+        return _WORKSPACE.read(file_path)
+    return _read_file(file_path)[0]
+
+
+def _may_contain(file_path, literals, all_of=False):
+    """Return False if the file contains none of the literals (with all_of,
+    if it misses one of them), without reading it in a string: the content
+    buffered by the workspace, if any, is searched, or the file is mapped
+    in memory and searched for the bytes of the literals. True means the
+    file has to be read to know: the file can contain them, or is encoded
+    in UTF-16 / UTF-32, or a literal is not ASCII.
+
+    The workspace buffers the files read by the rules of the scripts: the
+    files are only mapped in memory without workspace (see --no-pipeline).
+    """
+    match = all if all_of else any
+    if _WORKSPACE is not None:
+        content = _WORKSPACE.get_buffered_content(file_path)
+        if content is not None:
+            return match(x in content for x in literals)
+    if not all(x.isascii() for x in literals):
+        return True
     try:
-        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-            text = f.read()
-        logger.warning(f"Read file {file_path} with UTF-8 and replaced invalid characters")
-        return text
-    except Exception as e:
-        raise Exception(f"Unable to read file {file_path} with any encoding: {e}")
+        with open(file_path, "rb") as f:
+            if not os.fstat(f.fileno()).st_size:
+                return False
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                # The UTF-32 BOMs start with the UTF-16 ones
+                if data[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+                    return True
+                return match(data.find(x.encode("ascii")) != -1 for x in literals)
+    except (OSError, ValueError):
+        return True
+
+
+def _read_binary_content(file_path):
+    if _WORKSPACE is not None:
+        return _WORKSPACE.read_binary(file_path)
+    with open(file_path, "rb") as f:
+        return f.read()
+
+
+def _read_file(file_path):
+    """Return the text of the file, its encoding, detected once per file
+    (see file_encoding.py), and its line ending. As in text mode, the line
+    endings are read as '\\n': they are written back as in the file (see
+    _write_files())."""
+    with open(file_path, "rb") as f:
+        data = f.read()
+    text, encoding = file_encoding.decode_file(file_path, data)
+    text, newline = file_encoding.normalize_newlines(file_path, text)
+    return text, encoding, newline
+
+
+def _is_streamed(file_path):
+    """Return True if the lines of the file are read from and written to
+    the disk by _open_lines() and _write_chunks(), instead of the active
+    workspace: without workspace, or for the large files not buffered yet,
+    out of dry-run mode"""
+    if _WORKSPACE is None:
+        return True
+    if _WORKSPACE.virtual or _WORKSPACE.get_buffered_content(file_path) is not None:
+        return False
+    try:
+        return os.path.getsize(file_path) > _CSV_STREAMED_SIZE
+    except OSError:
+        return False
+
+
+@contextmanager
+def _open_lines(file_path):
+    """Iterate over the lines of the file, without reading it at once from
+    the disk (see _is_streamed()). The line endings are read as '\\n', as
+    in _read_file()."""
+    if not _is_streamed(file_path):
+        yield io.StringIO(_WORKSPACE.read(file_path))
+        return
+    encoding = file_encoding.detect_file_encoding(file_path)
+    with open(file_path, "r", encoding=encoding) as f:
+        yield f
+
+
+def _get_encoding(file_path):
+    """Return the encoding the file is written back in"""
+    if _WORKSPACE is not None:
+        return _WORKSPACE.get_encoding(file_path)
+    return file_encoding.get_encoding(file_path)
 
 
 # def _write_content(file_path, content):
@@ -72,21 +286,212 @@ def _read_content(file_path):
 #     f.close()
 
 def _write_content(file_path, content):
-    """Write content to file using UTF-8 encoding to handle Unicode characters"""
+    if _WORKSPACE is not None:
+        _WORKSPACE.write(file_path, content)
+    else:
+        _write_file(file_path, content)
+
+
+def _write_file(file_path, content):
+    """Write content to file, in the encoding and with the line endings it
+    has been read with"""
+    _write_files(
+        [
+            (
+                file_path,
+                content,
+                file_encoding.get_encoding(file_path),
+                file_encoding.get_newline(file_path),
+            )
+        ]
+    )
+
+
+def _write_chunks(file_path, chunks):
+    """Write the text chunks to the file, one after another, in the encoding
+    and with the line endings it has been read with (see _open_lines()).
+    Like _write_files(), the file is replaced once entirely written."""
+    if not _is_streamed(file_path):
+        _WORKSPACE.write(file_path, "".join(chunks))
+        return
+    encoding = file_encoding.get_encoding(file_path)
+    newline = file_encoding.get_newline(file_path)
+    temporary_path = _stage_file(file_path, b"")
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        logger.debug(f"Successfully wrote file {file_path} with UTF-8 encoding")
-    except Exception as e:
+        f = open(temporary_path, "w", encoding=encoding, newline=newline)
+        try:
+            for chunk in chunks:
+                try:
+                    f.write(chunk)
+                except UnicodeEncodeError:
+                    # Written again in utf-8, see file_encoding.encode()
+                    f.close()
+                    file_encoding.encode(file_path, chunk, encoding)
+                    f = _transcode_file(temporary_path, encoding, "utf-8", newline)
+                    f.write(chunk)
+        finally:
+            f.close()
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    os.replace(temporary_path, file_path)
+    logger.debug(f"Successfully wrote file {file_path}")
+
+
+def _transcode_file(file_path, encoding, new_encoding, newline="\n"):
+    """Write the file again in the new encoding, and return it opened for
+    appending text, with the given line endings"""
+    temporary_path = file_path + ".transcoded"
+    with open(file_path, "r", encoding=encoding, newline="") as source, open(
+        temporary_path, "w", encoding=new_encoding, newline=""
+    ) as target:
+        shutil.copyfileobj(source, target)
+    os.replace(temporary_path, file_path)
+    return open(file_path, "a", encoding=new_encoding, newline=newline)
+
+
+def _write_files(files, sync=False, renames=()):
+    """Write the files [(file_path, content, encoding, newline)], renaming
+    the files [(old_path, new_path)] in the same batch. The '\\n' line
+    endings of the contents are written as newline.
+
+    The contents are first written in temporary files, next to the targets,
+    then the files are renamed and the targets are replaced by the temporary
+    files: an interrupted run never leaves a truncated file, and a content
+    that can not be written leaves all the files as they are. With sync,
+    the temporary files are flushed to the disk once for all, before
+    replacing the targets.
+    """
+    # Without os.sync() (Windows), each temporary file is flushed on its own
+    fsync = sync and not hasattr(os, "sync")
+    # The permissions of a renamed file are the ones of its old path
+    old_paths = {new_path: old_path for old_path, new_path in renames}
+    staged_files = []
+    try:
+        for file_path, content, encoding, newline in files:
+            data = file_encoding.encode(file_path, content, encoding, newline)
+            staged_files.append(
+                (
+                    file_path,
+                    _stage_file(
+                        file_path, data, fsync, old_paths.get(file_path, file_path)
+                    ),
+                )
+            )
+    except BaseException:
+        for __, temporary_path in staged_files:
+            os.unlink(temporary_path)
+        raise
+    if sync and not fsync:
+        os.sync()
+    _rename_files(renames)
+    for file_path, temporary_path in staged_files:
+        os.replace(temporary_path, file_path)
+        logger.debug(f"Successfully wrote file {file_path}")
+
+
+def _rename_files(renames):
+    """Rename the files [(old_path, new_path)] at once: a file can take the
+    old path of another renamed file. Each file is first moved to a
+    temporary path, next to its new path."""
+    moved_files = []
+    for old_path, new_path in renames:
+        directory, filename = os.path.split(os.path.abspath(new_path))
+        fd, temporary_path = tempfile.mkstemp(
+            prefix=".%s." % filename, suffix=".tmp", dir=directory
+        )
+        os.close(fd)
+        os.replace(old_path, temporary_path)
+        moved_files.append((temporary_path, new_path))
+    for temporary_path, new_path in moved_files:
+        os.replace(temporary_path, new_path)
+
+
+def _stage_file(file_path, data, fsync=False, mode_path=None):
+    """Write the bytes in a temporary file in the folder of file_path, with
+    the permissions of mode_path (by default, file_path), and return its
+    path"""
+    directory, filename = os.path.split(os.path.abspath(file_path))
+    mode_path = mode_path or file_path
+    fd, temporary_path = tempfile.mkstemp(
+        prefix=".%s." % filename, suffix=".tmp", dir=directory
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if os.path.exists(mode_path):
+            shutil.copymode(mode_path, temporary_path)
+        else:
+            os.chmod(temporary_path, 0o666 & ~_get_umask())
+    except BaseException as e:
+        os.unlink(temporary_path)
         logger.error(f"Error writing file {file_path}: {e}")
         raise
+    return temporary_path
+
+
+def _get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def _rename(old_file_path, new_file_path):
+    """Rename the file on the disk, or in the rename plan of the active
+    workspace, if any, renaming the files when flushed"""
+    if _WORKSPACE is None:
+        os.rename(old_file_path, new_file_path)
+    file_encoding.move_encoding(old_file_path, new_file_path)
+    if _WORKSPACE is not None:
+        _WORKSPACE.rename(old_file_path, new_file_path)
+
+
+def _has_rename_plan():
+    """Return True if the renames are planned by the active workspace (see
+    Workspace.flush()), instead of being done at once"""
+    return _WORKSPACE is not None
+
+
+def _remove_tree(path):
+    if not _is_virtual():
+        shutil.rmtree(path)
+    if _WORKSPACE is not None:
+        _WORKSPACE.discard(path)
+
+
+def _is_virtual():
+    """Return True if the files are only changed in memory (dry-run mode)"""
+    return _WORKSPACE is not None and _WORKSPACE.virtual
+
+
+def _exists(path):
+    if _WORKSPACE is not None:
+        return _WORKSPACE.exists(path)
+    return os.path.exists(path)
+
+
+def _walk(top):
+    """Same as os.walk(top), through the active workspace, if any, or
+    without the files excluded by the active file filter"""
+    if _WORKSPACE is not None:
+        return _WORKSPACE.walk(top)
+    if _FILE_FILTER is not None and _FILE_FILTER.covers(top):
+        return _FILE_FILTER.walk(top)
+    return os.walk(top)
 
 
 def _replace_in_file(file_path, replaces, log_message=False):
+    """Apply the replaces on the file. replaces can be a dict
+    {old_term: new_term} or a sequence of (old_term, new_term) pairs"""
     current_text = _read_content(file_path)
     new_text = current_text
 
-    for old_term, new_term in replaces.items():
+    if isinstance(replaces, dict):
+        replaces = replaces.items()
+    for old_term, new_term in replaces:
         new_text = re.sub(old_term, new_term or "", new_text)
 
     # Write file if changed
@@ -108,6 +513,23 @@ def get_files(module_path, extensions):
     if not module_dir.is_dir():
         raise Exception(f"'{module_path}' is not a valid directory.")
 
+    # The workspace has an index of the files of the module
+    if _WORKSPACE is not None:
+        indexed_file_paths = _WORKSPACE.list_files(module_dir, extensions)
+        if indexed_file_paths is not None:
+            return indexed_file_paths
+    if (_WORKSPACE is not None and _WORKSPACE.virtual) or (
+        _WORKSPACE is None
+        and _FILE_FILTER is not None
+        and _FILE_FILTER.covers(module_dir)
+    ):
+        for ext in extensions:
+            for root, __, filenames in _walk(module_dir):
+                file_paths.extend(
+                    pathlib.Path(root) / x for x in filenames if x.endswith(ext)
+                )
+        return file_paths
+
     for ext in extensions:
         file_paths.extend(module_dir.rglob(f"*{ext}"))
 
@@ -1,6 +1,8 @@
 from odoo_module_upgrade.base_migration_script import BaseMigrationScript
+from odoo_module_upgrade.function_graph import file_access
 
 
+@file_access(writes=[".xml"])
 def replace_toggle_button(
     logger, module_path, module_name, manifest_path, migration_steps, tools
 ):
@@ -11,7 +13,7 @@ def replace_toggle_button(
         r'<attribute\s+name=["\']widget["\']>\s*toggle_button\s*</attribute>': '<attribute name="widget">boolean_toggle</attribute>',
     }
 
-    for file in files_to_process:
+    def process_file(file):
         try:
             tools._replace_in_file(
                 file,
@@ -21,6 +23,8 @@ def replace_toggle_button(
         except Exception as e:
             logger.error(f"Error processing file {file}: {str(e)}")
 
+    tools._map_files(process_file, files_to_process)
+
 
 class MigrationScript(BaseMigrationScript):
     _GLOBAL_FUNCTIONS = [replace_toggle_button]
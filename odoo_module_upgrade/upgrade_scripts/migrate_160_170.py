@@ -1,5 +1,6 @@
 
 from odoo_module_upgrade.base_migration_script import BaseMigrationScript
+from odoo_module_upgrade.function_graph import MANIFEST, file_access
 import lxml.etree as et
 from pathlib import Path
 import sys
@@ -308,29 +309,9 @@ Steps_visitor: list[AbstractVisitor] = [
 #         with open(filename, mode="wt") as file:
 #             file.write(new_all)
 
-def replace_read_group_signature(logger, filename):
-    # Try different encodings to handle various file encodings
-    encodings_to_try = ['utf-8', 'utf-8-sig', 'latin1', 'cp1252', 'iso-8859-1']
-    
-    content = None
-    used_encoding = None
-    
-    for encoding in encodings_to_try:
-        try:
-            with open(filename, mode="rt", encoding=encoding) as file:
-                content = file.read()
-                used_encoding = encoding
-                break
-        except UnicodeDecodeError:
-            continue
-        except Exception as e:
-            logger.error(f"Unexpected error reading {filename} with encoding {encoding}: {e}")
-            continue
-    
-    if content is None:
-        logger.error(f"Could not read file {filename} with any of the tried encodings: {encodings_to_try}")
-        return
-    
+def replace_read_group_signature(logger, filename, tools):
+    content = tools._read_content(filename)
+
     all_code = content
     new_all = all_code
     
@@ -350,34 +331,14 @@ def replace_read_group_signature(logger, filename):
 
     if new_all != all_code:
         logger.info("Script read_group replace applied in file %s" % filename)
-        try:
-            with open(filename, mode="wt", encoding=used_encoding) as file:
-                file.write(new_all)
-        except Exception as e:
-            logger.error(f"Error writing back to {filename}: {e}")
-            # Fallback to UTF-8 if the original encoding fails
-            try:
-                with open(filename, mode="wt", encoding='utf-8') as file:
-                    file.write(new_all)
-                logger.info(f"File {filename} written using UTF-8 encoding as fallback")
-            except Exception as fallback_error:
-                logger.error(f"Failed to write {filename} even with UTF-8 fallback: {fallback_error}")
-
+        tools._write_content(filename, new_all)
 
-def _get_files(module_path, reformat_file_ext):
-    """Get files to be reformatted."""
-    file_paths = list()
-    if not module_path.is_dir():
-        raise Exception(f"'{module_path}' is not a directory")
-    file_paths.extend(module_path.rglob("*" + reformat_file_ext))
-    return file_paths
 
-
-def _check_open_form_view(logger, file_path: Path):
+def _check_open_form_view(logger, file_path: Path, tools):
     """Check if the view has a button to open a form reg in a tree view `file_path`."""
     parser = et.XMLParser(remove_blank_text=True)
-    tree = et.parse(str(file_path.resolve()), parser)
-    record_node = tree.getroot()[0]
+    root_node = et.fromstring(tools._read_binary_content(file_path), parser)
+    record_node = root_node[0]
     f_arch = record_node.find('field[@name="arch"]')
     root = f_arch if f_arch is not None else record_node
     for button in root.findall(".//button[@name='get_formview_action']"):
@@ -389,31 +350,37 @@ def _check_open_form_view(logger, file_path: Path):
         )
 
 
+@file_access(reads=[".xml"])
 def _check_open_form(
     logger, module_path, module_name, manifest_path, migration_steps, tools
 ):
     reformat_file_ext = ".xml"
-    file_paths = _get_files(module_path, reformat_file_ext)
+    file_paths = tools.get_files(module_path, (reformat_file_ext,))
     logger.debug(f"{reformat_file_ext} files found:\n" f"{list(map(str, file_paths))}")
 
-    for file_path in file_paths:
-        _check_open_form_view(logger, file_path)
+    tools._map_files(
+        lambda file_path: _check_open_form_view(logger, file_path, tools), file_paths
+    )
 
 
+@file_access(writes=[".py"])
 def _reformat_read_group(
     logger, module_path, module_name, manifest_path, migration_steps, tools
 ):
     """Reformat read_group method in py files."""
 
     reformat_file_ext = ".py"
-    file_paths = _get_files(module_path, reformat_file_ext)
+    file_paths = tools.get_files(module_path, (reformat_file_ext,))
     logger.debug(f"{reformat_file_ext} files found:\n" f"{list(map(str, file_paths))}")
 
-    reformatted_files = list()
-    for file_path in file_paths:
-        reformatted_file = replace_read_group_signature(logger, file_path)
-        if reformatted_file:
-            reformatted_files.append(reformatted_file)
+    reformatted_files = [
+        reformatted_file
+        for reformatted_file in tools._map_files(
+            lambda file_path: replace_read_group_signature(logger, file_path, tools),
+            file_paths,
+        )
+        if reformatted_file
+    ]
     logger.debug("Reformatted files:\n" f"{list(reformatted_files)}")
 
 def normalize_domain(domain):
@@ -653,20 +620,18 @@ def get_combined_invisible_condition(invisible_attribute, states_attribute):
     return combined_invisible_condition
 
 
+@file_access(writes=[".xml"])
 def replace_attrs_expressions(logger, module_path, module_name, manifest_path, migration_steps, tools):
     """Replace complex attrs expressions with simplified versions."""
     files_to_process = tools.get_files(module_path, (".xml",))
 
-    for file in files_to_process:
+    def process_file(file):
         try:
-            with open(file, 'rb') as f:
-                content = f.read().decode('utf-8')
-                f.close()
+            if tools._may_contain(file, ['attrs', 'states']):
+                content = tools._read_content(file)
+                encoding = tools._get_encoding(file)
                 if not 'attrs' in content and not 'states' in content:
-                    continue
-                convert_line_separator_back_to_windows = False
-                if '\r\n' in content:
-                    convert_line_separator_back_to_windows = True
+                    return
                 has_encoding_declaration = False
                 if encoding_declaration := re.search(r"\A.*<\?xml.*?encoding=.*?\?>\s*", content, re.DOTALL):
                     has_encoding_declaration = True
@@ -677,7 +642,7 @@ def replace_attrs_expressions(logger, module_path, module_name, manifest_path, m
                 tags_with_states = doc.xpath("//*[@states]")
                 attribute_tags_with_states = doc.xpath("//attribute[@name='states']")
                 if not (tags_with_attrs or attribute_tags_with_attrs or tags_with_states or attribute_tags_with_states):
-                    continue
+                    return
                 for t in tags_with_attrs + attribute_tags_with_attrs + tags_with_states + attribute_tags_with_states:
                     logger.info(etree.tostring(t, encoding='unicode'))
                 nofilesfound = False
@@ -843,24 +808,29 @@ def replace_attrs_expressions(logger, module_path, module_name, manifest_path, m
                     attribute_tags_with_states_after.append(attribute_tag_invisible)
                 for t in tags_with_attrs + attribute_tags_with_attrs_after + tags_with_states + attribute_tags_with_states_after:
                     logger.info(etree.tostring(t, encoding='unicode'))
-                with open(file, 'wb') as rf:
-                    xml_string = etree.tostring(doc, encoding='utf-8', xml_declaration=has_encoding_declaration)
-                    if convert_line_separator_back_to_windows:
-                        xml_string = xml_string.replace(b"\n", b"\r\n")
-                    rf.write(xml_string)
+                if encoding in ('utf-8', 'utf-8-sig'):
+                    xml_string = etree.tostring(doc, encoding='utf-8', xml_declaration=has_encoding_declaration).decode('utf-8')
+                else:
+                    # The file is written back in its encoding: keep its declaration
+                    xml_string = etree.tostring(doc, encoding='unicode')
+                    if has_encoding_declaration:
+                        xml_string = encoding_declaration.group(0).rstrip() + "\n" + xml_string
+                tools._write_content(file, xml_string)
                 if content != xml_string:
                     logger.info(f"Updated attrs expressions in {file}")
         except Exception as e:
             logger.error(f"Error processing file {file}: {str(e)}")
 
-def _find_manifest_file(module_path):
+    tools._map_files(process_file, files_to_process)
+
+def _find_manifest_file(module_path, tools):
     """Find the manifest file (__manifest__.py) in the module."""
     manifest_paths = [
         module_path / "__manifest__.py",
         module_path / "__openerp__.py",
     ]    
     for manifest_path in manifest_paths:
-        if manifest_path.exists():
+        if tools._exists(manifest_path):
             return manifest_path    
     return None
 
@@ -936,17 +906,17 @@ def _find_manifest_file(module_path):
 #     except Exception as e:
 #         logger.error(f"Error reading manifest file {manifest_file}: {str(e)}")
 
+@file_access(writes=[MANIFEST])
 def _update_manifest_version_for_v17(logger, module_path, module_name, manifest_path, migration_steps, tools):
     """Update manifest version to be compatible with Odoo 17."""
-    manifest_file = _find_manifest_file(module_path)
+    manifest_file = _find_manifest_file(module_path, tools)
     
     if not manifest_file:
         logger.warning(f"No manifest file found in module {module_name}")
         return
     
     try:
-        with open(manifest_file, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = tools._read_content(manifest_file)
         
         try:
             version_match = re.search(r'["\']version["\']\s*:\s*["\']([^"\']+)["\']', content)
@@ -981,8 +951,7 @@ def _update_manifest_version_for_v17(logger, module_path, module_name, manifest_
             )
             
             if updated_content != content:
-                with open(manifest_file, 'w', encoding='utf-8') as f:
-                    f.write(updated_content)
+                tools._write_content(manifest_file, updated_content)
                 logger.info(f"Updated manifest version from '{original_version}' to '{new_version}' in {manifest_file}")
             else:
                 logger.warning(f"Failed to update version in {manifest_file}")
@@ -993,21 +962,24 @@ def _update_manifest_version_for_v17(logger, module_path, module_name, manifest_
     except Exception as e:
         logger.error(f"Error reading manifest file {manifest_file}: {str(e)}")
 
+@file_access(writes=[".xml"])
 def _replace_config_settings_xpath(logger, module_path, module_name, manifest_path, migration_steps, tools):
     """Replace xpath expressions specifically for res.config.settings inheritance."""
     files_to_process = tools.get_files(module_path, (".xml",))
 
-    for file in files_to_process:
+    def process_file(file):
         try:
-            with open(file, 'rb') as f:
-                content = f.read().decode('utf-8')
-                
-            if not any(pattern in content for pattern in [
+            patterns = [
                 'res.config.settings', 
                 'base.res_config_settings_view_form',
                 'res_config_settings'
-            ]):
-                continue
+            ]
+            if not tools._may_contain(file, patterns):
+                return
+            content = tools._read_content(file)
+                
+            if not any(pattern in content for pattern in patterns):
+                return
                 
             original_content = content
             
@@ -1026,43 +998,25 @@ def _replace_config_settings_xpath(logger, module_path, module_name, manifest_pa
                 content = re.sub(pattern, replacement, content)
             
             if content != original_content:
-                with open(file, 'w', encoding='utf-8') as f:
-                    f.write(content)
+                tools._write_content(file, content)
                 logger.info(f"Replaced settings xpath expressions in {file}")
                 
         except Exception as e:
             logger.error(f"Error processing file {file}: {str(e)}")
 
+    tools._map_files(process_file, files_to_process)
+
+@file_access(writes=[MANIFEST])
 def _comment_assets_js_xml_files(logger, module_path, module_name, manifest_path, migration_steps, tools):
     """Comment out .js and .xml files in assets blocks of manifest files and log the changes."""
-    manifest_file = _find_manifest_file(module_path)
+    manifest_file = _find_manifest_file(module_path, tools)
     
     if not manifest_file:
         logger.warning(f"No manifest file found in module {module_name}")
         return
     
     try:
-        # Try different encodings to handle various file encodings
-        encodings_to_try = ['utf-8', 'utf-8-sig', 'latin1', 'cp1252', 'iso-8859-1']
-        
-        content = None
-        used_encoding = None
-        
-        for encoding in encodings_to_try:
-            try:
-                with open(manifest_file, mode="rt", encoding=encoding) as file:
-                    content = file.read()
-                    used_encoding = encoding
-                    break
-            except UnicodeDecodeError:
-                continue
-            except Exception as e:
-                logger.error(f"Unexpected error reading {manifest_file} with encoding {encoding}: {e}")
-                continue
-        
-        if content is None:
-            logger.error(f"Could not read manifest file {manifest_file} with any of the tried encodings: {encodings_to_try}")
-            return
+        content = tools._read_content(manifest_file)
         
         original_content = content
         
@@ -1134,36 +1088,16 @@ def _comment_assets_js_xml_files(logger, module_path, module_name, manifest_path
         
         # Write the modified content back to the file if changes were made
         if modified_content != original_content:
-            try:
-                with open(manifest_file, mode="wt", encoding=used_encoding) as file:
-                    file.write(modified_content)
-                
-                logger.info(f"Successfully commented out {len(commented_files)} asset files in {manifest_file}")
-                logger.info(f"Commented files: {commented_files}")
-                
-            except Exception as e:
-                logger.error(f"Error writing back to {manifest_file}: {e}")
-                # Fallback to UTF-8 if the original encoding fails
-                try:
-                    with open(manifest_file, mode="wt", encoding='utf-8') as file:
-                        file.write(modified_content)
-                    logger.info(f"File {manifest_file} written using UTF-8 encoding as fallback")
-                except Exception as fallback_error:
-                    logger.error(f"Failed to write {manifest_file} even with UTF-8 fallback: {fallback_error}")
+            tools._write_content(manifest_file, modified_content)
+            
+            logger.info(f"Successfully commented out {len(commented_files)} asset files in {manifest_file}")
+            logger.info(f"Commented files: {commented_files}")
         else:
             logger.info(f"No .js or .xml files found to comment in assets block of {manifest_file}")
             
     except Exception as e:
         logger.error(f"Error processing manifest file {manifest_file}: {str(e)}")
 
-def _get_xml_files(module_path):
-    """Get all XML files in the module."""
-    xml_files = []
-    if not module_path.is_dir():
-        raise Exception(f"'{module_path}' is not a directory")
-    xml_files.extend(module_path.rglob("*.xml"))
-    return xml_files
-
 def _is_valid_odoo_module(module_name, logger):
     """
     Check if a module name refers to a valid Odoo module that should be added as dependency.
@@ -1190,29 +1124,12 @@ def _is_valid_odoo_module(module_name, logger):
     # For unknown modules, we'll be conservative and include them, but log a warning
     return True
 
-def _extract_module_references_from_xml(xml_file, logger):
+def _extract_module_references_from_xml(xml_file, logger, tools):
     """Extract module references from XML file content."""
     module_references = set()
     
     try:
-        # Try different encodings to handle various file encodings
-        encodings_to_try = ['utf-8', 'utf-8-sig', 'latin1', 'cp1252', 'iso-8859-1']
-        
-        content = None
-        for encoding in encodings_to_try:
-            try:
-                with open(xml_file, 'r', encoding=encoding) as f:
-                    content = f.read()
-                break
-            except UnicodeDecodeError:
-                continue
-            except Exception as e:
-                logger.error(f"Unexpected error reading {xml_file} with encoding {encoding}: {e}")
-                continue
-        
-        if content is None:
-            logger.error(f"Could not read XML file {xml_file} with any encoding")
-            return module_references
+        content = tools._read_content(xml_file)
         
         # Common patterns to find module references in XML files
         patterns = [
@@ -1259,29 +1176,12 @@ def _extract_module_references_from_xml(xml_file, logger):
     
     return module_references
 
-def _get_manifest_dependencies(manifest_file, logger):
+def _get_manifest_dependencies(manifest_file, logger, tools):
     """Extract current dependencies from manifest file."""
     dependencies = []
     
     try:
-        # Try different encodings to handle various file encodings
-        encodings_to_try = ['utf-8', 'utf-8-sig', 'latin1', 'cp1252', 'iso-8859-1']
-        
-        content = None
-        for encoding in encodings_to_try:
-            try:
-                with open(manifest_file, 'r', encoding=encoding) as f:
-                    content = f.read()
-                break
-            except UnicodeDecodeError:
-                continue
-            except Exception as e:
-                logger.error(f"Unexpected error reading {manifest_file} with encoding {encoding}: {e}")
-                continue
-        
-        if content is None:
-            logger.error(f"Could not read manifest file {manifest_file} with any encoding")
-            return dependencies
+        content = tools._read_content(manifest_file)
         
         # Parse the manifest file to extract dependencies
         try:
@@ -1322,36 +1222,16 @@ def _get_manifest_dependencies(manifest_file, logger):
     logger.debug(f"Current dependencies in manifest: {dependencies}")
     return dependencies
 
-def _update_manifest_dependencies_safely(manifest_file, dependencies_to_add, logger):
+def _update_manifest_dependencies_safely(manifest_file, dependencies_to_add, logger, tools):
     """
     Update the manifest file by ADDING new dependencies to existing ones.
     This function preserves all existing dependencies and only adds new ones.
     """
     try:
-        # Try different encodings to handle various file encodings
-        encodings_to_try = ['utf-8', 'utf-8-sig', 'latin1', 'cp1252', 'iso-8859-1']
-        
-        content = None
-        used_encoding = None
-        
-        for encoding in encodings_to_try:
-            try:
-                with open(manifest_file, 'r', encoding=encoding) as f:
-                    content = f.read()
-                    used_encoding = encoding
-                break
-            except UnicodeDecodeError:
-                continue
-            except Exception as e:
-                logger.error(f"Unexpected error reading {manifest_file} with encoding {encoding}: {e}")
-                continue
-        
-        if content is None:
-            logger.error(f"Could not read manifest file {manifest_file} with any encoding")
-            return False
+        content = tools._read_content(manifest_file)
         
         # Get current dependencies first by reading the actual file content again
-        current_deps = _get_manifest_dependencies(manifest_file, logger)
+        current_deps = _get_manifest_dependencies(manifest_file, logger, tools)
         logger.info(f"BEFORE UPDATE - Current dependencies: {sorted(current_deps)}")
         
         # Only add dependencies that don't already exist
@@ -1400,15 +1280,15 @@ def _update_manifest_dependencies_safely(manifest_file, dependencies_to_add, log
         if updated_content != original_content:
             # Write back to file
             try:
-                with open(manifest_file, 'w', encoding=used_encoding) as f:
-                    f.write(updated_content)
+                # Written back in the encoding of the manifest file
+                tools._write_content(manifest_file, updated_content)
                 
                 logger.info(f"AFTER UPDATE - Dependencies preserved: {sorted(existing_deps)}")
                 logger.info(f"AFTER UPDATE - Dependencies added: {sorted(new_deps_to_add)}")
                 logger.info(f"AFTER UPDATE - Final dependencies: {sorted(final_dependencies)}")
                 
                 # Verify the update worked by re-reading the file
-                verify_deps = _get_manifest_dependencies(manifest_file, logger)
+                verify_deps = _get_manifest_dependencies(manifest_file, logger, tools)
                 if sorted(set(verify_deps)) != sorted(set(final_dependencies)):
                     logger.error(f"Verification failed! Expected: {sorted(final_dependencies)}, Got: {sorted(verify_deps)}")
                     return False
@@ -1428,6 +1308,7 @@ def _update_manifest_dependencies_safely(manifest_file, dependencies_to_add, log
         return False
 
 
+@file_access(reads=[".xml"], writes=[MANIFEST])
 def _add_missing_dependencies_from_xml(logger, module_path, module_name, manifest_path, migration_steps, tools):
     """
     Scan XML files for module references and automatically add missing dependencies to manifest.
@@ -1443,13 +1324,13 @@ def _add_missing_dependencies_from_xml(logger, module_path, module_name, manifes
     logger.info(f"Starting dependency analysis for module: {module_name}")
     
     # Find manifest file
-    manifest_file = _find_manifest_file(module_path)
+    manifest_file = _find_manifest_file(module_path, tools)
     if not manifest_file:
         logger.warning(f"No manifest file found in module {module_name}")
         return
     
     # Get all XML files
-    xml_files = _get_xml_files(module_path)
+    xml_files = tools.get_files(module_path, (".xml",))
     if not xml_files:
         logger.info(f"No XML files found in module {module_name}")
         return
@@ -1461,7 +1342,7 @@ def _add_missing_dependencies_from_xml(logger, module_path, module_name, manifes
     xml_file_references = {}
     
     for xml_file in xml_files:
-        file_references = _extract_module_references_from_xml(xml_file, logger)
+        file_references = _extract_module_references_from_xml(xml_file, logger, tools)
         if file_references:
             xml_file_references[xml_file.name] = file_references
             all_module_references.update(file_references)
@@ -1474,7 +1355,7 @@ def _add_missing_dependencies_from_xml(logger, module_path, module_name, manifes
     logger.info(f"Total unique module references found: {sorted(all_module_references)}")
     
     # Get current dependencies from manifest
-    current_dependencies = _get_manifest_dependencies(manifest_file, logger)
+    current_dependencies = _get_manifest_dependencies(manifest_file, logger, tools)
     logger.info(f"Current dependencies in manifest (WILL BE PRESERVED): {sorted(current_dependencies)}")
     
     # Find missing dependencies - only add what's not already there
@@ -1504,7 +1385,7 @@ def _add_missing_dependencies_from_xml(logger, module_path, module_name, manifes
     logger.info(f"Expected final dependencies: {sorted(set(current_dependencies + missing_dependencies))}")
     
     # Update manifest file with ONLY the missing dependencies
-    if _update_manifest_dependencies_safely(manifest_file, missing_dependencies, logger):
+    if _update_manifest_dependencies_safely(manifest_file, missing_dependencies, logger, tools):
         logger.info(f"Successfully updated manifest dependencies in {manifest_file}")
         
         # Log detailed information about which files reference which modules
@@ -1,8 +1,10 @@
 
 from odoo_module_upgrade.base_migration_script import BaseMigrationScript
+from odoo_module_upgrade.function_graph import MANIFEST, file_access
 import re
 
 
+@file_access(writes=[".xml", ".js", ".py"])
 def replace_tree_with_list_in_views(
     logger, module_path, module_name, manifest_path, migration_steps, tools
 ):
@@ -27,7 +29,7 @@ def replace_tree_with_list_in_views(
     reg_tree_to_list_String = re.compile(r"""([ '">)])Tree( [vV]iews?[ '"<.)])""")
     reg_tree_to_list_env_ref = re.compile(r"""(self\.env\.ref\(.*['"])tree(['"])""")
 
-    for file in files_to_process:
+    def process_file(file):
         try:
             content = tools._read_content(file)
             content = content.replace(" tree view ", " list view ")
@@ -47,7 +49,10 @@ def replace_tree_with_list_in_views(
         except Exception as e:
             logger.error(f"Error processing file {file}: {str(e)}")
 
+    tools._map_files(process_file, files_to_process)
 
+
+@file_access(writes=[".xml"])
 def replace_chatter_blocks(
     logger, module_path, module_name, manifest_path, migration_steps, tools
 ):
@@ -72,7 +77,7 @@ def replace_chatter_blocks(
         reg_chatter_with_position_self_closing: replace_chatter_self_closing,
     }
 
-    for file in files_to_process:
+    def process_file(file):
         try:
             tools._replace_in_file(
                 file, replaces, log_message=f"Updated chatter blocks in file: {file}"
@@ -80,7 +85,10 @@ def replace_chatter_blocks(
         except Exception as e:
             logger.error(f"Error processing file {file}: {str(e)}")
 
+    tools._map_files(process_file, files_to_process)
+
 
+@file_access(writes=[".xml", ".js", ".py"])
 def replace_deprecated_kanban_box_card_menu(
     logger, module_path, module_name, manifest_path, migration_steps, tools
 ):
@@ -90,7 +98,8 @@ def replace_deprecated_kanban_box_card_menu(
         "kanban-box": "card",
         "kanban-menu": "menu",
     }
-    for file in files_to_process:
+
+    def process_file(file):
         try:
             tools._replace_in_file(
                 file,
@@ -100,7 +109,10 @@ def replace_deprecated_kanban_box_card_menu(
         except Exception as e:
             logger.error(f"Error processing file {file}: {str(e)}")
 
+    tools._map_files(process_file, files_to_process)
 
+
+@file_access(writes=[".py"])
 def replace_user_has_groups(
     logger, module_path, module_name, manifest_path, migration_steps, tools
 ):
@@ -110,13 +122,16 @@ def replace_user_has_groups(
         r"self\.user_has_groups\(\s*(['\"])([^'\"]*[,!][^'\"]*?)\1\s*\)": r"self.env.user.has_groups(\1\2\1)",
     }
 
-    for file in files_to_process:
+    def process_file(file):
         try:
             tools._replace_in_file(file, replaces)
         except Exception as e:
             logger.error(f"Error processing file {file}: {str(e)}")
 
+    tools._map_files(process_file, files_to_process)
+
 
+@file_access(writes=[".py"])
 def replace_unaccent_parameter(
     logger, module_path, module_name, manifest_path, migration_steps, tools
 ):
@@ -132,7 +147,7 @@ def replace_unaccent_parameter(
         r"(?s)fields\.(Char|Text|Html|Properties)\(([^)]+?),\s*unaccent\s*=\s*(False|True)\s*\)": r"fields.\1(\2)",
     }
 
-    for file in files_to_process:
+    def process_file(file):
         try:
             tools._replace_in_file(
                 file,
@@ -142,7 +157,10 @@ def replace_unaccent_parameter(
         except Exception as e:
             logger.error(f"Error processing file {file}: {str(e)}")
 
+    tools._map_files(process_file, files_to_process)
+
 
+@file_access(writes=[".py"])
 def replace_ustr(
     logger, module_path, module_name, manifest_path, migration_steps, tools
 ):
@@ -157,7 +175,7 @@ def replace_ustr(
         r"misc\.ustr\(([^)]+)\)": r"\1",
         r"=\s*ustr\(([^)]+)\)": r"= \1",
     }
-    for file in files_to_process:
+    def process_file(file):
         try:
             tools._replace_in_file(
                 file, replaces, log_message=f"Deprecate ustr in: {file}"
@@ -165,28 +183,30 @@ def replace_ustr(
         except Exception as e:
             logger.error(f"Error processing file {file}: {str(e)}")
 
-def _find_manifest_file(module_path):
+    tools._map_files(process_file, files_to_process)
+
+def _find_manifest_file(module_path, tools):
     """Find the manifest file (__manifest__.py) in the module."""
     manifest_paths = [
         module_path / "__manifest__.py",
         module_path / "__openerp__.py",
     ]    
     for manifest_path in manifest_paths:
-        if manifest_path.exists():
+        if tools._exists(manifest_path):
             return manifest_path    
     return None
 
+@file_access(writes=[MANIFEST])
 def _update_manifest_version_for_v18(logger, module_path, module_name, manifest_path, migration_steps, tools):
     """Update manifest version to be compatible with Odoo 18."""
-    manifest_file = _find_manifest_file(module_path)
+    manifest_file = _find_manifest_file(module_path, tools)
     
     if not manifest_file:
         logger.warning(f"No manifest file found in module {module_name}")
         return
     
     try:
-        with open(manifest_file, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = tools._read_content(manifest_file)
         
         try:
             version_match = re.search(r'["\']version["\']\s*:\s*["\']([^"\']+)["\']', content)
@@ -221,8 +241,7 @@ def _update_manifest_version_for_v18(logger, module_path, module_name, manifest_
             )
             
             if updated_content != content:
-                with open(manifest_file, 'w', encoding='utf-8') as f:
-                    f.write(updated_content)
+                tools._write_content(manifest_file, updated_content)
                 logger.info(f"Updated manifest version from '{original_version}' to '{new_version}' in {manifest_file}")
             else:
                 logger.warning(f"Failed to update version in {manifest_file}")
@@ -233,6 +252,7 @@ def _update_manifest_version_for_v18(logger, module_path, module_name, manifest_
     except Exception as e:
         logger.error(f"Error reading manifest file {manifest_file}: {str(e)}")
 
+@file_access(writes=[".xml"])
 def replace_xml_field_type_tree(
     logger, module_path, module_name, manifest_path, migration_steps, tools
 ):
@@ -248,10 +268,8 @@ def replace_xml_field_type_tree(
         re.IGNORECASE
     )
     
-    files_modified = 0
-    total_replacements = 0
-    
-    for file in files_to_process:
+    def process_file(file):
+        """Return the number of replacements done in the file"""
         try:
             logger.debug(f"Processing XML file for field type tree replacement: {file}")
             
@@ -269,18 +287,21 @@ def replace_xml_field_type_tree(
                 # Write the modified content back to file
                 tools._write_content(file, content)
                 
-                files_modified += 1
-                total_replacements += file_replacements
-                
                 logger.info(
                     f"Replaced {file_replacements} '<field name=\"type\">tree</field>' "
                     f"occurrences with 'list' in file: {file}"
                 )
+                return file_replacements
             else:
                 logger.debug(f"No '<field name=\"type\">tree</field>' patterns found in: {file}")
                 
         except Exception as e:
             logger.error(f"Error processing XML file {file} for field type replacement: {str(e)}")
+        return 0
+
+    file_replacements = tools._map_files(process_file, files_to_process)
+    files_modified = len([x for x in file_replacements if x])
+    total_replacements = sum(file_replacements)
     
     if total_replacements > 0:
         logger.info(
@@ -290,6 +311,7 @@ def replace_xml_field_type_tree(
     else:
         logger.info("[Odoo 18 Migration] No '<field name=\"type\">tree</field>' patterns found to replace")
 
+@file_access(writes=[".xml"])
 def remove_deprecated_ir_cron_fields(
     logger, module_path, module_name, manifest_path, migration_steps, tools
 ):
@@ -358,21 +380,23 @@ def remove_deprecated_ir_cron_fields(
         re.IGNORECASE
     )
     
-    files_modified = 0
-    total_numbercall_removals = 0
-    total_doall_removals = 0
-    
-    for file in files_to_process:
+    def process_file(file):
+        """Return the number of numbercall and doall fields removed from the
+        file"""
         try:
             logger.debug(f"Processing XML file for ir.cron deprecated fields removal: {file}")
             
+            # Check if file contains ir.cron model references to avoid unnecessary processing
+            if not tools._may_contain(file, ['ir.cron']):
+                logger.debug(f"No ir.cron references found in: {file}")
+                return 0, 0
+
             content = tools._read_content(file)
             original_content = content
             
-            # Check if file contains ir.cron model references to avoid unnecessary processing
             if 'ir.cron' not in content and 'model="ir.cron"' not in content:
                 logger.debug(f"No ir.cron references found in: {file}")
-                continue
+                return 0, 0
             
             # Count matches before removal for logging
             numbercall_matches = reg_numbercall_field.findall(content)
@@ -394,7 +418,6 @@ def remove_deprecated_ir_cron_fields(
                 # Then remove any remaining instances
                 content = reg_numbercall_field.sub('', content)
                 content_modified = True
-                total_numbercall_removals += file_numbercall_removals
                 
                 logger.info(
                     f"Removed {file_numbercall_removals} deprecated '<field name=\"numbercall\">-1</field>' "
@@ -416,7 +439,6 @@ def remove_deprecated_ir_cron_fields(
                 content = reg_doall_field_non_closing.sub('', content)
                 
                 content_modified = True
-                total_doall_removals += file_doall_removals
                 
                 logger.info(
                     f"Removed {file_doall_removals} deprecated '<field name=\"doall\">' "
@@ -426,12 +448,18 @@ def remove_deprecated_ir_cron_fields(
             # Write the modified content back to file if any changes were made
             if content_modified:
                 tools._write_content(file, content)
-                files_modified += 1
+                return file_numbercall_removals, file_doall_removals
             else:
                 logger.debug(f"No deprecated ir.cron fields found in: {file}")
                 
         except Exception as e:
             logger.error(f"Error processing XML file {file} for ir.cron deprecated fields removal: {str(e)}")
+        return 0, 0
+
+    file_removals = tools._map_files(process_file, files_to_process)
+    files_modified = len([x for x in file_removals if any(x)])
+    total_numbercall_removals = sum(x[0] for x in file_removals)
+    total_doall_removals = sum(x[1] for x in file_removals)
     
     # Summary logging
     if total_numbercall_removals > 0 or total_doall_removals > 0:
@@ -446,6 +474,7 @@ def remove_deprecated_ir_cron_fields(
     else:
         logger.info("[Odoo 18 Migration] No deprecated ir.cron fields found to remove")
 
+@file_access(writes=[".xml"])
 def replace_active_id_with_parent_id(
     logger, module_path, module_name, manifest_path, migration_steps, tools
 ):
@@ -478,20 +507,22 @@ def replace_active_id_with_parent_id(
         re.IGNORECASE
     )
     
-    files_modified = 0
-    total_replacements = 0
-    
-    for file in files_to_process:
+    def process_file(file):
+        """Return the number of replacements done in the file"""
         try:
             logger.debug(f"Processing XML file for active_id replacement: {file}")
             
+            # Check if file contains field definitions with context to avoid unnecessary processing
+            if not tools._may_contain(file, ['context=', 'active_id'], all_of=True):
+                logger.debug(f"No context with active_id found in: {file}")
+                return 0
+
             content = tools._read_content(file)
             original_content = content
             
-            # Check if file contains field definitions with context to avoid unnecessary processing
             if 'context=' not in content or 'active_id' not in content:
                 logger.debug(f"No context with active_id found in: {file}")
-                continue
+                return 0
             
             # Count active_id occurrences before replacement for logging
             before_count = len(re.findall(r'\bactive_id\b', content, re.IGNORECASE))
@@ -512,13 +543,12 @@ def replace_active_id_with_parent_id(
                 # Write the modified content back to file if any changes were made
                 if content != original_content and file_replacements > 0:
                     tools._write_content(file, content)
-                    files_modified += 1
-                    total_replacements += file_replacements
                     
                     logger.info(
                         f"Replaced {file_replacements} 'active_id' occurrences with 'parent.id' "
                         f"in context attributes in file: {file}"
                     )
+                    return file_replacements
                 else:
                     logger.debug(f"No changes made to file: {file}")
             else:
@@ -526,6 +556,11 @@ def replace_active_id_with_parent_id(
                 
         except Exception as e:
             logger.error(f"Error processing XML file {file} for active_id replacement: {str(e)}")
+        return 0
+
+    file_replacements = tools._map_files(process_file, files_to_process)
+    files_modified = len([x for x in file_replacements if x])
+    total_replacements = sum(file_replacements)
     
     # Summary logging
     if total_replacements > 0:
@@ -1,5 +1,6 @@
 
 from odoo_module_upgrade.base_migration_script import BaseMigrationScript
+from odoo_module_upgrade.function_graph import MANIFEST, file_access
 
 _TEXT_REPLACES = {
     ".xml": {
@@ -8,6 +9,7 @@ _TEXT_REPLACES = {
 }
 
 
+@file_access(writes=[MANIFEST])
 def set_module_installable(**kwargs):
     tools = kwargs["tools"]
     manifest_path = kwargs["manifest_path"]
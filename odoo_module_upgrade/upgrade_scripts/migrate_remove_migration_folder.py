@@ -1,16 +1,16 @@
 
 import os
-import subprocess
 from odoo_module_upgrade.base_migration_script import BaseMigrationScript
 
 
 def remove_migration_folder(**kwargs):
     logger = kwargs["logger"]
+    tools = kwargs["tools"]
     module_path = kwargs["module_path"]
     migration_path_folder = os.path.join(module_path, "migrations")
-    if os.path.exists(migration_path_folder):
+    if tools._exists(migration_path_folder):
         logger.info("Removing 'migrations' folder")
-        subprocess.check_output("rm -r %s" % migration_path_folder, shell=True)
+        tools._remove_tree(migration_path_folder)
 
 
 class MigrationScript(BaseMigrationScript):
@@ -1,3 +1,7 @@
+from odoo_module_upgrade.function_graph import MANIFEST, file_access
+
+
+@file_access(writes=[MANIFEST])
 def bump_revision(**kwargs):
     tools = kwargs["tools"]
     manifest_path = kwargs["manifest_path"]
@@ -0,0 +1,156 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from .config import _WATCH_DEBOUNCE, _WATCH_POLL_INTERVAL
+from .log import logger
+
+# inotify(7) events
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+_IN_EVENT = struct.Struct("iIII")
+
+# Folders never watched
+_SKIPPED_FOLDER_NAMES = [".git", "__pycache__"]
+
+
+def get_file_watcher(folder_paths):
+    """Return a watcher of the files of the folders: inotify on Linux, or a
+    watcher polling the disk on the other systems"""
+    try:
+        return InotifyWatcher(folder_paths)
+    except OSError as e:
+        logger.debug("Unable to use inotify (%s), polling the files instead" % e)
+        return PollingWatcher(folder_paths)
+
+
+class InotifyWatcher(object):
+    """Watch the files written, created or moved in the folders and their
+    sub-folders, with inotify"""
+
+    def __init__(self, folder_paths):
+        library_name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(library_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # {watch descriptor: folder path}
+        self._folders = {}
+        try:
+            for folder_path in folder_paths:
+                self._add_folder(os.path.abspath(os.fspath(folder_path)))
+        except OSError:
+            self.close()
+            raise
+
+    def _add_folder(self, folder_path):
+        """Watch the folder and its sub-folders, and return their files"""
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(folder_path), _IN_WATCH_MASK
+        )
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "Unable to watch %s" % folder_path)
+        self._folders[wd] = folder_path
+        file_paths = []
+        try:
+            with os.scandir(folder_path) as entries:
+                entries = list(entries)
+        except OSError:
+            return file_paths
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in _SKIPPED_FOLDER_NAMES:
+                    file_paths.extend(self._add_folder(entry.path))
+            else:
+                file_paths.append(entry.path)
+        return file_paths
+
+    def get_changes(self, timeout=None):
+        """Wait for changes, and return the paths of the written, created or
+        moved files. The changes following the first ones by less than
+        _WATCH_DEBOUNCE seconds are returned with them."""
+        file_paths = set()
+        while select.select([self._fd], [], [], timeout)[0]:
+            data = os.read(self._fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, __, length = _IN_EVENT.unpack_from(data, offset)
+                offset += _IN_EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & _IN_Q_OVERFLOW:
+                    logger.warning("Too many changes at once, some were missed")
+                    continue
+                folder_path = self._folders.get(wd)
+                if mask & _IN_IGNORED:
+                    self._folders.pop(wd, None)
+                    continue
+                if folder_path is None:
+                    continue
+                path = os.path.join(folder_path, name)
+                if mask & _IN_ISDIR:
+                    if name not in _SKIPPED_FOLDER_NAMES and os.path.isdir(path):
+                        # The files created before the folder was watched
+                        file_paths.update(self._add_folder(path))
+                elif mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO):
+                    file_paths.add(path)
+            timeout = _WATCH_DEBOUNCE
+        return sorted(file_paths)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher(object):
+    """Watch the files of the folders and their sub-folders, by comparing
+    their modification times every _WATCH_POLL_INTERVAL seconds"""
+
+    def __init__(self, folder_paths):
+        self._folder_paths = [os.path.abspath(os.fspath(x)) for x in folder_paths]
+        self._stats = self._get_stats()
+
+    def _get_stats(self):
+        stats = {}
+        for folder_path in self._folder_paths:
+            for root, folder_names, file_names in os.walk(folder_path):
+                folder_names[:] = [
+                    x for x in folder_names if x not in _SKIPPED_FOLDER_NAMES
+                ]
+                for file_name in file_names:
+                    file_path = os.path.join(root, file_name)
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError:
+                        continue
+                    stats[file_path] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def get_changes(self, timeout=None):
+        """Wait for changes, and return the paths of the changed or created
+        files"""
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(_WATCH_POLL_INTERVAL)
+            stats = self._get_stats()
+            file_paths = sorted(
+                file_path
+                for file_path, stat in stats.items()
+                if self._stats.get(file_path) != stat
+            )
+            self._stats = stats
+            if file_paths or (end is not None and time.monotonic() >= end):
+                return file_paths
+
+    def close(self):
+        pass
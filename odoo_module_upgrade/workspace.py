@@ -0,0 +1,418 @@
+import difflib
+import os
+import threading
+
+from .file_index import FileIndex
+from .log import logger
+from . import file_encoding
+from . import tools
+
+
+class Workspace(object):
+    """In-memory buffer of the files of a module during its migration.
+
+    Each file is read from the disk once, on first access, then all the
+    migration scripts read and write the buffered content through
+    tools._read_content() and tools._write_content(). flush() writes the
+    changed files back once, at the end of the module migration.
+
+    The files can be accessed from several threads (see tools._map_files()),
+    a given file being handled by one thread at a time.
+
+    The files of the root folder (the module) are listed once, in a
+    FileIndex, kept up to date with the created, renamed and removed files.
+    The files excluded by the file_filter are not listed, nor the ones not
+    in file_paths, if given.
+
+    The renamed files are recorded in a rename plan, and renamed on the
+    disk by flush(), in one pass, reported at once.
+
+    A virtual workspace never touches the disk: deletions are recorded in
+    memory too, and get_diff() returns the changes as a patch instead of
+    flushing them. (dry-run mode)
+    """
+
+    def __init__(self, root=None, virtual=False, file_filter=None, file_paths=None):
+        self.virtual = virtual
+        self._root = root
+        self._file_filter = file_filter
+        self._file_paths = file_paths
+        self._index = None
+        # {absolute_path: [content, encoding, original_content, newline]}
+        self._files = {}
+        # Paths of the files that must not be changed (see freeze())
+        self._frozen = set()
+        # Rename plan: {new_absolute_path: old_absolute_path} of the renamed
+        # files. Paths of the files renamed and, in virtual mode, of the
+        # deleted files and folders
+        self._sources = {}
+        self._deleted = set()
+        self._lock = threading.Lock()
+
+    def _key(self, file_path):
+        return os.path.abspath(os.fspath(file_path))
+
+    def _get_index(self, path):
+        """Return the FileIndex of the root folder if it contains path"""
+        if self._root is None:
+            return None
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = FileIndex(
+                        self._root, self._file_filter, self._file_paths
+                    )
+        return self._index if self._index.covers(path) else None
+
+    def _get_entry(self, file_path):
+        key = self._key(file_path)
+        entry = self._files.get(key)
+        if entry is None:
+            if self._is_deleted(key):
+                raise FileNotFoundError("No such file: '%s'" % key)
+            content, encoding, newline = tools._read_file(key)
+            with self._lock:
+                entry = self._files.setdefault(
+                    key, [content, encoding, content, newline]
+                )
+        return entry
+
+    def read(self, file_path):
+        return self._get_entry(file_path)[0]
+
+    def read_binary(self, file_path):
+        content, encoding, __, __ = self._get_entry(file_path)
+        return content.encode(encoding)
+
+    def get_buffered_content(self, file_path):
+        """Return the content of the file, or None if it is not buffered
+        yet"""
+        entry = self._files.get(self._key(file_path))
+        return entry[0] if entry is not None else None
+
+    def get_encoding(self, file_path):
+        """Return the encoding the file is written back in: the one of its
+        original content, utf-8 for a new file"""
+        entry = self._files.get(self._key(file_path))
+        if entry is None:
+            return file_encoding.get_encoding(file_path)
+        return entry[1]
+
+    def write(self, file_path, content):
+        key = self._key(file_path)
+        index = self._get_index(key)
+        with self._lock:
+            entry = self._files.get(key)
+            if key in self._frozen and (entry is None or entry[0] != content):
+                # Changed by a global function: the per-file tasks of the
+                # next scripts don't skip it anymore
+                logger.debug("Unfreezing the changed file %s" % key)
+                self._frozen.remove(key)
+            if entry is None:
+                self._files[key] = [content, "utf-8", None, "\n"]
+                if index:
+                    index.add(key)
+            else:
+                # content is written back in its original encoding
+                entry[0] = content
+
+    def rename(self, old_file_path, new_file_path):
+        old_key, new_key = self._key(old_file_path), self._key(new_file_path)
+        # The content of the file moves with it
+        self._get_entry(old_key)
+        index = self._get_index(old_key)
+        with self._lock:
+            if index:
+                index.rename(old_key, new_key)
+            entry = self._files.pop(old_key, None)
+            if entry is not None:
+                self._files[new_key] = entry
+            if old_key in self._frozen:
+                self._frozen.remove(old_key)
+                self._frozen.add(new_key)
+            self._sources[new_key] = self._sources.pop(old_key, old_key)
+            self._deleted.add(old_key)
+            self._deleted.discard(new_key)
+
+    def get_source(self, file_path):
+        """Return the path the file is read from: its path before being
+        renamed, if it was"""
+        key = self._key(file_path)
+        return self._sources.get(key, key)
+
+    def freeze(self, file_path):
+        """Keep the file as it is: the per-file tasks skip it (see
+        tools._is_frozen()), until a change of its content"""
+        self._frozen.add(self._key(file_path))
+
+    def is_frozen(self, file_path):
+        return self._key(file_path) in self._frozen
+
+    def get_files(self):
+        """Return the buffered files, as a list of
+        (absolute_path, original_content, content)"""
+        with self._lock:
+            return [
+                (key, original_content, content)
+                for key, (content, __, original_content, __) in sorted(
+                    self._files.items()
+                )
+            ]
+
+    def discard(self, path):
+        """Forget the buffered files located in the given path"""
+        key = self._key(path)
+        prefix = os.path.join(key, "")
+        index = self._get_index(key)
+        with self._lock:
+            if index:
+                index.remove(key)
+            for file_key in list(self._files):
+                if file_key == key or file_key.startswith(prefix):
+                    del self._files[file_key]
+                    self._sources.pop(file_key, None)
+            if self.virtual:
+                self._deleted.add(key)
+
+    def _is_deleted(self, key):
+        return any(
+            key == path or key.startswith(os.path.join(path, ""))
+            for path in self._deleted
+        )
+
+    def exists(self, path):
+        key = self._key(path)
+        if key in self._files:
+            return True
+        index = self._get_index(key)
+        if index:
+            return index.exists(key)
+        if self._is_deleted(key):
+            return False
+        return os.path.exists(key)
+
+    def walk(self, top):
+        """Same as os.walk(top), with the planned renames and the virtual
+        deletions"""
+        index = self._get_index(top)
+        if index:
+            yield from index.walk(top)
+            return
+        if not self.virtual and not self._deleted:
+            yield from os.walk(top)
+            return
+        for root, dirnames, filenames in os.walk(self._key(top)):
+            dirnames[:] = [
+                x for x in dirnames if not self._is_deleted(os.path.join(root, x))
+            ]
+            filenames = [
+                x for x in filenames if not self._is_deleted(os.path.join(root, x))
+            ]
+            filenames.extend(
+                sorted(
+                    os.path.basename(key)
+                    for key, (__, __, original_content, __) in list(
+                        self._files.items()
+                    )
+                    if os.path.dirname(key) == root
+                    and (key in self._sources or original_content is None)
+                    and os.path.basename(key) not in filenames
+                )
+            )
+            yield root, dirnames, filenames
+
+    def list_files(self, top, extensions):
+        """Return the files of top with the given extensions, as
+        tools.get_files(), or None if they are not indexed"""
+        index = self._get_index(top)
+        if index is None:
+            return None
+        return index.get_files(top, extensions)
+
+    def get_diff(self, base_path):
+        """Return the changes of the workspace as a git patch, the paths
+        being relative to base_path. The removed lines are the ones of the
+        files on the disk, with their bytes and line endings."""
+        self._log_renames()
+        diffs = []
+        renamed_keys = set(self._sources.values())
+        for key, (content, encoding, original_content, newline) in self._files.items():
+            source_key = self._sources.get(key, key)
+            if source_key == key and content == original_content:
+                continue
+            old_text = None
+            if original_content is not None:
+                old_text = _read_patch_text(source_key)
+            if content == original_content:
+                # Only renamed: the file is moved as it is
+                new_text = old_text
+            else:
+                new_text = _get_patch_text(content, encoding, newline)
+            diffs.append(
+                _get_file_diff(
+                    old_text,
+                    new_text,
+                    os.path.relpath(source_key, base_path),
+                    os.path.relpath(key, base_path),
+                )
+            )
+        for deleted_key in self._deleted:
+            if os.path.isdir(deleted_key):
+                deleted_file_keys = [
+                    os.path.join(root, x)
+                    for root, __, filenames in os.walk(deleted_key)
+                    for x in filenames
+                ]
+            else:
+                deleted_file_keys = [deleted_key]
+            for file_key in deleted_file_keys:
+                if file_key in renamed_keys or not os.path.isfile(file_key):
+                    continue
+                diffs.append(
+                    _get_file_diff(
+                        _read_patch_text(file_key),
+                        None,
+                        os.path.relpath(file_key, base_path),
+                        None,
+                        mode="100755" if os.access(file_key, os.X_OK) else "100644",
+                        is_binary=_is_binary_file(file_key),
+                    )
+                )
+        return "".join(x[1] for x in sorted(diffs))
+
+    def flush(self, sync=False):
+        """Rename the files of the rename plan and write the changed files on
+        the disk, in one batch: the renames and writes are done once the
+        contents of all the changed files are written in temporary files
+        (see tools._write_files()). With sync, the files are flushed to the
+        disk once.
+
+        A rename to an existing file, which is not renamed itself, is
+        refused: FileExistsError is raised, before any change on the
+        disk."""
+        renames = [
+            (old_key, new_key)
+            for new_key, old_key in sorted(self._sources.items())
+            if new_key != old_key
+        ]
+        old_keys = set(x[0] for x in renames)
+        for old_key, new_key in renames:
+            if new_key not in old_keys and os.path.lexists(new_key):
+                raise FileExistsError(
+                    "Unable to rename '%s' to '%s': the file already exists"
+                    % (old_key, new_key)
+                )
+        self._log_renames()
+        changed_keys = sorted(
+            key
+            for key, (content, __, original_content, __) in self._files.items()
+            if content != original_content
+        )
+        tools._write_files(
+            [
+                (key, self._files[key][0], self._files[key][1], self._files[key][3])
+                for key in changed_keys
+            ],
+            sync=sync,
+            renames=renames,
+        )
+        self._sources.clear()
+        self._deleted.clear()
+        for key in changed_keys:
+            entry = self._files[key]
+            entry[2] = entry[0]
+        logger.debug(
+            "Flushed %d changed file(s) out of %d read file(s)"
+            % (len(changed_keys), len(self._files))
+        )
+
+    def _log_renames(self):
+        renames = [
+            (old_key, new_key)
+            for new_key, old_key in sorted(self._sources.items())
+            if new_key != old_key
+        ]
+        if not renames:
+            return
+        root = self._root or os.sep
+        logger.info(
+            "[%s] Renaming %d file(s): %s"
+            % (
+                os.path.basename(os.fspath(root)),
+                len(renames),
+                ", ".join(
+                    "'%s' by '%s'"
+                    % (os.path.relpath(old_key, root), os.path.relpath(new_key, root))
+                    for old_key, new_key in renames
+                ),
+            )
+        )
+
+
+def _is_binary_file(file_path):
+    with open(file_path, "rb") as f:
+        return b"\0" in f.read(8000)
+
+
+def _read_patch_text(file_path):
+    """Return the content of the file on the disk, as written in the patch:
+    its bytes are kept as they are (see _get_patch_text())"""
+    with open(file_path, "rb") as f:
+        return f.read().decode("utf-8", "surrogateescape")
+
+
+def _get_patch_text(content, encoding, newline="\n"):
+    """Return the content, as written in the patch, with the line endings of
+    the file: the bytes of the files not encoded in utf-8 are kept as
+    surrogate characters, written back as they are with the 'surrogateescape'
+    error handler."""
+    if content is None:
+        return content
+    if newline != "\n":
+        content = content.replace("\n", newline)
+    if encoding == "utf-8":
+        return content
+    try:
+        data = content.encode(encoding)
+    except UnicodeEncodeError:
+        # Written in utf-8 (see file_encoding.encode())
+        return content
+    return data.decode("utf-8", "surrogateescape")
+
+
+def _split_lines(content):
+    # str.splitlines() would also split on other separators than \n
+    lines = [x + "\n" for x in content.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+
+def _get_file_diff(
+    old_content, new_content, old_name, new_name, mode="100644", is_binary=False
+):
+    """Return (path, diff) of a file, in the git patch format.
+    old_content is None for a created file, new_content for a deleted one."""
+    old_name = old_name or new_name
+    new_name = new_name or old_name
+    lines = ["diff --git a/%s b/%s\n" % (old_name, new_name)]
+    if old_content is None:
+        lines.append("new file mode %s\n" % mode)
+    elif new_content is None:
+        lines.append("deleted file mode %s\n" % mode)
+    elif old_name != new_name:
+        lines.append("rename from %s\nrename to %s\n" % (old_name, new_name))
+    from_name = "/dev/null" if old_content is None else "a/" + old_name
+    to_name = "/dev/null" if new_content is None else "b/" + new_name
+    if is_binary:
+        lines.append("Binary files %s and %s differ\n" % (from_name, to_name))
+    elif old_content != new_content:
+        lines.append("--- %s\n+++ %s\n" % (from_name, to_name))
+        diff_lines = difflib.unified_diff(
+            _split_lines(old_content or ""), _split_lines(new_content or "")
+        )
+        # Skip the header of difflib, already written
+        for line in list(diff_lines)[2:]:
+            lines.append(line)
+            if not line.endswith("\n"):
+                lines.append("\n\\ No newline at end of file\n")
+    return new_name, "".join(lines)
@@ -10,6 +10,14 @@ setuptools.setup(
     long_description_content_type="text/x-rst",
     packages=["odoo_module_upgrade", "odoo_module_upgrade.upgrade_scripts"],
     include_package_data=True,
+    # The registry of the scripts lists their rules and python_scripts
+    package_data={
+        "odoo_module_upgrade.upgrade_scripts": [
+            "registry.json",
+            "*/*/*.yaml",
+            "python_scripts/*/*.py",
+        ],
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Framework :: Odoo",
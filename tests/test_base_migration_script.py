@@ -0,0 +1,153 @@
+import re
+
+from odoo_module_upgrade import file_encoding, tools
+from odoo_module_upgrade.base_migration_script import BaseMigrationScript
+from odoo_module_upgrade.script_registry import ScriptEntry
+from odoo_module_upgrade.workspace import Workspace
+
+
+class ReplaceScript(BaseMigrationScript):
+    _TEXT_REPLACES = {".xml": {r"old_(\w+)": r"new_\1"}}
+    _TEXT_WARNINGS = {".xml": {r"<tree\b": "Use list views"}}
+
+
+def _process_file(script, file_path):
+    script.process_file(
+        str(file_path.parent),
+        file_path.name,
+        file_path.suffix,
+        {},
+        str(file_path.parent),
+        False,
+    )
+
+
+def test_unmatched_file_not_read(tmp_path, monkeypatch):
+    decoded_paths = []
+    decode_file = file_encoding.decode_file
+
+    def record_decode_file(file_path, data):
+        decoded_paths.append(file_path)
+        return decode_file(file_path, data)
+
+    monkeypatch.setattr(file_encoding, "decode_file", record_decode_file)
+    matched_path = tmp_path / "matched.xml"
+    matched_path.write_text('<field name="old_field"/>\n')
+    unmatched_path = tmp_path / "unmatched.xml"
+    unmatched_path.write_text('<field name="field"/>\n')
+    workspace = Workspace(tmp_path)
+    with tools._use_workspace(workspace):
+        _process_file(ReplaceScript(), unmatched_path)
+        _process_file(ReplaceScript(), matched_path)
+        assert workspace.get_buffered_content(str(unmatched_path)) is None
+        assert workspace.get_buffered_content(str(matched_path)) == (
+            '<field name="new_field"/>\n'
+        )
+    assert decoded_paths == [str(matched_path)]
+
+
+def test_rule_without_literal_reads_file(tmp_path):
+    class AnyScript(ReplaceScript):
+        _TEXT_WARNINGS = {".xml": {r"\w+": "Any word"}}
+
+    file_path = tmp_path / "view.xml"
+    file_path.write_text("<odoo/>\n")
+    workspace = Workspace(tmp_path)
+    with tools._use_workspace(workspace):
+        _process_file(AnyScript(), file_path)
+        assert workspace.get_buffered_content(str(file_path)) == "<odoo/>\n"
+
+
+class RenameScript(ReplaceScript):
+    _FILE_RENAMES = {"old.xml": "new.xml"}
+    _DEPRECATED_MODULES = [("old_module", "removed")]
+
+
+def _get_script_entry(tmp_path):
+    replaces_path = tmp_path / "text_replaces.yaml"
+    replaces_path.write_text('.xml:\n  "<list>": "<list/>"\n.py:\n  "a": "b"\n')
+    modules_path = tmp_path / "deprecated_modules.yaml"
+    modules_path.write_text("- [yaml_module, removed]\n")
+    return ScriptEntry(
+        name="test",
+        script="test:Script",
+        kind="step",
+        start=None,
+        end=None,
+        rule_files={
+            "text_replaces": (str(replaces_path),),
+            "deprecated_modules": (str(modules_path),),
+        },
+        python_scripts=(),
+    )
+
+
+def test_parse_rules_keeps_class_rules(tmp_path):
+    class YamlScript(RenameScript):
+        _script_entry = _get_script_entry(tmp_path)
+
+    for __ in range(2):
+        rules = YamlScript().parse_rules()
+        assert rules["_TEXT_REPLACES"] == {
+            ".xml": {r"old_(\w+)": r"new_\1", "<list>": "<list/>"},
+            ".py": {"a": "b"},
+        }
+        assert rules["_DEPRECATED_MODULES"] == [
+            ("old_module", "removed"),
+            ["yaml_module", "removed"],
+        ]
+        rules["_TEXT_REPLACES"][".xml"]["x"] = "y"
+        rules["_FILE_RENAMES"]["a.xml"] = "b.xml"
+    # The rules of the classes are not extended by the yaml files
+    assert RenameScript._TEXT_REPLACES == {".xml": {r"old_(\w+)": r"new_\1"}}
+    assert RenameScript._DEPRECATED_MODULES == [("old_module", "removed")]
+    assert RenameScript._FILE_RENAMES == {"old.xml": "new.xml"}
+    assert RenameScript().parse_rules()["_TEXT_REPLACES"] == {
+        ".xml": {r"old_(\w+)": r"new_\1"}
+    }
+
+
+def test_rule_set_once_per_class(tmp_path):
+    class YamlScript(RenameScript):
+        _script_entry = _get_script_entry(tmp_path)
+
+    rule_set = YamlScript().get_rule_set()
+    assert YamlScript().get_rule_set() is rule_set
+    assert RenameScript().get_rule_set() is not rule_set
+    assert [x[0].pattern for x in rule_set.text_replaces[".xml"]] == [
+        r"old_(\w+)",
+        "<list>",
+    ]
+    assert isinstance(rule_set.text_replaces[".xml"][0][0], re.Pattern)
+    assert rule_set.deprecated_modules == (
+        ("old_module", "removed"),
+        ("yaml_module", "removed"),
+    )
+
+
+class ModelScript(BaseMigrationScript):
+    _TEXT_REPLACES = {"*": {"<tree": "<list"}, ".xml": {"old_view": "new_view"}}
+    _TEXT_WARNINGS = {".py": {r"\.name_get\(": "name_get is removed"}}
+    _RENAMED_MODELS = [("old.model", "new.model", None)]
+    _REMOVED_FIELDS = [("res.partner", "old_field", None)]
+
+
+def test_rule_plan_per_extension():
+    script = ModelScript()
+    xml_plan = script.get_rule_plan(".xml")
+    assert script.get_rule_plan(".xml") is xml_plan
+    assert ModelScript().get_rule_plan(".xml") is xml_plan
+    py_plan = script.get_rule_plan(".py")
+    assert py_plan is not xml_plan
+
+    text = "<tree old_view 'old.model'/>\n"
+    assert xml_plan.replace(text) == "<list new_view 'new.model'/>\n"
+    # The rules of the other extensions don't apply
+    assert py_plan.replace(text) == "<list old_view 'new.model'/>\n"
+
+    text = "partner.name_get()\npartner.old_field = 1\n"
+    assert [(x.line, x.message) for x in py_plan.scan(text)] == [
+        (1, "name_get is removed"),
+        (2, "On the model res.partner, the field old_field was deprecated."),
+    ]
+    assert [x.line for x in xml_plan.scan(text)] == [2]
@@ -0,0 +1,135 @@
+import sqlite3
+
+import pytest
+
+from odoo_module_upgrade import batch
+from odoo_module_upgrade.batch import Batch, read_batch_file
+from odoo_module_upgrade.exception import ConfigException
+
+_BATCH_FILE = """
+defaults:
+  init_version_name: 16.0
+  pre_commit: false
+repositories:
+  - directory: web
+  - directory: web
+    name: web-2
+    modules: [web_tour]
+  - directory: tools
+"""
+
+
+class _JobPool(object):
+    """Run the jobs at once, failing the ones listed in failures as many
+    times as given"""
+
+    instances = []
+    failures = {}
+
+    def __init__(self, workers, on_event):
+        self.submitted_names = []
+        self._on_event = on_event
+        self.instances.append(self)
+
+    def submit(self, job_id, options):
+        self.submitted_names.append(job_id)
+        if self.failures.get(job_id):
+            self.failures[job_id] -= 1
+            self._on_event(job_id, "state", {"state": "failed", "error": "Broken"})
+            return
+        self._on_event(job_id, "log", {"level": "INFO", "message": "Migrating"})
+        self._on_event(job_id, "module", {"module": "mod_a", "state": "done"})
+        self._on_event(job_id, "state", {"state": "done", "error": None})
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def batch_path(tmp_path, monkeypatch):
+    (tmp_path / "web").mkdir()
+    (tmp_path / "tools").mkdir()
+    batch_path = tmp_path / "batch.yaml"
+    batch_path.write_text(_BATCH_FILE)
+    monkeypatch.setattr(batch, "JobPool", _JobPool)
+    monkeypatch.setattr(_JobPool, "instances", [])
+    monkeypatch.setattr(_JobPool, "failures", {})
+    return batch_path
+
+
+def _get_states(batch_path):
+    connection = sqlite3.connect(str(batch_path.with_suffix(".sqlite")))
+    try:
+        return dict(connection.execute("SELECT name, state FROM jobs"))
+    finally:
+        connection.close()
+
+
+def test_read_batch_file(batch_path, tmp_path):
+    jobs = read_batch_file(str(batch_path))
+    assert [name for name, __ in jobs] == ["web", "web-2", "tools"]
+    options = dict(jobs)
+    assert options["web"]["directory"] == str(tmp_path / "web")
+    assert options["web-2"]["directory"] == str(tmp_path / "web")
+    assert options["web"]["init_version_name"] == "16.0"
+    assert not options["web"]["pre_commit"]
+    assert options["web"]["modules"] == []
+    assert options["web-2"]["modules"] == ["web_tour"]
+
+
+@pytest.mark.parametrize(
+    "repositories, error",
+    [
+        ("[]", "has no list of repositories"),
+        ("[{name: web}]", "must have a directory"),
+        ("[{directory: web}, {directory: web}]", "listed twice"),
+        ("[{directory: web, dry_run: true}]", "dry-run mode"),
+        ("[{directory: web, file_jobs: two}]", "Repository 'web': The option"),
+    ],
+)
+def test_read_invalid_batch_file(batch_path, repositories, error):
+    batch_path.write_text(
+        "defaults:\n  init_version_name: 16.0\nrepositories: %s\n" % repositories
+    )
+    with pytest.raises(ConfigException, match=error):
+        read_batch_file(str(batch_path))
+
+
+def test_run_same_directory_one_after_another(batch_path):
+    _JobPool.failures["tools"] = 1
+    assert Batch(str(batch_path), workers=3, retries=1).run()
+    # web-2 waits for the end of web, tools is retried once
+    assert _JobPool.instances[0].submitted_names == ["web", "tools", "web-2", "tools"]
+    assert _get_states(batch_path) == {"web": "done", "web-2": "done", "tools": "done"}
+
+    # The repositories already migrated are skipped, without starting a pool
+    assert Batch(str(batch_path), workers=3).run()
+    assert len(_JobPool.instances) == 1
+
+
+def test_run_again(batch_path):
+    _JobPool.failures["tools"] = 2
+    assert not Batch(str(batch_path), workers=2).run()
+    assert _get_states(batch_path) == {
+        "web": "done",
+        "web-2": "done",
+        "tools": "failed",
+    }
+
+    # An interrupted job is run again, a failed one only on demand
+    connection = sqlite3.connect(str(batch_path.with_suffix(".sqlite")))
+    with connection:
+        connection.execute("UPDATE jobs SET state = 'running' WHERE name = 'web'")
+    connection.close()
+    assert not Batch(str(batch_path)).run()
+    assert _JobPool.instances[-1].submitted_names == ["web"]
+    assert not Batch(str(batch_path), retry_failed=True).run()
+    assert _JobPool.instances[-1].submitted_names == ["tools"]
+    assert Batch(str(batch_path), retry_failed=True).run()
+    assert _JobPool.instances[-1].submitted_names == ["tools"]
+    assert _get_states(batch_path) == {"web": "done", "web-2": "done", "tools": "done"}
+
+    # The jobs whose options changed are run again
+    batch_path.write_text(_BATCH_FILE.replace("pre_commit: false", "fused: true"))
+    assert Batch(str(batch_path)).run()
+    assert _JobPool.instances[-1].submitted_names == ["web", "web-2", "tools"]
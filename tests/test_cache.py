@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from odoo_module_upgrade import cache, tools
+from odoo_module_upgrade.cache import ModuleCache
+from odoo_module_upgrade.workspace import Workspace
+
+
+@pytest.fixture
+def module_path(tmp_path):
+    module_path = tmp_path / "mod_a"
+    module_path.mkdir()
+    (module_path / "a.xml").write_text("<tree/>\n")
+    (module_path / "b.xml").write_text("<tree></tree>\n")
+    return module_path
+
+
+@pytest.fixture
+def hashed_paths(monkeypatch):
+    hashed_paths = []
+    hash_file = cache._hash_file
+
+    def record_hash_file(file_path):
+        hashed_paths.append(os.path.basename(file_path))
+        return hash_file(file_path)
+
+    monkeypatch.setattr(cache, "_hash_file", record_hash_file)
+    return hashed_paths
+
+
+def _migrate(module_path, fingerprint="1"):
+    """Migrate the files of the module not frozen by the cache, and return
+    the names of the migrated ones"""
+    workspace = Workspace(module_path)
+    module_cache = ModuleCache(str(module_path.parent), "mod_a", fingerprint)
+    module_cache.freeze_migrated_files(module_path, workspace)
+    file_names = []
+    with tools._use_workspace(workspace):
+        for file_path in sorted(module_path.glob("*.xml")):
+            if tools._is_frozen(str(file_path)):
+                continue
+            file_names.append(file_path.name)
+            content = tools._read_content(str(file_path))
+            tools._write_content(str(file_path), content.replace("tree", "list"))
+        module_cache.update(module_path, workspace)
+        workspace.flush()
+    module_cache.save(module_path)
+    # The files written in the same tick as the cache would be hashed
+    cache_path = str(module_path.parent / ".odoo_module_upgrade_cache" / "mod_a.json")
+    saved_ns = os.stat(cache_path).st_mtime_ns + 10 ** 9
+    os.utime(cache_path, ns=(saved_ns, saved_ns))
+    return file_names
+
+
+def test_unchanged_files_not_read(module_path, hashed_paths):
+    assert _migrate(module_path) == ["a.xml", "b.xml"]
+    del hashed_paths[:]
+    assert _migrate(module_path) == []
+    assert hashed_paths == []
+    assert (module_path / "a.xml").read_text() == "<list/>\n"
+
+
+def test_edited_file_migrated_again(module_path, hashed_paths):
+    _migrate(module_path)
+    # Same size, the bytes are hashed
+    (module_path / "a.xml").write_text("<tree/>\n")
+    del hashed_paths[:]
+    assert _migrate(module_path) == ["a.xml"]
+    assert "a.xml" in hashed_paths
+    assert (module_path / "a.xml").read_text() == "<list/>\n"
+
+
+def test_touched_file_hashed(module_path, hashed_paths):
+    _migrate(module_path)
+    os.utime(str(module_path / "b.xml"), (0, 0))
+    del hashed_paths[:]
+    assert _migrate(module_path) == []
+    assert hashed_paths[:1] == ["b.xml"]
+
+
+def test_fingerprint_change(module_path):
+    _migrate(module_path)
+    (module_path / "a.xml").write_text("<tree/>\n")
+    assert _migrate(module_path, fingerprint="2") == ["a.xml", "b.xml"]
+    assert _migrate(module_path, fingerprint="2") == []
@@ -0,0 +1,96 @@
+import csv
+import logging
+import os
+
+import pytest
+
+from odoo_module_upgrade import csv_migration, tools
+from odoo_module_upgrade.base_migration_script import BaseMigrationScript
+from odoo_module_upgrade.csv_migration import CsvStage, migrate_csv_file
+from odoo_module_upgrade.log import logger
+from odoo_module_upgrade.workspace import Workspace
+
+_CONTENT = (
+    "id,name,old_field,model_id:id,res_model\n"
+    'a,"Line 1\nline 2",x,model_old_model,old.model\n'
+    "b,B,y,base.model_gone_model,other\n"
+    "c,C,z,model_other,gone.model\n"
+    'd,D,"q, r",x,y\n'
+)
+
+_MIGRATED_CONTENT = (
+    "id,name,new_field,model_id:id,res_model\n"
+    'a,"Line 1\nline 2",x,model_new_model,new.model\n'
+    "b,B,y,base.model_gone_model,other\n"
+    "c,C,z,model_other,gone.model\n"
+    'd,D,"q, r",x,y\n'
+)
+
+
+class CsvScript(BaseMigrationScript):
+    _RENAMED_MODELS = [("old.model", "new.model", "")]
+    _REMOVED_MODELS = [("gone.model", "")]
+    _RENAMED_FIELDS = [("res.partner", "old_field", "new_field", "")]
+
+
+def _process_file(file_path):
+    CsvScript().process_file(
+        str(file_path.parent),
+        file_path.name,
+        file_path.suffix,
+        {},
+        str(file_path.parent),
+        False,
+    )
+
+
+def test_columns_migrated(tmp_path):
+    file_path = tmp_path / "res.partner.csv"
+    file_path.write_text(_CONTENT)
+    stage = CsvStage(CsvScript().get_csv_plan(), file_path.name)
+    migrate_csv_file(str(file_path), [stage])
+    assert file_path.read_text() == _MIGRATED_CONTENT
+    assert stage.changed
+    # The cells of the removed model, reported once with the text rules
+    assert sorted(
+        (x.severity, x.line, x.column) for x in stage.findings if x.severity == "error"
+    ) == [("error", 4, 12), ("error", 5, 19)]
+
+
+def test_unchanged_file_not_written(tmp_path):
+    file_path = tmp_path / "res.users.csv"
+    file_path.write_text("id,name\na,A\n")
+    inode = os.stat(str(file_path)).st_ino
+    _process_file(file_path)
+    assert os.stat(str(file_path)).st_ino == inode
+
+
+@pytest.mark.parametrize("block_lines", [1, 2, 3, 1000])
+def test_streamed_by_blocks(tmp_path, monkeypatch, block_lines):
+    monkeypatch.setattr(csv_migration, "_CSV_BLOCK_LINES", block_lines)
+    # Streamed from and to the disk, instead of being buffered
+    monkeypatch.setattr(tools, "_CSV_STREAMED_SIZE", 0)
+    file_path = tmp_path / "res.partner.csv"
+    rows = "".join("r%d,R,x,model_other,other\n" % x for x in range(5))
+    file_path.write_bytes((_CONTENT + rows).replace("\n", "\r\n").encode())
+    workspace = Workspace(tmp_path)
+    with tools._use_workspace(workspace):
+        _process_file(file_path)
+        assert workspace.get_buffered_content(str(file_path)) is None
+    assert file_path.read_bytes() == (
+        (_MIGRATED_CONTENT + rows).replace("\n", "\r\n").encode()
+    )
+
+
+def test_invalid_csv_migrated_as_text(tmp_path, monkeypatch, caplog):
+    file_path = tmp_path / "res.partner.csv"
+    file_path.write_text(_CONTENT)
+    field_size_limit = csv.field_size_limit(4)
+    try:
+        with caplog.at_level(logging.WARNING, logger=logger.name):
+            _process_file(file_path)
+    finally:
+        csv.field_size_limit(field_size_limit)
+    assert "Unable to read %s as a CSV file" % file_path in caplog.text
+    # The text rules still apply, the header is kept
+    assert file_path.read_text() == _CONTENT.replace("model_old_", "model_new_")
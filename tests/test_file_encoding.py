@@ -0,0 +1,102 @@
+import codecs
+
+import pytest
+
+from odoo_module_upgrade import file_encoding, tools
+
+
+@pytest.fixture(autouse=True)
+def forget_encodings():
+    yield
+    file_encoding.forget_encodings()
+
+
+@pytest.mark.parametrize(
+    "data, text, encoding",
+    [
+        (b"<odoo/>\n", "<odoo/>\n", "utf-8"),
+        ("<odoo>é</odoo>".encode("utf-8"), "<odoo>é</odoo>", "utf-8"),
+        (codecs.BOM_UTF8 + "é".encode("utf-8"), "é", "utf-8-sig"),
+        ("é\n".encode("utf-16"), "é\n", "utf-16"),
+        ("é\n".encode("utf-32"), "é\n", "utf-32"),
+        (
+            '<?xml version="1.0" encoding="cp1252"?>\n<a>€</a>'.encode("cp1252"),
+            '<?xml version="1.0" encoding="cp1252"?>\n<a>€</a>',
+            "cp1252",
+        ),
+        (
+            "#!/usr/bin/python\n# -*- coding: iso-8859-15 -*-\nx = '€'\n".encode(
+                "iso-8859-15"
+            ),
+            "#!/usr/bin/python\n# -*- coding: iso-8859-15 -*-\nx = '€'\n",
+            "iso-8859-15",
+        ),
+        # Not declared, or declared in an unknown encoding: latin-1
+        ("<a>é</a>".encode("latin-1"), "<a>é</a>", "latin-1"),
+        (
+            '<?xml encoding="unknown"?><a>é</a>'.encode("latin-1"),
+            '<?xml encoding="unknown"?><a>é</a>',
+            "latin-1",
+        ),
+    ],
+)
+def test_decode(data, text, encoding):
+    assert file_encoding.decode(data) == (text, encoding)
+
+
+@pytest.mark.parametrize("encoding", ["utf-8-sig", "utf-16", "cp1252"])
+def test_written_back_in_its_encoding(tmp_path, encoding):
+    file_path = tmp_path / "view.xml"
+    declaration = '<?xml version="1.0" encoding="%s"?>\n' % encoding
+    file_path.write_bytes((declaration + "<a>é</a>\n").encode(encoding))
+    content = tools._read_content(str(file_path))
+    assert content == declaration + "<a>é</a>\n"
+    tools._write_content(str(file_path), content.replace("a>", "b>"))
+    assert file_path.read_bytes() == (declaration + "<b>é</b>\n").encode(encoding)
+
+
+def test_unrepresentable_content_written_in_utf8(tmp_path):
+    file_path = tmp_path / "view.xml"
+    file_path.write_bytes("<a>é</a>\n".encode("latin-1"))
+    content = tools._read_content(str(file_path))
+    tools._write_content(str(file_path), content.replace("é", "€"))
+    assert file_path.read_bytes() == "<a>€</a>\n".encode("utf-8")
+    assert file_encoding.get_encoding(str(file_path)) == "utf-8"
+
+
+def test_detected_once(tmp_path, monkeypatch):
+    file_path = tmp_path / "view.xml"
+    file_path.write_bytes("<a>é</a>".encode("latin-1"))
+    assert file_encoding.decode_file(str(file_path), file_path.read_bytes()) == (
+        "<a>é</a>",
+        "latin-1",
+    )
+    monkeypatch.setattr(file_encoding, "decode", None)
+    assert file_encoding.detect_file_encoding(str(file_path)) == "latin-1"
+    assert file_encoding.decode_file(str(file_path), b"<a>e</a>") == (
+        "<a>e</a>",
+        "latin-1",
+    )
+
+
+def test_detected_again_when_replaced(tmp_path):
+    file_path = tmp_path / "view.xml"
+    assert file_encoding.decode_file(str(file_path), b"\xff\xfea\x00") == (
+        "a",
+        "utf-16",
+    )
+    # Not valid in the cached encoding anymore
+    assert file_encoding.decode_file(str(file_path), b"\xff") == ("\xff", "latin-1")
+    file_encoding.forget_encodings([str(file_path)])
+    assert file_encoding.get_encoding(str(file_path)) == "utf-8"
+
+
+def test_detect_by_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_encoding, "_CHUNK_SIZE", 3)
+    file_path = tmp_path / "data.csv"
+    # The bytes of a character split over two chunks
+    file_path.write_bytes("ab€cd\r\n".encode("utf-8"))
+    assert file_encoding.detect_file_encoding(str(file_path)) == "utf-8"
+    file_encoding.forget_encodings()
+    file_path.write_bytes("abécd".encode("latin-1"))
+    assert file_encoding.detect_file_encoding(str(file_path)) == "latin-1"
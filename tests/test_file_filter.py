@@ -0,0 +1,80 @@
+import os
+
+from odoo_module_upgrade import tools
+from odoo_module_upgrade.file_filter import FileFilter
+from odoo_module_upgrade.workspace import Workspace
+
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def _make_module(module_path):
+    _write(module_path / ".odoo-upgrade-ignore", "views/generated_*.xml\n")
+    _write(module_path / "__manifest__.py", "{}\n")
+    _write(module_path / "views" / "view.xml", "<odoo/>\n")
+    _write(module_path / "views" / "generated_view.xml", "<odoo/>\n")
+    _write(module_path / "static" / "lib" / "lib.js", "var a;\n")
+    _write(module_path / "static" / "src" / "app.min.js", "var a;\n")
+    _write(module_path / "static" / "src" / "app.js", "var a;\n")
+    _write(module_path / "data" / "big.xml", "<odoo>%s</odoo>\n" % ("x" * 4096))
+
+
+def _get_walked_files(module_path):
+    return sorted(
+        os.path.relpath(os.path.join(root, x), str(module_path))
+        for root, __, file_names in tools._walk(str(module_path))
+        for x in file_names
+    )
+
+
+def test_walk_without_workspace(tmp_path):
+    module_path = tmp_path / "mod_a"
+    _make_module(module_path)
+    file_filter = FileFilter(module_path, {".xml": 1024})
+    with tools._use_file_filter(file_filter):
+        walked_files = _get_walked_files(module_path)
+        # Walked again, the skipped paths are counted once
+        assert _get_walked_files(module_path) == walked_files
+        assert sorted(
+            os.path.relpath(str(x), str(module_path))
+            for x in tools.get_files(module_path, (".xml", ".js"))
+        ) == ["static/src/app.js", "views/view.xml"]
+    assert walked_files == [
+        ".odoo-upgrade-ignore",
+        "__manifest__.py",
+        "static/src/app.js",
+        "views/view.xml",
+    ]
+    assert sorted(
+        (os.path.relpath(path, str(module_path)), reason)
+        for path, reason, __ in file_filter.skipped
+    ) == [
+        ("data/big.xml", "too large"),
+        ("static/lib", "vendored"),
+        ("static/src/app.min.js", "minified"),
+        ("views/generated_view.xml", "ignored"),
+    ]
+
+
+def test_walk_subfolder_without_workspace(tmp_path):
+    module_path = tmp_path / "mod_a"
+    _make_module(module_path)
+    with tools._use_file_filter(FileFilter(module_path)):
+        # The ignore file of the module applies
+        assert [
+            file_names for __, __, file_names in tools._walk(module_path / "views")
+        ] == [["view.xml"]]
+
+
+def test_same_files_as_workspace(tmp_path):
+    module_path = tmp_path / "mod_a"
+    _make_module(module_path)
+    with tools._use_file_filter(FileFilter(module_path)):
+        walked_files = _get_walked_files(module_path)
+    workspace = Workspace(module_path, file_filter=FileFilter(module_path))
+    with tools._use_workspace(workspace):
+        assert _get_walked_files(module_path) == walked_files
+    # No size ceiling by default
+    assert "data/big.xml" in walked_files
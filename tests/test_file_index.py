@@ -0,0 +1,69 @@
+import os
+
+from odoo_module_upgrade.file_filter import FileFilter
+from odoo_module_upgrade.file_index import FileIndex
+
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def _make_module(module_path):
+    for relative_path in (
+        "__manifest__.py",
+        "models/__init__.py",
+        "models/model.py",
+        "views/view.xml",
+        "views/sub/other.xml",
+        "data/data.csv",
+        "static/lib/lib.js",
+        "static/src/app.js",
+    ):
+        _write(module_path / relative_path, "x\n")
+
+
+def test_same_walk_as_disk(tmp_path):
+    _make_module(tmp_path)
+    file_index = FileIndex(tmp_path)
+    assert list(file_index.walk(tmp_path)) == list(os.walk(str(tmp_path)))
+    assert list(file_index.walk(tmp_path / "views")) == list(
+        os.walk(str(tmp_path / "views"))
+    )
+    extensions = (".xml", ".py", ".js")
+    assert file_index.get_files(tmp_path, extensions) == [
+        x for extension in extensions for x in tmp_path.rglob("*" + extension)
+    ]
+
+
+def test_kept_up_to_date(tmp_path):
+    _make_module(tmp_path)
+    file_index = FileIndex(tmp_path)
+    file_index.rename(tmp_path / "views" / "view.xml", tmp_path / "new" / "view.xml")
+    file_index.add(tmp_path / "views" / "added.xml")
+    file_index.remove(tmp_path / "static")
+    assert sorted(
+        os.path.relpath(str(x), str(tmp_path))
+        for x in file_index.get_files(tmp_path, (".xml", ".js"))
+    ) == ["new/view.xml", "views/added.xml", "views/sub/other.xml"]
+    assert file_index.exists(tmp_path / "new")
+    assert not file_index.exists(tmp_path / "views" / "view.xml")
+    assert not file_index.exists(tmp_path / "static" / "src" / "app.js")
+
+
+def test_excluded_files(tmp_path):
+    _make_module(tmp_path)
+    file_index = FileIndex(
+        tmp_path,
+        FileFilter(tmp_path),
+        file_paths=[tmp_path / "models" / "model.py", tmp_path / "views" / "view.xml"],
+    )
+    assert sorted(
+        (os.path.relpath(root, str(tmp_path)), file_names)
+        for root, __, file_names in file_index.walk(tmp_path)
+        if file_names
+    ) == [("models", ["model.py"]), ("views", ["view.xml"])]
+    # Not indexed, but still on the disk
+    assert file_index.exists(tmp_path / "static" / "lib" / "lib.js")
+    assert file_index.exists(tmp_path / "data" / "data.csv")
+    assert not file_index.exists(tmp_path / "data" / "missing.csv")
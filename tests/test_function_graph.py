@@ -0,0 +1,113 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from odoo_module_upgrade import tools
+from odoo_module_upgrade.function_graph import (
+    ANY,
+    MANIFEST,
+    file_access,
+    get_dependencies,
+    get_reading_functions,
+    overlap,
+)
+from odoo_module_upgrade.log import logger
+
+
+def _function(reads=(), writes=(), declared=True):
+    def function(**kwargs):
+        pass
+
+    return file_access(reads, writes)(function) if declared else function
+
+
+def test_overlap():
+    assert overlap([".py"], [".py", ".xml"])
+    assert overlap([MANIFEST], [".py"])
+    assert overlap([ANY], [".csv"])
+    assert not overlap([MANIFEST], [".xml"])
+    assert not overlap([".js"], [])
+
+
+def test_get_dependencies():
+    functions = [
+        _function(reads=[".xml"]),
+        _function(reads=[".xml"]),
+        _function(writes=[".xml"]),
+        _function(writes=[MANIFEST]),
+        _function(reads=[".py"]),
+        _function(declared=False),
+        _function(reads=[".csv"]),
+    ]
+    assert get_dependencies(functions) == [
+        [],
+        # Both only read the xml files
+        [],
+        [0, 1],
+        [],
+        [3],
+        [0, 1, 2, 3, 4],
+        [5],
+    ]
+    assert get_reading_functions(functions, [".py"]) == functions[3:6]
+
+
+def _run_functions(functions):
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        with tools._use_file_executor(executor):
+            tools._run_functions(functions)
+    finally:
+        executor.shutdown()
+
+
+def test_independent_functions_concurrent():
+    barrier = threading.Barrier(2, timeout=5)
+    calls = []
+
+    @file_access(reads=[".xml"])
+    def read_views(**kwargs):
+        barrier.wait()
+        calls.append("read_views")
+
+    @file_access(writes=[".py"])
+    def write_models(**kwargs):
+        barrier.wait()
+        calls.append("write_models")
+
+    @file_access(reads=[".py"])
+    def read_models(**kwargs):
+        calls.append("read_models")
+
+    # read_views and write_models wait for each other, read_models waits
+    # for write_models
+    _run_functions([read_views, write_models, read_models])
+    assert sorted(calls) == ["read_models", "read_views", "write_models"]
+    assert calls.index("read_models") > calls.index("write_models")
+
+
+def test_failed_function_skips_dependents(caplog):
+    calls = []
+
+    @file_access(writes=[".py"])
+    def failing(**kwargs):
+        logger.info("failing")
+        raise ValueError("failed")
+
+    @file_access(reads=[".py"])
+    def dependent(**kwargs):
+        calls.append("dependent")
+
+    @file_access(reads=[".xml"])
+    def independent(**kwargs):
+        logger.info("independent")
+        calls.append("independent")
+
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        with pytest.raises(ValueError):
+            _run_functions([independent, failing, dependent])
+    assert calls == ["independent"]
+    # Emitted in the order of the functions
+    assert [x.getMessage() for x in caplog.records] == ["independent", "failing"]
@@ -0,0 +1,120 @@
+import shutil
+
+from odoo_module_upgrade import tools
+from odoo_module_upgrade.base_migration_script import BaseMigrationScript
+from odoo_module_upgrade.function_graph import file_access
+from odoo_module_upgrade.workspace import Workspace
+
+
+@file_access(reads=[".py"], writes=[".py"])
+def comment_models(module_path, **kwargs):
+    for file_path in tools.get_files(module_path, (".py",)):
+        content = tools._read_content(str(file_path))
+        tools._write_content(str(file_path), "# Migrated\n" + content)
+
+
+def count_views(module_path, **kwargs):
+    """Undeclared: reads and writes any file"""
+    view_count = len(tools.get_files(module_path, (".xml",)))
+    tools._write_content(str(module_path / "views.txt"), "%d\n" % view_count)
+
+
+class ListScript(BaseMigrationScript):
+    _TEXT_REPLACES = {".xml": {"<tree": "<list"}}
+    _FILE_RENAMES = {"tree.xml": "list.xml"}
+    _GLOBAL_FUNCTIONS = [comment_models]
+
+
+class ListAttributeScript(BaseMigrationScript):
+    _TEXT_REPLACES = {".xml": {r"<list\b": "<list editable='1'"}}
+    _FILE_RENAMES = {"list.xml": "views.xml"}
+
+
+class CountScript(BaseMigrationScript):
+    _TEXT_REPLACES = {".xml": {"<tree": "<list"}}
+    _GLOBAL_FUNCTIONS = [count_views]
+
+
+class ModelScript(BaseMigrationScript):
+    _TEXT_REPLACES = {".py": {"_inherit": "_inherits"}}
+
+
+class DeprecatedModuleScript(BaseMigrationScript):
+    _DEPRECATED_MODULES = [("old_module", "renamed", "new_module")]
+
+
+class RemovedFieldScript(BaseMigrationScript):
+    _REMOVED_FIELDS = [("res.partner", "old_field", None)]
+
+
+def test_can_fuse():
+    # The module function of ListScript only reads python files
+    assert ListScript().can_fuse(ListAttributeScript())
+    assert not ListScript().can_fuse(ModelScript())
+    # Undeclared functions read any file
+    assert not CountScript().can_fuse(ListAttributeScript())
+    assert ListAttributeScript().can_fuse(CountScript())
+    # The manifest is changed once all the files are processed
+    assert DeprecatedModuleScript().can_fuse(ListScript())
+    assert not DeprecatedModuleScript().can_fuse(ModelScript())
+    assert not DeprecatedModuleScript().can_fuse(RemovedFieldScript())
+
+
+def _make_module(module_path):
+    (module_path / "views").mkdir(parents=True)
+    (module_path / "__manifest__.py").write_text("{'depends': ['old_module']}\n")
+    (module_path / "models.py").write_text("_inherit = 'res.partner'\n")
+    (module_path / "views" / "tree.xml").write_text("<tree/>\n")
+    (module_path / "views" / "form.xml").write_text("<form><tree/></form>\n")
+
+
+def _run(module_path, scripts, fused_count):
+    workspace = Workspace(module_path)
+    with tools._use_workspace(workspace):
+        index = 0
+        while index < len(scripts):
+            fused_scripts = scripts[index : index + fused_count - 1]
+            index += len(fused_scripts)
+            scripts[index].run(
+                module_path,
+                module_path / "__manifest__.py",
+                module_path.name,
+                [],
+                module_path.parent,
+                False,
+                fused_scripts,
+            )
+            index += 1
+        workspace.flush()
+    return {
+        str(x.relative_to(module_path)): x.read_text()
+        for x in sorted(module_path.rglob("*"))
+        if x.is_file()
+    }
+
+
+def test_fused_same_as_sequential(tmp_path):
+    module_path = tmp_path / "sequential" / "mod_a"
+    _make_module(module_path)
+    fused_module_path = tmp_path / "fused" / "mod_a"
+    shutil.copytree(str(module_path), str(fused_module_path))
+    scripts = [
+        DeprecatedModuleScript(),
+        ListScript(),
+        ListAttributeScript(),
+        CountScript(),
+    ]
+    # As checked by ModuleMigration.migrate_files()
+    assert all(
+        x.can_fuse(y) for index, y in enumerate(scripts) for x in scripts[:index]
+    )
+
+    files = _run(module_path, scripts, 1)
+    assert files == {
+        "__manifest__.py": "# Migrated\n{'depends': ['new_module']}\n",
+        "models.py": "# Migrated\n_inherit = 'res.partner'\n",
+        "views.txt": "2\n",
+        "views/form.xml": "<form><list editable='1'/></form>\n",
+        "views/views.xml": "<list editable='1'/>\n",
+    }
+    assert _run(fused_module_path, scripts, 4) == files
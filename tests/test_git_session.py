@@ -0,0 +1,220 @@
+import os
+import pathlib
+import subprocess
+
+import pytest
+
+from odoo_module_upgrade.git_session import GitSession
+
+
+@pytest.fixture(autouse=True)
+def git_identity(monkeypatch):
+    for name in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv("GIT_%s_NAME" % name, "Tester")
+        monkeypatch.setenv("GIT_%s_EMAIL" % name, "tester@example.com")
+
+
+def _git(path, *args):
+    return subprocess.run(
+        ("git",) + args, cwd=str(path), check=True, stdout=subprocess.PIPE
+    ).stdout.decode()
+
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+@pytest.fixture
+def repository(tmp_path):
+    """Repository with the modules mod_a and mod_b, committed"""
+    _git(tmp_path, "init", "-q")
+    _write(tmp_path / "mod_a" / "__manifest__.py", "{}\n")
+    _write(tmp_path / "mod_b" / "__manifest__.py", "{}\n")
+    _git(tmp_path, "add", "--all")
+    _git(tmp_path, "commit", "-q", "-m", "init")
+    return tmp_path
+
+
+@pytest.fixture
+def session(repository):
+    git_session = GitSession(pathlib.Path(repository))
+    yield git_session
+    git_session.close()
+
+
+def test_commit_without_changes(session, repository):
+    head = session.get_head()
+    assert session.commit("Nothing") is None
+    assert session.get_head() == head
+    assert _git(repository, "rev-list", "--count", "HEAD").strip() == "1"
+
+
+def test_commit_new_files_only(session, repository):
+    head = session.get_head()
+    _write(repository / "mod_a" / "views" / "view.xml", "<odoo/>\n")
+    sha = session.commit("[MIG] mod_a", "mod_a")
+    assert sha and sha != head
+    assert sha == _git(repository, "rev-parse", "HEAD").strip()
+    assert _git(repository, "show", "--format=%s", "--name-only", "HEAD").split() == [
+        "[MIG]",
+        "mod_a",
+        "mod_a/views/view.xml",
+    ]
+
+
+def test_commit_restricted_to_pathspec(session, repository):
+    _write(repository / "mod_a" / "a.py", "a\n")
+    _write(repository / "mod_b" / "b.py", "b\n")
+    session.commit("[MIG] mod_a", "mod_a")
+    assert _git(repository, "show", "--format=", "--name-only", "HEAD").split() == [
+        "mod_a/a.py"
+    ]
+    assert _git(repository, "status", "--porcelain").split() == ["??", "mod_b/b.py"]
+
+
+def test_commit_unborn_head(tmp_path):
+    _git(tmp_path, "init", "-q")
+    git_session = GitSession(pathlib.Path(tmp_path))
+    try:
+        assert git_session.get_head() is None
+        assert git_session.commit("Nothing") is None
+        _write(tmp_path / "mod_a" / "__manifest__.py", "{}\n")
+        sha = git_session.commit("First")
+        assert sha == _git(tmp_path, "rev-parse", "HEAD").strip()
+    finally:
+        git_session.close()
+
+
+def test_commit_as_git_add(session, repository):
+    _write(repository / ".gitignore", "*.pyc\n")
+    _write(repository / "mod_a" / "removed.py", "r\n")
+    _write(repository / "mod_a" / "script.py", "s\n")
+    _git(repository, "add", "--all")
+    _git(repository, "commit", "-q", "-m", "files")
+    (repository / "mod_a" / "removed.py").unlink()
+    os.chmod(str(repository / "mod_a" / "script.py"), 0o755)
+    _write(repository / "mod_a" / "__manifest__.py", "{'name': 'a'}\n")
+    _write(repository / "mod_a" / "views" / 'a "b".xml', "<odoo/>\n")
+    _write(repository / "mod_a" / "ignored.pyc", "i\n")
+    # Staged, then deleted: not committed
+    _write(repository / "mod_a" / "staged.py", "s\n")
+    _git(repository, "add", "mod_a/staged.py")
+    (repository / "mod_a" / "staged.py").unlink()
+    head = session.get_head()
+    sha = session.commit("[MIG] mod_a", "mod_a")
+    assert _git(repository, "rev-parse", "HEAD^").strip() == head
+    assert _git(
+        repository, "show", "--format=", "--name-status", sha
+    ).splitlines() == [
+        "M\tmod_a/__manifest__.py",
+        "D\tmod_a/removed.py",
+        "M\tmod_a/script.py",
+        'A\t"mod_a/views/a \\"b\\".xml"',
+    ]
+    assert _git(repository, "ls-tree", sha, "mod_a/script.py").startswith("100755")
+    # The index is up to date, with the same tree as the one staged by git
+    assert _git(repository, "status", "--porcelain") == ""
+    _git(repository, "add", "--all", "--", "mod_a")
+    assert _git(repository, "write-tree") == _git(
+        repository, "rev-parse", "HEAD^{tree}"
+    )
+
+
+def test_commit_reuses_processes(session, repository, monkeypatch):
+    session.commit("Nothing")
+    commands = []
+    run = subprocess.run
+
+    def run_git(args, **kwargs):
+        commands.append(args[1:3])
+        return run(args, **kwargs)
+
+    monkeypatch.setattr(subprocess, "run", run_git)
+    for module_name in ("mod_a", "mod_b"):
+        _write(repository / module_name / "new.py", "n\n")
+        assert session.commit("[MIG] %s" % module_name, module_name)
+    assert commands == [
+        ("--no-optional-locks", "status"),
+        ("update-index", "-z"),
+    ] * 2
+    assert _git(repository, "log", "--format=%s %an").splitlines() == [
+        "[MIG] mod_b Tester",
+        "[MIG] mod_a Tester",
+        "init Tester",
+    ]
+
+
+def test_commit_detached_head(session, repository):
+    _git(repository, "checkout", "-q", "--detach")
+    _write(repository / "mod_a" / "new.py", "n\n")
+    sha = session.commit("[MIG] mod_a")
+    assert sha == _git(repository, "rev-parse", "HEAD").strip()
+    assert _git(repository, "status", "--porcelain") == ""
+
+
+def test_commit_symbolic_link(session, repository):
+    os.symlink("__manifest__.py", str(repository / "mod_a" / "link.py"))
+    sha = session.commit("[MIG] mod_a")
+    assert _git(repository, "ls-tree", sha, "mod_a/link.py").startswith("120000")
+    assert _git(repository, "status", "--porcelain") == ""
+
+
+def test_resolve(session, repository):
+    assert session.resolve("HEAD") == _git(repository, "rev-parse", "HEAD").strip()
+    assert session.resolve("HEAD^{tree}") == (
+        _git(repository, "rev-parse", "HEAD^{tree}").strip()
+    )
+    assert session.resolve("missing-branch") is None
+    assert session.resolve("HEAD~5") is None
+
+
+def test_get_changed_folders(session, repository):
+    assert session.get_changed_folders([]) == set()
+    assert session.get_changed_folders(["mod_a", "mod_b"]) == set()
+    _write(repository / "mod_a" / "new.py", "a\n")
+    _write(repository / "mod_b" / "__manifest__.py", "{'name': 'b'}\n")
+    _write(repository / "other.txt", "o\n")
+    assert session.get_changed_folders(["mod_a"]) == {"mod_a"}
+    assert session.get_changed_folders(["mod_a", "mod_b"]) == {"mod_a", "mod_b"}
+
+
+def test_get_changed_folders_in_subfolder(tmp_path):
+    _git(tmp_path, "init", "-q")
+    addons_path = tmp_path / "addons"
+    _write(addons_path / "mod_a" / "__manifest__.py", "{}\n")
+    _write(addons_path / "mod_b" / "__manifest__.py", "{}\n")
+    _git(tmp_path, "add", "--all")
+    _git(tmp_path, "commit", "-q", "-m", "init")
+    _write(addons_path / "mod_b" / "__manifest__.py", "{'name': 'b'}\n")
+    _write(tmp_path / "mod_a" / "outside.py", "o\n")
+    git_session = GitSession(pathlib.Path(addons_path))
+    try:
+        assert git_session.get_changed_folders(["mod_a", "mod_b"]) == {"mod_b"}
+    finally:
+        git_session.close()
+
+
+def test_restore(session, repository):
+    _write(repository / "mod_a" / "__manifest__.py", "{'name': 'a'}\n")
+    _write(repository / "mod_a" / "views" / "new.xml", "<odoo/>\n")
+    _git(repository, "add", "mod_a/views/new.xml")
+    _write(repository / "mod_a" / "untracked.py", "u\n")
+    _write(repository / "mod_b" / "untracked.py", "u\n")
+    session.restore("mod_a")
+    assert (repository / "mod_a" / "__manifest__.py").read_text() == "{}\n"
+    assert not (repository / "mod_a" / "views").exists()
+    assert not (repository / "mod_a" / "untracked.py").exists()
+    assert (repository / "mod_b" / "untracked.py").exists()
+    assert session.get_changed_folders(["mod_a", "mod_b"]) == {"mod_b"}
+
+
+def test_session_sent_to_worker(session):
+    import pickle
+
+    head = session.get_head()
+    worker_session = pickle.loads(pickle.dumps(session))
+    try:
+        assert worker_session.get_head() == head
+    finally:
+        worker_session.close()
@@ -0,0 +1,111 @@
+import queue
+import subprocess
+
+import pytest
+
+from odoo_module_upgrade.config import _AVAILABLE_MIGRATION_STEPS
+from odoo_module_upgrade.exception import ConfigException
+from odoo_module_upgrade.job_pool import END_STATES, JobPool, parse_job_options
+
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def _run_jobs(jobs):
+    """Run the jobs {job_id: options} on a pool, and return their events"""
+    events = queue.Queue()
+    pool = JobPool(2, lambda *event: events.put(event))
+    try:
+        for job_id, options in jobs.items():
+            pool.submit(job_id, parse_job_options(options))
+        res = {job_id: [] for job_id in jobs}
+        ended_ids = set()
+        while ended_ids != set(jobs):
+            job_id, event_type, data = events.get(timeout=60)
+            res[job_id].append((event_type, data))
+            if event_type == "state" and data["state"] in END_STATES:
+                ended_ids.add(job_id)
+    finally:
+        pool.close()
+    return res
+
+
+def test_parse_job_options(tmp_path):
+    options = parse_job_options(
+        {
+            "directory": str(tmp_path),
+            "init_version_name": "16.0",
+            "max_file_sizes": {"xml": 64, ".csv": 0},
+        }
+    )
+    assert options["target_version_name"] == (
+        _AVAILABLE_MIGRATION_STEPS[-1]["target_version_name"]
+    )
+    assert options["commit"] and not options["dry_run"]
+    assert options["max_file_sizes"] == {".xml": 64, ".csv": 0}
+
+
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        ({"directory": None}, "'directory' is required"),
+        ({"jobs": 2}, "Unknown option"),
+        ({"file_jobs": True}, "must be a int"),
+        ({"init_version_name": "10.0"}, "Unknown initial version"),
+        ({"modules": [1]}, "list of names"),
+        ({"max_file_sizes": {"xml": -1}}, "Invalid size"),
+    ],
+)
+def test_parse_invalid_job_options(tmp_path, data, error):
+    with pytest.raises(ConfigException, match=error):
+        parse_job_options(
+            dict({"directory": str(tmp_path), "init_version_name": "16.0"}, **data)
+        )
+
+
+def test_run_jobs(tmp_path):
+    _write(
+        tmp_path / "repo" / "mod_a" / "__manifest__.py",
+        "{\n    'name': 'A',\n    'version': '16.0.1.0.0',\n"
+        "    'depends': ['base'],\n}\n",
+    )
+    _write(
+        tmp_path / "repo" / "mod_a" / "views" / "a.xml",
+        '<odoo>\n  <tree string="x"/>\n</odoo>\n',
+    )
+    subprocess.run(["git", "init", "-q", str(tmp_path / "repo")], check=True)
+    (tmp_path / "empty").mkdir()
+    events = _run_jobs(
+        {
+            "1": {
+                "directory": str(tmp_path / "repo"),
+                "init_version_name": "16.0",
+                "dry_run": True,
+                "pre_commit": False,
+            },
+            "2": {"directory": str(tmp_path / "empty"), "init_version_name": "16.0"},
+        }
+    )
+
+    assert [x for x in events["1"] if x[0] != "log"][:-1] == [
+        ("state", {"state": "running"}),
+        ("module", {"module": "mod_a", "state": "queued"}),
+        ("module", {"module": "mod_a", "state": "running"}),
+        ("module", {"module": "mod_a", "state": "done"}),
+    ]
+    event_type, data = events["1"][-1]
+    assert (event_type, data["state"], data["error"]) == ("state", "done", None)
+    assert "+  <list/>\n" in data["patch"]
+    # Dry-run: the files are kept as they are
+    assert "<tree" in (tmp_path / "repo" / "mod_a" / "views" / "a.xml").read_text()
+
+    # The logs of a job are sent with its events
+    event_type, data = events["2"][-1]
+    assert (event_type, data["state"]) == ("state", "failed")
+    assert data["error"] == "No modules found to migrate. Exiting."
+    assert any(
+        event_type == "log" and data["level"] == "ERROR"
+        for event_type, data in events["2"]
+    )
@@ -0,0 +1,150 @@
+import json
+import subprocess
+
+import pytest
+
+from odoo_module_upgrade import migration
+from odoo_module_upgrade.exception import ConfigException
+from odoo_module_upgrade.git_session import GitSession
+from odoo_module_upgrade.journal import RunJournal
+from odoo_module_upgrade.migration import Migration
+from odoo_module_upgrade.module_migration import ModuleMigration
+
+_HEADER = {
+    "init_version_name": "16.0",
+    "target_version_name": "17.0",
+    "scripts": ["a.MigrationScript"],
+    "commit": True,
+}
+
+
+@pytest.fixture(autouse=True)
+def git_identity(monkeypatch):
+    for name in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv("GIT_%s_NAME" % name, "Tester")
+        monkeypatch.setenv("GIT_%s_EMAIL" % name, "tester@example.com")
+
+
+def _git(path, *args):
+    return subprocess.run(
+        ("git",) + args, cwd=str(path), check=True, stdout=subprocess.PIPE
+    ).stdout.decode()
+
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def _write_interrupted_run(tmp_path, header=None):
+    """Write the journal of a run that died while writing an event"""
+    journal = RunJournal(tmp_path, dict(_HEADER, **(header or {})))
+    journal.start()
+    journal.start_module("mod_a")
+    journal.write("module_done", module="mod_a")
+    journal.write("module_commit", module="mod_a", sha="abc")
+    journal.set_changed_modules(["mod_b"])
+    journal.start_module("mod_b")
+    journal.write("module_done", module="mod_b")
+    journal.start_module("mod_c")
+    with open(journal._path, "a", encoding="utf-8") as f:
+        f.write('{"event": "module_do')
+    return journal
+
+
+def _get_migration(directory_path, resume=False):
+    return Migration(
+        str(directory_path),
+        "16.0",
+        "18.0",
+        module_names=["mod_a", "mod_b"],
+        pre_commit=False,
+        resume=resume,
+    )
+
+
+def test_resume_state(tmp_path):
+    _write_interrupted_run(tmp_path)
+    assert RunJournal(tmp_path, _HEADER).get_resume_state() == (
+        {"mod_a"},
+        {"mod_b": True, "mod_c": False},
+    )
+    # Without commits, the modules are completed once written
+    _write_interrupted_run(tmp_path, {"commit": False})
+    assert RunJournal(tmp_path, dict(_HEADER, commit=False)).get_resume_state() == (
+        {"mod_a", "mod_b"},
+        {"mod_c": False},
+    )
+
+
+def test_resume_other_run(tmp_path):
+    journal = RunJournal(tmp_path, _HEADER)
+    assert journal.get_resume_state() is None
+    _write_interrupted_run(tmp_path)
+    with pytest.raises(ConfigException, match="Unable to resume"):
+        RunJournal(tmp_path, dict(_HEADER, target_version_name="18.0")).start(True)
+
+    assert journal.start(resume=True) is not None
+    with open(journal._path, "r", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    # The partial line is ended, and skipped
+    assert lines[-2] == '{"event": "module_do'
+    assert json.loads(lines[-1])["event"] == "resume"
+    journal.end()
+    # A new run starts after an ended one
+    assert journal.start(resume=True) is None
+    with open(journal._path, "r", encoding="utf-8") as f:
+        assert [json.loads(x)["event"] for x in f] == ["run"]
+
+
+def test_resume_interrupted_migration(tmp_path, monkeypatch):
+    _git(tmp_path, "init", "-q")
+    for module_name in ("mod_a", "mod_b"):
+        _write(
+            tmp_path / module_name / "__manifest__.py",
+            "{\n    'name': '%s',\n    'version': '16.0.1.0.0',\n}\n" % module_name,
+        )
+        _write(tmp_path / module_name / "views" / "a.xml", "<odoo><tree/></odoo>\n")
+    _git(tmp_path, "add", "--all")
+    _git(tmp_path, "commit", "-q", "-m", "init")
+
+    # The run dies after writing the files of mod_b, before committing them
+    commit = ModuleMigration.commit
+
+    def interrupted_commit(module_migration):
+        if module_migration._module_name == "mod_b":
+            raise KeyboardInterrupt()
+        commit(module_migration)
+
+    monkeypatch.setattr(ModuleMigration, "commit", interrupted_commit)
+    with pytest.raises(KeyboardInterrupt):
+        _get_migration(tmp_path).run()
+    assert "<list/>" in (tmp_path / "mod_b" / "views" / "a.xml").read_text()
+    monkeypatch.setattr(ModuleMigration, "commit", commit)
+
+    restored_pathspecs = []
+    restore = GitSession.restore
+
+    def record_restore(git_session, pathspec):
+        restored_pathspecs.append(pathspec)
+        restore(git_session, pathspec)
+
+    monkeypatch.setattr(migration.GitSession, "restore", record_restore)
+    migrated_module_names = []
+    migrate_files = ModuleMigration.migrate_files
+
+    def record_migrate_files(module_migration):
+        migrated_module_names.append(module_migration._module_name)
+        return migrate_files(module_migration)
+
+    monkeypatch.setattr(ModuleMigration, "migrate_files", record_migrate_files)
+    _get_migration(tmp_path, resume=True).run()
+    # mod_a is skipped, mod_b rolled back then migrated again
+    assert migrated_module_names == ["mod_b"]
+    assert restored_pathspecs == ["mod_b"]
+    assert _git(tmp_path, "log", "--format=%s").splitlines() == [
+        "[MIG] mod_b: Migration to 18.0",
+        "[MIG] mod_a: Migration to 18.0",
+        "init",
+    ]
+    assert _git(tmp_path, "status", "--porcelain") == ""
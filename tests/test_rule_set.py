@@ -0,0 +1,99 @@
+import itertools
+import re
+
+import pytest
+
+from odoo_module_upgrade import rule_set
+from odoo_module_upgrade.rule_set import RulePlan, _get_anchors
+from odoo_module_upgrade.scanner import Scanner
+
+_WORDS = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "theta"]
+
+_ANCHORS = [
+    (r"attrs\s*=", ("attrs",)),
+    (r"\.name_get\(", (".name_get(",)),
+    # Alternation: one of the literals of each branch
+    (r"foo|bar", ("bar", "foo")),
+    (r"(foo|barbaz)_x", ("barbaz", "foo")),
+    (r"(?:foo|\d+)bar", ("bar",)),
+    (r"(ab|cd)(efg|hij)", ("efg", "hij")),
+    # Optional groups and repeats are skipped, unless they match once
+    (r"(?:optional)?name", ("name",)),
+    (r"(?:ab|cd)?efgh", ("efgh",)),
+    (r"(?:ab){0,3}cd", ("cd",)),
+    (r"(ab){2,}", ("ab",)),
+    (r"x*yz", ("yz",)),
+    # Classes break the literals
+    (r"[ab]cd", ("cd",)),
+    (r"(?P<q>[\"'])ref(?P=q)", ("ref",)),
+    # Only the case insensitive parts are skipped
+    (r"(?i:foo)bar", ("bar",)),
+    # Give up: no literal, too short or case insensitive
+    (r"[abc]+", None),
+    (r".*", None),
+    (r"(?:foo|\d+)", None),
+    (r"a\d", None),
+    (r"(?i)foo", None),
+]
+
+
+@pytest.mark.parametrize("pattern, anchors", _ANCHORS)
+def test_get_anchors(pattern, anchors):
+    assert _get_anchors(re.compile(pattern)) == anchors
+
+
+def test_matches_contain_an_anchor():
+    text = "attrs = foo barbaz_x 12bar abefg cdhij name efgh ababcd abab xxyz"
+    text += " bcd 'ref' FOObar .name_get( bar"
+    for pattern, anchors in _ANCHORS:
+        if anchors is None:
+            continue
+        matches = [x.group() for x in re.finditer(pattern, text)]
+        assert matches, pattern
+        assert all(any(x in match for x in anchors) for match in matches)
+
+
+def test_rule_without_anchor_always_applied():
+    rule_plan = RulePlan.from_dicts({"foo": "bar", r"\d+": "N"}, {}, {})
+    assert rule_plan.literals is None
+    assert rule_plan.replace("x 12") == "x N"
+    rule_plan = RulePlan.from_dicts({"foo": "bar"}, {}, {r"ba[rz]": "Found"})
+    assert rule_plan.literals == ("ba", "foo")
+    assert rule_plan.replace("x 12") == "x 12"
+
+
+def _get_positions(findings):
+    return [(x.rule_id, x.severity, x.line, x.column) for x in findings]
+
+
+def test_scanners_limited(monkeypatch):
+    monkeypatch.setattr(rule_set, "_MAX_SCANNERS", 8)
+    rule_plan = RulePlan.from_dicts(
+        {r"old_(%s)" % x: r"new_\1" for x in _WORDS},
+        {r"%s\(" % x: "Call of %s" % x for x in _WORDS[:3]},
+        {r"\b%s_\w+" % x: "Found %s" % x for x in _WORDS},
+    )
+    full_scanner = Scanner(
+        (pattern.pattern, severity, pattern, message)
+        for severity, rules in (
+            ("error", rule_plan.errors),
+            ("warning", rule_plan.warnings),
+        )
+        for pattern, message, __ in rules
+    )
+    texts = [
+        "\n".join("%s_x %s(1) old_%s" % (x, x, x) for x in words)
+        for count in range(len(_WORDS) + 1)
+        for words in itertools.combinations(_WORDS, count)
+    ]
+    # Scanned again once their scanner is dropped
+    for text in texts + texts[:10]:
+        new_text = text
+        for pattern, replacement, __ in rule_plan.replaces:
+            new_text = pattern.sub(replacement, new_text)
+        assert rule_plan.replace(text) == new_text
+        assert _get_positions(rule_plan.scan(text)) == _get_positions(
+            full_scanner.scan(text)
+        )
+        assert len(rule_plan._scanners) <= 8
+    assert len(rule_plan._scanners) == 8
@@ -0,0 +1,41 @@
+import re
+
+from odoo_module_upgrade.scanner import Scanner
+
+
+def _get_scanner(patterns):
+    return Scanner(
+        [
+            (pattern, "warning", re.compile(pattern), "Found %s" % pattern)
+            for pattern in patterns
+        ]
+    )
+
+
+def _get_positions(findings):
+    return [(x.rule_id, x.line, x.column) for x in findings]
+
+
+def test_match_hidden_by_another_rule():
+    scanner = _get_scanner(["attrs=", "s="])
+    assert _get_positions(scanner.scan("attrs= x\ny s=\n")) == [
+        ("attrs=", 1, 1),
+        ("s=", 1, 5),
+        ("s=", 2, 3),
+    ]
+
+
+def test_same_matches_as_finditer():
+    patterns = ["ab", "b", "abc", r"c\w", "x+", "[ab]c", "a+b?", "(?:ab)+c"]
+    scanner = _get_scanner(patterns)
+    text = "abcab xxbca\naabbc cab abab abcx\nbcxxab ac\n"
+    line_starts = [0] + [x.end() for x in re.finditer("\n", text)]
+    expected = sorted(
+        (match.start(), pattern)
+        for pattern in patterns
+        for match in re.finditer(pattern, text)
+    )
+    assert expected == sorted(
+        (line_starts[x.line - 1] + x.column - 1, x.rule_id)
+        for x in scanner.scan(text)
+    )
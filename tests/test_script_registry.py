@@ -0,0 +1,129 @@
+import importlib.metadata
+import json
+import sys
+from collections import namedtuple
+
+import pytest
+
+from odoo_module_upgrade import script_registry
+from odoo_module_upgrade.base_migration_script import BaseMigrationScript
+from odoo_module_upgrade.config import _SCRIPT_ENTRY_POINT_GROUP
+
+_EntryPoint = namedtuple("_EntryPoint", ["name", "value", "group"])
+
+
+class _EntryPoints(list):
+    def select(self, group):
+        return [x for x in self if x.group == group]
+
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+@pytest.fixture
+def plugin_package(tmp_path, monkeypatch):
+    package_path = tmp_path / "plugin_scripts"
+    _write(package_path / "__init__.py", "")
+    _write(
+        package_path / "migrate_180_allways.py",
+        "from odoo_module_upgrade.base_migration_script import "
+        "BaseMigrationScript\n\n\n"
+        "class MigrationScript(BaseMigrationScript):\n"
+        "    pass\n",
+    )
+    _write(
+        package_path / "text_warnings" / "migrate_180_allways" / "views.yaml",
+        '".xml":\n  "<list": "Found a list view"\n',
+    )
+    _write(package_path / "python_scripts" / "migrate_180_allways" / "a.py", "")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(script_registry, "_ENTRIES", None)
+    monkeypatch.setattr(
+        importlib.metadata,
+        "entry_points",
+        lambda: _EntryPoints(
+            [_EntryPoint("plugin", "plugin_scripts", _SCRIPT_ENTRY_POINT_GROUP)]
+        ),
+    )
+    yield package_path
+    for module_name in list(sys.modules):
+        if module_name.split(".")[0] == "plugin_scripts":
+            del sys.modules[module_name]
+
+
+def test_builtin_registry_up_to_date():
+    script_registry.main(["--check"])
+
+
+def test_build_registry(plugin_package):
+    assert script_registry.build_registry("plugin_scripts") == [
+        {
+            "name": "migrate_180_allways",
+            "script": "plugin_scripts.migrate_180_allways:MigrationScript",
+            "kind": "step",
+            "start": "180",
+            "end": None,
+            "rule_files": {
+                "text_warnings": ["text_warnings/migrate_180_allways/views.yaml"]
+            },
+            "python_scripts": ["plugin_scripts.python_scripts.migrate_180_allways.a"],
+        }
+    ]
+
+
+def test_check_outdated_registry(plugin_package):
+    with pytest.raises(SystemExit):
+        script_registry.main(["plugin_scripts", "--check"])
+    script_registry.main(["plugin_scripts"])
+    script_registry.main(["plugin_scripts", "--check"])
+    registry = json.loads((plugin_package / "registry.json").read_text())
+    assert [x["name"] for x in registry] == ["migrate_180_allways"]
+
+
+def test_entry_point_scripts_loaded_lazily(plugin_package):
+    script_registry.main(["plugin_scripts"])
+    for module_name in list(sys.modules):
+        if module_name.split(".")[0] == "plugin_scripts":
+            del sys.modules[module_name]
+    entries = script_registry.get_script_entries()
+    assert script_registry.get_script_entries() is entries
+    entry = entries[-1]
+    assert entry.name == "migrate_180_allways"
+    rule_path = plugin_package / "text_warnings" / "migrate_180_allways"
+    assert entry.rule_files == {"text_warnings": (str(rule_path / "views.yaml"),)}
+    # The registries are read without importing the scripts
+    assert "plugin_scripts.migrate_180_allways" not in sys.modules
+    assert all(
+        x.script.startswith("odoo_module_upgrade.upgrade_scripts.")
+        for x in entries[:-1]
+    )
+
+    script = entry.load()
+    assert isinstance(script, BaseMigrationScript)
+    assert script._script_entry is entry
+
+
+def test_select_script_entries(plugin_package):
+    script_registry.main(["plugin_scripts"])
+    names = [x.name for x in script_registry.select_script_entries("160", "180", "180")]
+    assert names == [
+        "migrate_allways",
+        "migrate_remove_migration_folder",
+        "migrate_150_allways",
+        "migrate_160_170",
+        "migrate_170_180",
+    ]
+    names = [
+        x.name
+        for x in script_registry.select_script_entries(
+            "170", "190", "190", remove_migration_folder=False
+        )
+    ]
+    assert names == [
+        "migrate_allways",
+        "migrate_150_allways",
+        "migrate_170_180",
+        "migrate_180_allways",
+    ]
@@ -0,0 +1,91 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+from odoo_module_upgrade import server
+from odoo_module_upgrade.config import _SERVER_TOKEN_HEADER
+
+
+class _JobPool(object):
+    """Record the submitted jobs, without running them"""
+
+    def __init__(self, workers, on_event):
+        self.jobs = []
+
+    def submit(self, job_id, options):
+        self.jobs.append((job_id, options))
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def migration_server(monkeypatch):
+    monkeypatch.setattr(server, "JobPool", _JobPool)
+    migration_server = server.MigrationServer(("127.0.0.1", 0), token="secret")
+    thread = threading.Thread(target=migration_server.serve_forever, daemon=True)
+    thread.start()
+    yield migration_server
+    migration_server.shutdown()
+    migration_server.server_close()
+    thread.join()
+
+
+def _request(migration_server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", migration_server.server_port)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize("headers", [{}, {_SERVER_TOKEN_HEADER: "wrong"}])
+def test_requests_without_token_refused(migration_server, tmp_path, headers):
+    assert _request(migration_server, "GET", "/jobs", headers=headers) == (
+        401,
+        {"error": "Invalid token"},
+    )
+    body = json.dumps({"directory": str(tmp_path), "init_version_name": "16.0"})
+    headers["Content-Type"] = "application/json"
+    status, __ = _request(migration_server, "POST", "/jobs", body, headers)
+    assert status == 401
+    assert not migration_server.jobs
+    assert not migration_server._pool.jobs
+
+
+def test_jobs_posted_as_json(migration_server, tmp_path):
+    headers = {_SERVER_TOKEN_HEADER: "secret"}
+    assert _request(migration_server, "GET", "/jobs", headers=headers) == (200, [])
+    body = json.dumps({"directory": str(tmp_path), "init_version_name": "16.0"})
+
+    # A web page can post a form without CORS preflight
+    status, __ = _request(
+        migration_server,
+        "POST",
+        "/jobs",
+        body,
+        dict(headers, **{"Content-Type": "application/x-www-form-urlencoded"}),
+    )
+    assert status == 415
+
+    headers["Content-Type"] = "application/json"
+    status, data = _request(migration_server, "POST", "/jobs", "{", headers)
+    assert (status, data) == (400, {"error": "Invalid JSON"})
+    status, data = _request(migration_server, "POST", "/jobs", "{}", headers)
+    assert (status, data) == (400, {"error": "The option 'directory' is required"})
+    assert not migration_server._pool.jobs
+
+    status, data = _request(migration_server, "POST", "/jobs", body, headers)
+    assert status == 201
+    assert data["state"] == "queued"
+    assert [x[0] for x in migration_server._pool.jobs] == [data["id"]]
+    assert migration_server._pool.jobs[0][1]["directory"] == str(tmp_path)
+    status, data = _request(
+        migration_server, "GET", "/jobs/%s" % data["id"], headers=headers
+    )
+    assert status == 200
+    assert data["options"]["init_version_name"] == "16.0"
@@ -0,0 +1,46 @@
+from odoo_module_upgrade import tools
+from odoo_module_upgrade.workspace import Workspace
+
+
+def test_may_contain(tmp_path):
+    file_path = tmp_path / "view.xml"
+    file_path.write_text('<field name="x" context="{}"/>\n')
+    assert tools._may_contain(str(file_path), ["context=", "active_id"])
+    assert not tools._may_contain(
+        str(file_path), ["context=", "active_id"], all_of=True
+    )
+    assert not tools._may_contain(str(file_path), ["active_id"])
+    assert tools._may_contain(str(file_path), ["context=", "name="], all_of=True)
+
+
+def test_may_contain_buffered(tmp_path):
+    file_path = tmp_path / "view.xml"
+    file_path.write_text('<field name="x" context="{}"/>\n')
+    with tools._use_workspace(Workspace(tmp_path)):
+        tools._write_content(str(file_path), "context=active_id\n")
+        assert tools._may_contain(
+            str(file_path), ["context=", "active_id"], all_of=True
+        )
+        assert not tools._may_contain(str(file_path), ["name="])
+
+
+def test_crlf_line_endings_kept(tmp_path):
+    file_path = tmp_path / "view.xml"
+    file_path.write_bytes(b"<odoo>\r\n  <data/>\r\n</odoo>\r\n")
+    content = tools._read_content(str(file_path))
+    assert content == "<odoo>\n  <data/>\n</odoo>\n"
+    tools._write_content(str(file_path), content.replace("data", "record"))
+    assert file_path.read_bytes() == b"<odoo>\r\n  <record/>\r\n</odoo>\r\n"
+
+
+def test_crlf_line_endings_kept_buffered(tmp_path):
+    file_path = tmp_path / "view.xml"
+    file_path.write_bytes(b"<odoo>\r\n  <data/>\r\n</odoo>\r\n")
+    workspace = Workspace(tmp_path)
+    with tools._use_workspace(workspace):
+        content = tools._read_content(str(file_path))
+        tools._write_content(str(file_path), content + "<!-- new -->\n")
+        workspace.flush()
+    assert file_path.read_bytes() == (
+        b"<odoo>\r\n  <data/>\r\n</odoo>\r\n<!-- new -->\r\n"
+    )
@@ -0,0 +1,104 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from odoo_module_upgrade import tools
+from odoo_module_upgrade.workspace import Workspace
+
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def _get_files(path):
+    return {
+        str(x.relative_to(path)): x.read_text()
+        for x in sorted(path.rglob("*"))
+        if x.is_file()
+    }
+
+
+def test_flush_renames_and_writes(tmp_path):
+    _write(tmp_path / "a.xml", "a\n")
+    _write(tmp_path / "b.xml", "b\n")
+    os.chmod(str(tmp_path / "a.xml"), 0o755)
+    workspace = Workspace(tmp_path)
+    with tools._use_workspace(workspace):
+        # b.xml takes the place of a.xml, renamed itself
+        tools._rename(str(tmp_path / "a.xml"), str(tmp_path / "c.xml"))
+        tools._rename(str(tmp_path / "b.xml"), str(tmp_path / "a.xml"))
+        tools._write_content(str(tmp_path / "c.xml"), "c\n")
+        assert _get_files(tmp_path) == {"a.xml": "a\n", "b.xml": "b\n"}
+        workspace.flush()
+    assert _get_files(tmp_path) == {"a.xml": "b\n", "c.xml": "c\n"}
+    assert os.access(str(tmp_path / "c.xml"), os.X_OK)
+
+
+def test_flush_refuses_rename_to_existing_file(tmp_path):
+    _write(tmp_path / "a.xml", "a\n")
+    _write(tmp_path / "b.xml", "b\n")
+    workspace = Workspace(tmp_path)
+    with tools._use_workspace(workspace):
+        tools._write_content(str(tmp_path / "b.xml"), "new b\n")
+        tools._rename(str(tmp_path / "a.xml"), str(tmp_path / "c.xml"))
+        # Not listed by the workspace, created by another process
+        _write(tmp_path / "c.xml", "c\n")
+        with pytest.raises(FileExistsError):
+            workspace.flush()
+    assert _get_files(tmp_path) == {"a.xml": "a\n", "b.xml": "b\n", "c.xml": "c\n"}
+
+
+def test_flush_failed_write_keeps_files(tmp_path):
+    _write(tmp_path / "a.xml", "a\n")
+    workspace = Workspace(tmp_path)
+    with tools._use_workspace(workspace):
+        tools._rename(str(tmp_path / "a.xml"), str(tmp_path / "b.xml"))
+        tools._write_content(str(tmp_path / "b.xml"), "b\n")
+        # Its folder doesn't exist: the content can not be staged
+        tools._write_content(str(tmp_path / "missing" / "c.xml"), "c\n")
+        with pytest.raises(OSError):
+            workspace.flush()
+    assert _get_files(tmp_path) == {"a.xml": "a\n"}
+
+
+def test_diff_applies_on_crlf_files(tmp_path):
+    module_path = tmp_path / "mod_a"
+    _write(module_path / "__manifest__.py", "{}\n")
+    (module_path / "views").mkdir()
+    (module_path / "views" / "a.xml").write_bytes(b"<odoo>\r\n  <a/>\r\n</odoo>\r\n")
+    # Mixed line endings: the changed file is written with '\r\n' ones
+    (module_path / "views" / "b.xml").write_bytes(b"<odoo>\r\n  <b/>\n</odoo>\r\n")
+    expected_path = tmp_path / "expected"
+    shutil.copytree(str(module_path), str(expected_path / "mod_a"))
+
+    def migrate(workspace, module_path):
+        with tools._use_workspace(workspace):
+            for name in ("a.xml", "b.xml"):
+                file_path = str(module_path / "views" / name)
+                content = tools._read_content(file_path)
+                tools._write_content(file_path, content.replace("<", "<new_"))
+
+    workspace = Workspace(module_path, virtual=True)
+    migrate(workspace, module_path)
+    patch = workspace.get_diff(str(tmp_path))
+    assert (module_path / "views" / "a.xml").read_bytes() == (
+        b"<odoo>\r\n  <a/>\r\n</odoo>\r\n"
+    )
+
+    workspace = Workspace(expected_path / "mod_a")
+    migrate(workspace, expected_path / "mod_a")
+    workspace.flush()
+
+    patch_path = tmp_path / "migration.patch"
+    patch_path.write_bytes(patch.encode("utf-8", "surrogateescape"))
+    subprocess.run(["git", "apply", str(patch_path)], cwd=str(tmp_path), check=True)
+    for name in ("a.xml", "b.xml"):
+        assert (module_path / "views" / name).read_bytes() == (
+            expected_path / "mod_a" / "views" / name
+        ).read_bytes()
+    assert (module_path / "views" / "b.xml").read_bytes() == (
+        b"<new_odoo>\r\n  <new_b/>\r\n<new_/odoo>\r\n"
+    )